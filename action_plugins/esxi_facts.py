@@ -0,0 +1,86 @@
+'''
+controller side of esxi_facts: caches gathered facts per host in json files
+- cache_ttl: seconds to keep facts (0: no caching, just run module)
+- cache_dir: where to keep them, "~/.ansible/esxi_facts_cache" by default
+- refresh: ignore cached facts and gather them again
+- invalidate: just remove cached facts for host, do not contact it
+
+cache entry is valid only for same module args (gather groups, advanced options)
+'''
+
+import json
+import os
+import tempfile
+import time
+
+from ansible.plugins.action import ActionBase
+
+CACHE_PARAMS = ['cache_ttl', 'cache_dir', 'refresh', 'invalidate']
+DEFAULT_CACHE_DIR = '~/.ansible/esxi_facts_cache'
+TRUE_VALUES = ('true', 'yes', 'on', '1')
+
+
+def cache_path(cache_dir, host):
+    return os.path.join(os.path.expanduser(cache_dir), '%s.json' % host)
+
+
+def read_cache(path, module_args, ttl):
+    ''' cached facts if fresh and gathered with same args, else None '''
+    try:
+        with open(path) as cfile:
+            entry = json.load(cfile)
+    except (IOError, OSError, ValueError):
+        return None
+    if entry.get('args') != module_args or time.time() - entry.get('time', 0) > ttl:
+        return None
+    return entry
+
+
+def write_cache(path, module_args, facts):
+    ''' atomically replace cache entry; cache errors are not fatal '''
+    try:
+        cache_dir = os.path.dirname(path)
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        (fd, tmp_name) = tempfile.mkstemp(dir=cache_dir)
+        with os.fdopen(fd, 'w') as cfile:
+            json.dump({'time': time.time(), 'args': module_args, 'facts': facts}, cfile)
+        os.rename(tmp_name, path)
+    except (IOError, OSError):
+        pass
+
+
+class ActionModule(ActionBase):
+
+    def run(self, tmp=None, task_vars=None):
+        if task_vars is None:
+            task_vars = dict()
+        result = super(ActionModule, self).run(tmp, task_vars)
+
+        module_args = dict(self._task.args)
+        cache_ttl = int(module_args.pop('cache_ttl', 0) or 0)
+        cache_dir = module_args.pop('cache_dir', None) or DEFAULT_CACHE_DIR
+        refresh = str(module_args.pop('refresh', False)).lower() in TRUE_VALUES
+        invalidate = str(module_args.pop('invalidate', False)).lower() in TRUE_VALUES
+        path = cache_path(cache_dir, task_vars.get('inventory_hostname', 'localhost'))
+
+        if invalidate:
+            if os.path.exists(path):
+                os.remove(path)
+            result.update(changed=False, msg="esxi facts cache invalidated")
+            return result
+
+        if cache_ttl > 0 and not refresh:
+            entry = read_cache(path, module_args, cache_ttl)
+            if entry is not None:
+                result.update(changed=False, cached=True,
+                              cache_age=int(time.time() - entry['time']),
+                              ansible_facts={'esxi_facts': entry['facts']})
+                return result
+
+        result.update(self._execute_module(module_name='esxi_facts', module_args=module_args,
+                                           tmp=tmp, task_vars=task_vars))
+        if cache_ttl > 0 and not result.get('failed') and 'ansible_facts' in result:
+            write_cache(path, module_args, result['ansible_facts']['esxi_facts'])
+        result['cached'] = False
+        return result
@@ -0,0 +1,130 @@
+from ansible import errors
+try:
+    from collections.abc import Mapping
+except ImportError:
+    from collections import Mapping
+
+# column-oriented storage for big tables (like "esxcfg-mpath -L" with thousands of paths):
+# instead of dict per row (with its own hash table), values are kept in one list per
+# column plus "key -> row index" map
+#
+#   devinfo_by_path: "{{ dev_list_res.stdout | parse_table([...]) | compact_table('path') }}"
+#   ... devinfo_by_path[item].dev ...
+#
+# rows are read-only views with the same lookups as dicts (row.dev, row['dev']);
+# repeated values (like "vmhba2" or "active") are stored once
+#
+# when result is stored as fact w/o native jinja types, it is converted to plain
+# compact form {"columns": [...], "keys": [...], "data": [[column values], ...]};
+# wrap it with "table_view" to get lookups back: (devinfo_by_path | table_view)[item].dev
+
+
+class CompactRow(Mapping):
+    ''' read-only row view: values are in table columns '''
+    __slots__ = ('_table', '_idx')
+
+    def __init__(self, table, idx):
+        self._table = table
+        self._idx = idx
+
+    def __getitem__(self, name):
+        return self._table._data[self._table._col_idx[name]][self._idx]
+
+    def __getattr__(self, name):
+        # copy and pickle look for special names on row w/o slots set yet:
+        # "self._table" would call __getattr__ again
+        if name.startswith('_'):
+            raise AttributeError(name)
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(name)
+
+    def __iter__(self):
+        return iter(self._table._columns)
+
+    def __len__(self):
+        return len(self._table._columns)
+
+    def __repr__(self):
+        return repr(dict(self))
+
+    def __reduce__(self):
+        return (CompactRow, (self._table, self._idx))
+
+
+class CompactTable(Mapping):
+    ''' read-only "key -> row" mapping over column lists '''
+
+    def __init__(self, columns, keys, data):
+        self._columns = list(columns)
+        self._col_idx = dict((name, idx) for (idx, name) in enumerate(self._columns))
+        self._keys = list(keys)
+        self._index = dict((key, idx) for (idx, key) in enumerate(self._keys))
+        self._data = data
+
+    def __getitem__(self, key):
+        return CompactRow(self, self._index[key])
+
+    def __iter__(self):
+        return iter(self._keys)
+
+    def __len__(self):
+        return len(self._keys)
+
+    def to_plain(self):
+        return {'columns': self._columns, 'keys': self._keys, 'data': self._data}
+
+    def __repr__(self):
+        # keeps compact form if converted to string and evaluated back
+        return repr(self.to_plain())
+
+
+def compact_table(records, key):
+    """ convert list (or dict) of records to compact "key -> row" table """
+    if isinstance(records, Mapping):
+        records = records.values()
+    columns = []
+    col_idx = dict()
+    data = []
+    keys = []
+    # one object per distinct value
+    seen = dict()
+    try:
+        for (row_idx, rec) in enumerate(records):
+            for name in rec:
+                if name not in col_idx:
+                    col_idx[name] = len(columns)
+                    columns.append(name)
+                    data.append([None] * row_idx)
+            for (name, column) in zip(columns, data):
+                value = rec.get(name)
+                try:
+                    # keyed with type: True == 1, but they are different values
+                    value = seen.setdefault((type(value), value), value)
+                except TypeError:
+                    # unhashable values are kept as is
+                    pass
+                column.append(value)
+            keys.append(rec[key])
+    except (KeyError, AttributeError, TypeError) as e:
+        raise errors.AnsibleFilterError('compact_table: bad record: %s' % str(e))
+    return CompactTable(columns, keys, data)
+
+
+def table_view(table):
+    """ lookups over compact table stored as plain data (pass-through for others) """
+    if isinstance(table, CompactTable):
+        return table
+    if isinstance(table, Mapping) and set(table) == set(['columns', 'keys', 'data']):
+        return CompactTable(table['columns'], table['keys'], table['data'])
+    return table
+
+
+class FilterModule(object):
+    ''' Filters to keep big tables in column-oriented form '''
+    def filters(self):
+        return {
+            'compact_table': compact_table,
+            'table_view': table_view,
+        }
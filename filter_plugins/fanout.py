@@ -0,0 +1,72 @@
+from ansible import errors
+try:
+    from collections.abc import Mapping
+except ImportError:
+    from collections import Mapping
+
+# distribution plan for big file (like offline bundle) over many hosts: hosts that
+# already have it are sources, and every source feeds at most "limit" hosts at once;
+# hosts that got it in one wave are sources in the next one, so number of copies
+# grows (limit + 1) times every wave
+#
+#   bundle_plan: "{{ ansible_play_hosts | fanout_plan(hostvars, 3, 'bundle_path') }}"
+#
+# result is {host: {"wave": n, "src": source host}} for hosts that need the file;
+# if nobody has it yet, first "seeds" hosts get it from origin (like http server) in
+# wave 0, with "src" set to None; waves are numbered from 1 otherwise
+#
+# "have" is a list of hosts with the file, or hostvars with "fact" set (non-empty)
+# for them; receivers are spread over sources evenly, sources that had the file from
+# the start are used first
+
+
+def has_fact(hostvars, host, fact):
+    try:
+        return bool(hostvars[host][fact])
+    except (KeyError, TypeError, errors.AnsibleError):
+        return False
+
+
+def fanout_plan(hosts, have, limit=2, fact=None, seeds=1):
+    """ {host: {"wave": n, "src": host or None}} for hosts w/o file """
+    limit = int(limit)
+    seeds = int(seeds)
+    if limit < 1 or seeds < 1:
+        raise errors.AnsibleFilterError('fanout_plan: limit and seeds must be positive')
+    if isinstance(have, Mapping):
+        if fact is None:
+            raise errors.AnsibleFilterError('fanout_plan: fact is required with hostvars')
+        ready = [host for host in hosts if has_fact(have, host, fact)]
+    else:
+        ready = [host for host in hosts if host in have]
+    waiting = [host for host in hosts if host not in ready]
+    plan = {}
+    wave = 1
+    if not ready and waiting:
+        for host in waiting[:seeds]:
+            plan[host] = {'wave': 0, 'src': None}
+        ready = waiting[:seeds]
+        waiting = waiting[seeds:]
+    while waiting:
+        # round-robin: with few receivers every source gets at most one
+        batch = waiting[:len(ready) * limit]
+        for (num, host) in enumerate(batch):
+            plan[host] = {'wave': wave, 'src': ready[num % len(ready)]}
+        ready = ready + batch
+        waiting = waiting[len(batch):]
+        wave += 1
+    return plan
+
+
+def fanout_waves(plan):
+    """ number of the last wave in plan, -1 for empty one """
+    return max([item['wave'] for item in plan.values()] or [-1])
+
+
+class FilterModule(object):
+    ''' Filters to plan host-to-host distribution of a file in waves '''
+    def filters(self):
+        return {
+            'fanout_plan': fanout_plan,
+            'fanout_waves': fanout_waves,
+        }
@@ -0,0 +1,119 @@
+from ansible import errors
+import itertools
+import re
+
+try:
+    string_types = basestring
+except NameError:
+    string_types = str
+
+# parse tabular command output in one pass, instead of
+#   stdout_lines | map('split', None, 2) | map('record', [...]) | to_dict('name')
+# use
+#   stdout | parse_table(['name', 'address', 'rest'], key='name')
+#
+# column spec:
+# - None (default): split by whitespace into len(columns) fields (last one gets the rest)
+# - int: split by whitespace at most that many times
+# - regexp string: fields are regexp groups (named groups are used as column names),
+#   lines that do not match are skipped
+# - 'header': fixed-width columns with offsets from header line (or from "---- ----"
+#   ruler under it), like awk -F'  +'; column names are taken from header
+#   (lowercase, "IPv4 Address" -> "ipv4_address") unless set in "columns"
+#
+# blank lines and rulers ("---- ----") are always skipped, "skip" drops that many
+# leading lines (like header), "skip_re" drops matching lines
+#
+# result is dict keyed by "key" column (or just "key -> value column" with "value"),
+# or list of records if "key" is not set
+
+RULER_RE = re.compile(r'^[\s-]*-[\s-]*$')
+HEADER_COL_RE = re.compile(r'\S+(?: \S+)*')
+RULER_COL_RE = re.compile(r'-+')
+NAME_RE = re.compile(r'\W+')
+
+
+def header_columns(header, ruler=None):
+    ''' (offsets, names) of fixed-width columns from header (and ruler) line '''
+    col_re, src = (RULER_COL_RE, ruler) if ruler else (HEADER_COL_RE, header)
+    offsets = [match.start() for match in col_re.finditer(src)]
+    ends = offsets[1:] + [None]
+    names = [NAME_RE.sub('_', header[start:end].strip().lower()).strip('_')
+             for (start, end) in zip(offsets, ends)]
+    return offsets, names
+
+
+def split_fixed(line, offsets):
+    ''' fields of fixed-width line '''
+    ends = offsets[1:] + [None]
+    return [line[start:end].strip() for (start, end) in zip(offsets, ends)]
+
+
+def iter_rows(lines, columns, spec, skip_re):
+    ''' generator of records (dicts) from table lines '''
+    if spec == 'header':
+        header = next(lines, None)
+        if header is None:
+            return
+        ruler = next(lines, None)
+        if ruler is not None and not RULER_RE.match(ruler):
+            lines = itertools.chain([ruler], lines)
+            ruler = None
+        offsets, names = header_columns(header, ruler)
+        if columns:
+            names = list(columns) + names[len(columns):]
+        for line in lines:
+            if line.strip() and not RULER_RE.match(line) and not (skip_re and skip_re.match(line)):
+                yield dict(zip(names, split_fixed(line, offsets)))
+    elif isinstance(spec, string_types):
+        row_re = re.compile(spec)
+        names = columns or [name for (name, _) in
+                            sorted(row_re.groupindex.items(), key=lambda item: item[1])]
+        for line in lines:
+            if skip_re and skip_re.match(line):
+                continue
+            match = row_re.match(line)
+            if match is None:
+                continue
+            if row_re.groupindex and not columns:
+                yield match.groupdict()
+            else:
+                yield dict(zip(names, match.groups()))
+    else:
+        maxsplit = len(columns) - 1 if spec is None else spec
+        for line in lines:
+            fields = line.split(None, maxsplit)
+            # ruler check only for lines that could be one: this loop is per line
+            if not fields or (fields[0][0] == '-' and RULER_RE.match(line)) or \
+                    (skip_re and skip_re.match(line)):
+                continue
+            if len(fields) != len(columns):
+                raise errors.AnsibleFilterError('parse_table: expected %d fields, got %d in "%s"' %
+                                                (len(columns), len(fields), line))
+            yield dict(zip(columns, fields))
+
+
+def parse_table(text, columns=None, spec=None, key=None, value=None, skip=0, skip_re=None):
+    """ parse command output (string or list of lines) into dict or list of records """
+    if spec != 'header' and not columns and not isinstance(spec, string_types):
+        raise errors.AnsibleFilterError('parse_table: columns are required for "split" spec')
+    try:
+        lines = iter(text if isinstance(text, (list, tuple)) else text.splitlines())
+        for _ in range(skip):
+            next(lines, None)
+        rows = iter_rows(lines, columns, spec, re.compile(skip_re) if skip_re else None)
+        if key is None:
+            return list(rows)
+        if value is None:
+            return dict((row[key], row) for row in rows)
+        return dict((row[key], row[value]) for row in rows)
+    except (re.error, KeyError) as e:
+        raise errors.AnsibleFilterError('parse_table: %s' % str(e))
+
+
+class FilterModule(object):
+    ''' A filter to parse tabular command output in one pass '''
+    def filters(self):
+        return {
+            'parse_table': parse_table
+        }
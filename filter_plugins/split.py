@@ -6,13 +6,13 @@ import re
 def split_string(string, separator=None, maxsplit=-1):
     try:
         return string.split(separator, maxsplit)
-    except Exception, e:
+    except Exception as e:
         raise errors.AnsibleFilterError('split plugin error: %s, provided string: "%s"' % (str(e),str(string)) )
 
-def split_regex(string, separator_pattern='\s+'):
+def split_regex(string, separator_pattern=r'\s+'):
     try:
         return re.split(separator_pattern, string)
-    except Exception, e:
+    except Exception as e:
         raise errors.AnsibleFilterError('split plugin error: %s, provided string: "%s"' % (str(e),str(string)) )
 
 class FilterModule(object):
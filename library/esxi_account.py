@@ -0,0 +1,169 @@
+#!/usr/bin/python
+'''
+source ~/tmp/ansible/hacking/env-setup
+export PATH=$PATH:~/tmp/ansible/hacking/
+test-module -m esxi_account.py -a '{"users": {"alex": {"desc": "Alexey"}}, "exclusive": false}'
+
+export ANSIBLE_CONFIG=~/works/sysadm/ansible-study/esxi-mgmt/ansible.esxi.cfg
+ansible -m esxi_account -a '{"users": {"alex": {"desc": "Alexey"}}, "exclusive": false}' --check nest1-m8
+'''
+
+from ansible.module_utils.basic import AnsibleModule
+from ansible.module_utils.esxi_esxcli import run_esxcli, to_bool
+
+ANSIBLE_METADATA = {'status': ['preview'],
+                    'supported_by': 'committer',
+                    'version': '0.1'}
+
+DOCUMENTATION = '''
+---
+module: esxi_account
+short_description: manage local user accounts and their permissions on ESXi host
+version_added: "2.2"
+description:
+    - 'Reconciles local accounts with desired list in one run: accounts and
+       permissions are listed once, then missed users are created, descriptions
+       and permissions are fixed and extra users are removed.'
+    - 'Per-user results are returned in C(users) dict keyed by name, with C(actions)
+       (list of C(add), C(set_desc), C(set_role), C(unset_role), C(remove)) and
+       C(changed); names of created users are in C(added).'
+options:
+    users:
+        description: 'Desired users as dict "name -> {desc, role}", like
+            C(esxi_local_users) in role vars (other keys like C(pubkeys) are ignored)'
+        required: true
+    role:
+        description: 'Role for users w/o explicit C(role)'
+        default: "Admin"
+    passwords:
+        description: 'Initial passwords as dict "name -> password" (generated on controller);
+            required only for users that are to be created, not changed for existing ones'
+        default: {}
+    exclusive:
+        description: 'Remove users not in C(users) (except C(protected) ones)'
+        default: True
+    protected:
+        description: 'System users never touched by module'
+        default: ["root", "dcui", "vpxuser"]
+author: alex@maxidom.ru
+notes:
+    - works w/o vcenter via C(ssh)
+    - supports check mode and diff (passwords are never shown)
+requirements: []
+'''
+
+EXAMPLES = '''
+- name: manage local users
+  esxi_account:
+    users: "{{ esxi_local_users }}"
+    passwords: "{{ new_user_passwords }}"
+    protected: "{{ esxi_system_users }}"
+  register: accounts_res
+'''
+
+
+def get_accounts(module):
+    ''' current users: name -> description '''
+    _, recs, _, _ = run_esxcli(module, 'system account list', formatter='csv',
+                               fail_msg="unable to list accounts")
+    return dict((rec['UserID'], rec.get('Description', '')) for rec in recs)
+
+
+def get_permissions(module):
+    ''' current user (not group) permissions: principal -> role '''
+    _, recs, _, _ = run_esxcli(module, 'system permission list', formatter='csv',
+                               types={'IsGroup': to_bool}, fail_msg="unable to list permissions")
+    return dict((rec['Principal'], rec.get('Role')) for rec in recs if not rec.get('IsGroup'))
+
+
+def plan_changes(accounts, perms, wanted, role_def, exclusive, protected):
+    '''
+    list of (name, action, argv); removals go first, users are created before
+    their permissions are set
+    '''
+    changes = []
+    if exclusive:
+        for name in sorted(accounts):
+            if name in wanted or name in protected:
+                continue
+            if name in perms:
+                changes.append((name, 'unset_role',
+                                ['esxcli', 'system', 'permission', 'unset', '--id=%s' % name]))
+            changes.append((name, 'remove',
+                            ['esxcli', 'system', 'account', 'remove', '--id=%s' % name]))
+    for name in sorted(wanted):
+        if name in protected:
+            continue
+        user = wanted[name] or {}
+        desc = user.get('desc') or ''
+        role = user.get('role') or role_def
+        if name not in accounts:
+            # passwords are added right before run, see main()
+            changes.append((name, 'add', ['esxcli', 'system', 'account', 'add', '--id=%s' % name,
+                                          '--description=%s' % desc]))
+        elif accounts[name] != desc:
+            changes.append((name, 'set_desc', ['esxcli', 'system', 'account', 'set',
+                                               '--id=%s' % name, '--description=%s' % desc]))
+        if perms.get(name) != role:
+            changes.append((name, 'set_role', ['esxcli', 'system', 'permission', 'set',
+                                               '--id=%s' % name, '--role=%s' % role]))
+    return changes
+
+
+def main():
+    ''' entry point: list accounts and permissions once, apply all differences '''
+    module = AnsibleModule(
+        argument_spec = dict(
+            users = dict(required=True, type='dict'),
+            role = dict(required=False, type='str', default='Admin'),
+            passwords = dict(required=False, type='dict', default={}, no_log=True),
+            exclusive = dict(required=False, type='bool', default=True),
+            protected = dict(required=False, type='list', default=['root', 'dcui', 'vpxuser']),
+        ),
+        supports_check_mode=True,
+    )
+    users = module.params['users']
+    passwords = module.params['passwords'] or {}
+    protected = set(module.params['protected'])
+    accounts = get_accounts(module)
+    perms = get_permissions(module)
+    changes = plan_changes(accounts, perms, users, module.params['role'],
+                           module.params['exclusive'], protected)
+
+    no_password = [name for (name, action, _) in changes
+                   if action == 'add' and not passwords.get(name)]
+    if no_password:
+        module.fail_json(msg="no initial password for new users: %s" % ', '.join(no_password))
+
+    results = dict((name, {'actions': [], 'changed': False})
+                   for name in set(accounts) | set(users) if name not in protected)
+    commands = []
+    for (name, action, argv) in changes:
+        # commands are reported w/o passwords
+        commands.append(' '.join(argv))
+        if action == 'add':
+            argv = argv + ['--password=%s' % passwords[name],
+                           '--password-confirmation=%s' % passwords[name]]
+        if not module.check_mode:
+            ret, out, err = module.run_command(argv)
+            if ret != 0:
+                module.fail_json(msg="unable to %s for user %s" % (action, name),
+                                 cmd=commands[-1], rc=ret, err=err, out=out, commands=commands)
+        results[name]['actions'].append(action)
+        results[name]['changed'] = True
+
+    added = sorted(name for (name, res) in results.items() if 'add' in res['actions'])
+    before = dict((name, {'desc': desc, 'role': perms.get(name)})
+                  for (name, desc) in accounts.items() if name not in protected)
+    after = dict((name, {'desc': (user or {}).get('desc') or '',
+                         'role': (user or {}).get('role') or module.params['role']})
+                 for (name, user) in users.items() if name not in protected)
+    if not module.params['exclusive']:
+        for (name, state) in before.items():
+            after.setdefault(name, state)
+    module.exit_json(changed=bool(commands), commands=commands, users=results, added=added,
+                     diff={'before': before, 'after': after})
+
+
+if __name__ == '__main__':
+    main()
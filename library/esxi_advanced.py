@@ -0,0 +1,122 @@
+#!/usr/bin/python
+'''
+source ~/tmp/ansible/hacking/env-setup
+export PATH=$PATH:~/tmp/ansible/hacking/
+test-module -m esxi_advanced.py -a '{"options": {"/Net/BlockGuestBPDU": 1}}'
+
+export ANSIBLE_CONFIG=~/works/sysadm/ansible-study/esxi-mgmt/ansible.esxi.cfg
+ansible -m esxi_advanced -a '{"options": {"/UserVars/ESXiShellInteractiveTimeOut": 3600}}' --check --diff nest1-m8
+'''
+
+from ansible.module_utils.basic import AnsibleModule
+from ansible.module_utils.esxi_esxcli import run_esxcli
+
+ANSIBLE_METADATA = {'status': ['preview'],
+                    'supported_by': 'committer',
+                    'version': '0.1'}
+
+DOCUMENTATION = '''
+---
+module: esxi_advanced
+short_description: set ESXi advanced options in one run
+version_added: "2.2"
+description:
+    - 'Reads current values of advanced options (one C(esxcli system settings advanced
+       list) for all of them if there are many, or one per option within same run if
+       there are few) and sets only those that differ.'
+    - 'Option type (integer or string) is taken from host; per-option results are
+       returned in C(options) dict keyed by path, with C(changed), C(old) and C(new).'
+options:
+    options:
+        description: 'Dict "option path -> value", like
+            C({"/Net/BlockGuestBPDU": 1, "/UserVars/ESXiShellInteractiveTimeOut": 3600})'
+        required: true
+author: alex@maxidom.ru
+notes:
+    - works w/o vcenter via C(ssh)
+    - supports check mode and diff
+requirements: []
+'''
+
+EXAMPLES = '''
+- name: set advanced options
+  esxi_advanced:
+    options:
+      /Net/BlockGuestBPDU: 1
+      /UserVars/ESXiShellInteractiveTimeOut: "{{ ssh_timeout }}"
+'''
+
+# with more options to check one full listing is faster than separate ones
+LIST_ALL_THRESHOLD = 8
+
+
+def get_options(module, paths):
+    ''' current options: path -> {type, value} (value is int or string) '''
+    if len(paths) > LIST_ALL_THRESHOLD:
+        _, recs, _, _ = run_esxcli(module, 'system settings advanced list', formatter='csv',
+                                   fail_msg="unable to list advanced options")
+    else:
+        recs = []
+        for path in paths:
+            ret, res, out, err = run_esxcli(module, "system settings advanced list -o '%s'" % path,
+                                            formatter='csv')
+            # missing options are reported later, all at once
+            if ret == 0:
+                recs.extend(res)
+    current = dict()
+    for rec in recs:
+        if rec.get('Type') == 'integer':
+            current[rec['Path']] = {'type': 'integer', 'value': int(rec.get('IntValue'))}
+        else:
+            current[rec['Path']] = {'type': 'string', 'value': rec.get('StringValue')}
+    return current
+
+
+def convert(module, path, opt_type, value):
+    ''' desired value converted to option type '''
+    if opt_type == 'integer':
+        try:
+            return int(value)
+        except (TypeError, ValueError):
+            module.fail_json(msg="option %s is integer, got %s" % (path, value))
+    return '' if value is None else str(value)
+
+
+def main():
+    ''' entry point: read current values once, set differing ones '''
+    module = AnsibleModule(
+        argument_spec = dict(
+            options = dict(required=True, type='dict'),
+        ),
+        supports_check_mode=True,
+    )
+    wanted = module.params['options']
+    current = get_options(module, sorted(wanted))
+    unknown = sorted(set(wanted) - set(current))
+    if unknown:
+        module.fail_json(msg="unknown advanced options: %s" % ', '.join(unknown))
+
+    results = dict()
+    commands = []
+    for path in sorted(wanted):
+        opt = current[path]
+        value = convert(module, path, opt['type'], wanted[path])
+        results[path] = {'changed': value != opt['value'], 'old': opt['value'], 'new': value}
+        if not results[path]['changed']:
+            continue
+        flag = '-i' if opt['type'] == 'integer' else '-s'
+        argv = ['esxcli', 'system', 'settings', 'advanced', 'set', '-o', path, flag, str(value)]
+        commands.append(' '.join(argv))
+        if not module.check_mode:
+            ret, out, err = module.run_command(argv)
+            if ret != 0:
+                module.fail_json(msg="unable to set option %s" % path, cmd=commands[-1],
+                                 rc=ret, err=err, out=out, commands=commands)
+
+    module.exit_json(changed=bool(commands), commands=commands, options=results,
+                     diff={'before': dict((path, res['old']) for (path, res) in results.items()),
+                           'after': dict((path, res['new']) for (path, res) in results.items())})
+
+
+if __name__ == '__main__':
+    main()
@@ -3,12 +3,16 @@
 source ~/tmp/ansible/hacking/env-setup
 export PATH=$PATH:~/tmp/ansible/hacking/
 test-module -m esxi_autostart.py -a 'name=eagle-m8 start=yes mock=yes'
+test-module -m esxi_autostart.py -a '{"vms": ["eagle-m8", "hawk-m8"], "mock": true}'
 
 export ANSIBLE_CONFIG=~/works/sysadm/ansible-study/esxi-mgmt/ansible.esxi.cfg
 ansible -m esxi_autostart -a 'name=eagle-m8' nest1-m8
 '''
 
 from ansible.module_utils.basic import AnsibleModule
+from ansible.module_utils.esxi_inventory import load_inventory, LOAD_ERRORS as INVENTORY_ERRORS
+from ansible.module_utils.esxi_startseq import start_sequence, is_started, plan_moves, apply_moves
+from ansible.module_utils.esxi_vimcmd import parse_autostart_seq
 import re
 
 ANSIBLE_METADATA = {'status': ['preview'],
@@ -24,11 +28,26 @@ description:
     - 'This module manages VM startup on ESXi with ssh and C("vim-cmd").'
     - 'It allows to enable or disable autostart for named VM and optionally specify
        startup order.'
+    - 'With C(vms) whole startup sequence is managed in one call: current state
+       is loaded once and only entries that differ are updated.'
 options:
     name:
-        description: 'Name of registered VM to manage'
-        required: true
+        description: 'Name of registered VM to manage (one of C(name) or C(vms) is required)'
+        required: false
         aliases: ["vm"]
+    vms:
+        description:
+            - 'Desired startup sequence: list of VM names or dicts with C(name) and
+              optional C(enabled) (default C(true)); enabled VMs are started in list order.'
+            - 'Could also be a dict "name -> {order, enabled}" like C(vms_to_autostart) in
+              role vars: VMs are sorted by (relative) C(order), VMs w/o order keep their
+              current place or are added after ordered ones.'
+            - 'Currently enabled VMs not in list are left after listed ones (or disabled
+              if C(exclusive) is set).'
+        required: false
+    exclusive:
+        description: 'With C(vms): disable autostart for all VMs not in list'
+        default: False
     enabled:
         description: 'Whether VM should be started at host starup'
         default: true
@@ -42,6 +61,11 @@ options:
         description: 'Skip bad/not-yet-registered VM names without error (by default, it is error).
             Better check them in host facts if available :)'
         default: False
+    vm_list_source:
+        description: 'Where to get VM list from: C(inventory) (hostd C(vmInventory.xml), cached
+            on host), C(vim-cmd) (C(vmsvc/getallvms)) or C(auto) (inventory, then vim-cmd)'
+        choices: ["auto", "inventory", "vim-cmd"]
+        default: "auto"
     state:
         description: 'Whether VM should be running now, default: do not change state'
         required: false
@@ -75,6 +99,16 @@ EXAMPLES = '''
   name: phoenix11
   enabled: false
 
+# whole startup sequence: eagle-m8, then hawk-m8, phoenix11 is not started,
+# other VMs are removed from autostart
+- esxi_autostart:
+  vms:
+    - eagle-m8
+    - hawk-m8
+    - name: phoenix11
+      enabled: false
+  exclusive: true
+
 '''
 
 # either cat mock files (for test) or run actual cmds (for real)
@@ -117,8 +151,20 @@ class VMStartMgr(object):
         self.vm_start_info = self.load_startup_list()
 
     def load_vm_list(self):
-        ''' construct map "vm_name -> vm_id" from file or program '''
+        '''
+        construct map "vm_name -> vm_id" from hostd inventory (cached) or
+        from "vim-cmd vmsvc/getallvms" (or its mock file)
+        '''
         vmlist = dict()
+        source = self.params['vm_list_source']
+        if source != 'vim-cmd' and not self.mock:
+            try:
+                for vm in load_inventory():
+                    vmlist[vm['name']] = vm['id']
+                return vmlist
+            except INVENTORY_ERRORS as e:
+                if source == 'inventory':
+                    self.module.fail_json(msg="unable to read vm inventory: %s" % e)
         ret, out, err = self.module.run_command(self.commands['get_vmlist'])
         if ret != 0:
             self.module.fail_json(msg="unable to get vm list", rc=ret, err=err)
@@ -143,29 +189,10 @@ class VMStartMgr(object):
                 - DirectUI fling sets startOrder = -1 to disable autostart
                 - lets use both to make sure :)
         '''
-        sinfo = dict()
-        vm_id = 0
-        # for line in file(STARTUP_FILE):
-        # or subprocess.Popen + res.stdout.readlines
-        # for line in os.popen("cat %s" % STARTUP_FILE).readlines():
         ret, out, err = self.module.run_command(self.commands['get_autoruns'])
         if ret != 0:
             self.module.fail_json(msg="unable go get startup list", rc=ret, err=err)
-        if out == '(vim.host.AutoStartManager.AutoPowerInfo) []':
-            return sinfo
-        for line in out.split('\n'):
-            if line.lstrip().startswith(('(', '}', ']')) or line == '':
-                continue
-            (key, _, val) = line.strip("', \n").strip().split()
-            if key == 'key':
-                # key = 'vim.VirtualMachine:3',
-                vm_id = int(val.split(":")[1])
-                sinfo[vm_id] = {}
-            elif key == 'startOrder':
-                sinfo[vm_id]['order'] = int(val)
-            elif key == 'startAction':
-                sinfo[vm_id]['action'] = val.strip('"')
-        return sinfo
+        return parse_autostart_seq(out)
 
     def update_vm(self):
         '''
@@ -247,6 +274,94 @@ class VMStartMgr(object):
                 ret_params['cmd_err'] = err
         return (changed, ret_msg, ret_params)
 
+    def load_vms_param(self):
+        '''
+        normalize "vms" param (list or dict) to list of (vm_name, enabled), enabled
+        ones in desired startup order; unknown VMs are skipped or fail
+        '''
+        vms = self.params['vms']
+        if isinstance(vms, dict):
+            cur_pos = dict((vm_id, pos) for (pos, vm_id) in enumerate(start_sequence(self.vm_start_info)))
+            def sort_key(item):
+                (vm_name, props) = item
+                props = props or {}
+                if props.get('order') is not None:
+                    return (0, int(props['order']), vm_name)
+                vm_id = self.vmname_to_id.get(vm_name)
+                if vm_id in cur_pos:
+                    return (1, cur_pos[vm_id], vm_name)
+                return (2, 0, vm_name)
+            items = [(vm_name, (props or {}).get('enabled', True))
+                     for (vm_name, props) in sorted(vms.items(), key=sort_key)]
+        else:
+            items = []
+            for item in vms:
+                if isinstance(item, dict):
+                    if 'name' not in item:
+                        self.module.fail_json(msg="vm entry without name: %s" % item)
+                    items.append((item['name'], item.get('enabled', True)))
+                else:
+                    items.append((item, True))
+        res = []
+        for (vm_name, enabled) in items:
+            if vm_name not in self.vmname_to_id:
+                if self.params['skip']:
+                    continue
+                self.module.fail_json(msg="no such vm here: %s" % vm_name, rc=-1)
+            res.append((vm_name, str(enabled).lower() in ('true', 'yes', 'on', '1')))
+        return res
+
+    def update_vms(self):
+        '''
+        Bring whole startup sequence to desired state
+        - state is loaded once (in constructor), diff is done in memory
+        - minimal set of updates is planned by esxi_startseq (VMs already in right
+          relative order stay in place, no VM is moved to the end of list)
+        - returns per-vm results with "changed", "old_pos" and "new_pos"
+        '''
+        vm_items = self.load_vms_param()
+        listed = set(vm_name for (vm_name, _) in vm_items)
+        target = [self.vmname_to_id[vm_name] for (vm_name, enabled) in vm_items if enabled]
+        to_disable = [self.vmname_to_id[vm_name] for (vm_name, enabled) in vm_items if not enabled]
+        if self.params['exclusive']:
+            name_by_id = dict((vm_id, vm_name) for (vm_name, vm_id) in self.vmname_to_id.items())
+            to_disable.extend(vm_id for vm_id in self.vm_start_info
+                              if name_by_id.get(vm_id) not in listed)
+
+        old_seq = start_sequence(self.vm_start_info)
+        updates = plan_moves(self.vm_start_info, target, to_disable)
+        commands = []
+        for (vm_id, order) in updates:
+            if order == -1:
+                commands.append(self.commands['disable_start'].format(vm_id = vm_id))
+            else:
+                commands.append(self.commands['mod_start'].format(vm_id = vm_id, order = order))
+
+        if not self.check_mode:
+            for command in commands:
+                ret, out, err = self.module.run_command(command)
+                if ret != 0:
+                    self.module.fail_json(msg="unable to perform changes",
+                                          cmd=command, rc=ret, err=err)
+
+        updated = set(vm_id for (vm_id, _) in updates)
+        new_pos = dict((vm_id, pos + 1) for (pos, vm_id) in
+                       enumerate(apply_moves(old_seq, updates)))
+        old_pos = dict((vm_id, pos + 1) for (pos, vm_id) in enumerate(old_seq))
+        vm_results = dict()
+        for (vm_name, enabled) in vm_items:
+            vm_id = self.vmname_to_id[vm_name]
+            vm_results[vm_name] = {'vm_id': vm_id,
+                                   'changed': vm_id in updated,
+                                   'old_pos': old_pos.get(vm_id, -1) if is_started(self.vm_start_info, vm_id) else -1,
+                                   'new_pos': new_pos.get(vm_id, -1)}
+        changed = len(commands) > 0
+        if changed:
+            ret_msg = "%d autostart entries updated" % len(commands)
+        else:
+            ret_msg = "already ok: startup sequence matches"
+        return (changed, ret_msg, {'vms': vm_results, 'commands': commands})
+
 
 def main():
     ''' entry point, simple one for now
@@ -254,20 +369,28 @@ def main():
     '''
     module = AnsibleModule(
         argument_spec = dict(
-            name = dict(aliases=['vm'], required=True),
+            name = dict(aliases=['vm'], required=False),
+            vms = dict(required=False, type='raw'),
+            exclusive = dict(required=False, type='bool', default=False),
             enabled = dict(aliases=['autostart'], required=False, type='bool', default=True),
             order = dict(required=False, type='int'),
             state = dict(required=False, type='str',
                        choices=["started", "stopped"]),
+            vm_list_source = dict(required=False, type='str', default='auto',
+                                  choices=['auto', 'inventory', 'vim-cmd']),
             mock = dict(required=False, type='bool', default=False),
             skip = dict(required=False, type='bool', default=False)
         ),
         supports_check_mode=True,
-        required_one_of=[['enabled', 'state']],
+        required_one_of=[['enabled', 'state'], ['name', 'vms']],
+        mutually_exclusive=[['name', 'vms']],
     )
     # module.debug('stated')
     mgr = VMStartMgr(module)
-    changed, msg, params = mgr.update_vm()
+    if module.params['vms'] is not None:
+        changed, msg, params = mgr.update_vms()
+    else:
+        changed, msg, params = mgr.update_vm()
     module.exit_json(changed=changed, msg=msg, **params)
 
 
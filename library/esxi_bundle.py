@@ -0,0 +1,277 @@
+#!/usr/bin/python
+'''
+source ~/tmp/ansible/hacking/env-setup
+export PATH=$PATH:~/tmp/ansible/hacking/
+test-module -m esxi_bundle.py -a '{"url": "http://www-distr.m1.maxidom.ru/suse_distr/iso/update-from-esxi6.5-6.5_update01.zip", "cache_dir": "/tmp/bundle_cache"}'
+
+export ANSIBLE_CONFIG=~/works/sysadm/ansible-study/esxi-mgmt/ansible.esxi.cfg
+ansible -m esxi_bundle -a 'name=update-from-esxi6.5-6.5_update01.zip src_host=10.1.1.10 src=/vmfs/volumes/nest1-sys/.bundle_cache/<sha256>/update-from-esxi6.5-6.5_update01.zip datastore=nest2-sys' -e 'ansible_ssh_extra_args=-A' nest2-m8
+
+local run w/o ESXi: datastores are plain dirs, http stand-in is any local server
+(like "python3 -m http.server" in dir with bundle; it has no range support, so
+broken download starts over with it)
+test-module -m esxi_bundle.py -a '{"url": "http://localhost:8000/bundle.zip", "datastore": "/tmp/ds1", "datastores": ["/tmp/ds1", "/tmp/ds2"]}'
+test-module -m esxi_bundle.py -a '{"name": "bundle.zip", "src": "/tmp/ds1/.bundle_cache/<sha256>/bundle.zip", "transport": "local", "datastore": "/tmp/ds3", "datastores": ["/tmp/ds3"]}'
+'''
+
+from ansible.module_utils.basic import AnsibleModule
+from ansible.module_utils.esxi_bundle import (CACHE_DIR, BundleCache, BundleError, Downloader,
+                                              cache_dirs, file_sha256, find, hash_file,
+                                              parse_checksum)
+from ansible.module_utils.esxi_template_cache import datastore_dirs
+from ansible.module_utils.esxi_transfer import Receiver, TransferError, sender_argv
+import os
+import time
+
+ANSIBLE_METADATA = {'status': ['preview'],
+                    'supported_by': 'committer',
+                    'version': '0.1'}
+
+DOCUMENTATION = '''
+---
+module: esxi_bundle
+short_description: keep offline bundle (depot zip) in checksum-keyed cache, get it once
+version_added: "2.2"
+description:
+    - 'Keeps offline bundles in C(.bundle_cache) dir of datastore (or in C(cache_dir),
+       like on controller) as C(<sha256>/<name>), so copy that is already on any
+       datastore mounted by host (including shared one, put there by another host) is
+       found and used instead of getting it again.'
+    - 'sha256 of cached copy is checked once and kept in hidden sidecar next to it;
+       copy that does not match is dropped.'
+    - 'Missing bundle is pulled from another host that has it (C(src_host), with
+       C(esxi_transfer) stream: resumable and checked by chunk), or downloaded from
+       C(url) with resumable ranged requests; if both are set, C(url) is a fallback.
+       New copy is moved into cache only after its sha256 is checked (against
+       C(checksum), if set).'
+options:
+    state:
+        description:
+            - 'C(present): make sure that verified copy is on some datastore of host
+               (or in C(cache_dir)), get it into cache on C(datastore) if it is not'
+            - 'C(find): just look for verified copy'
+            - 'C(absent): drop cached copies (with C(checksum), or all with this name)'
+        choices: [present, find, absent]
+        default: present
+    name:
+        description: 'Bundle file name, default is the last part of C(url) or C(src)'
+        required: false
+    checksum:
+        description: 'sha256 of bundle, as C(sha256:<hex>) or just C(<hex>); w/o it
+            any verified copy with this name is ok'
+        required: false
+    url:
+        description: 'URL to download bundle from'
+        required: false
+    src:
+        description: 'Bundle path on C(src_host), or on this host (w/o C(src_host):
+            like uploaded file, it is moved into cache)'
+        required: false
+    src_host:
+        description: 'Host to pull bundle from (name or IP, as seen from this host)'
+        required: false
+    src_user:
+        description: 'User for C(ssh) to source host'
+        default: root
+    transport:
+        description: 'C(ssh) to pull from C(src_host); C(local) to stream C(src) on
+            this host (for tests)'
+        choices: [ssh, local]
+        default: ssh
+    ssh_args:
+        description: 'Extra C(ssh) options'
+        default: ['-o', 'StrictHostKeyChecking=no', '-o', 'BatchMode=yes',
+                  '-o', 'ServerAliveInterval=15', '-o', 'ServerAliveCountMax=4']
+    python:
+        description: 'Python interpreter on source host'
+        default: python
+    datastore:
+        description: 'Datastore (name or path) to keep new copy on'
+        required: false
+    datastores:
+        description: 'Datastores (names or paths) to search, default is all mounted'
+        required: false
+    cache_dir:
+        description: 'Cache dir to use instead of datastore one (like on controller)'
+        required: false
+    timeout:
+        description: 'Timeout for HTTP connect and reads, seconds'
+        default: 30
+    retries:
+        description: 'How many times to resume broken download or stream in one run'
+        default: 3
+author: alex@maxidom.ru
+notes:
+    - works w/o vcenter via C(ssh)
+    - supports check mode
+requirements: []
+'''
+
+EXAMPLES = '''
+- name: get patch bundle into controller cache
+  esxi_bundle:
+    url: "{{ bundle_url }}"
+    cache_dir: "~/.ansible/esxi_bundle_cache"
+  delegate_to: localhost
+  run_once: true
+
+- name: get patch bundle from host that already has it, or from http server
+  esxi_bundle:
+    name: "{{ bundle }}"
+    checksum: "{{ hostvars[src_host].bundle_checksum }}"
+    src_host: "{{ hostvars[src_host].ansible_host | d(src_host) }}"
+    src: "{{ hostvars[src_host].bundle_path }}"
+    url: "{{ bundle_url }}"
+    datastore: nest1-sys
+  register: bundle_res
+'''
+
+
+def pull(params, partial):
+    ''' stream src from src_host (or locally) into partial file, returns stats '''
+    src = params['src']
+    src_id = '%s:%s' % (params['src_host'], src) if params['src_host'] else src
+    # zip is compressed already; destination of failed attempt is reused as delta
+    receiver = Receiver(sender_argv(params), src, partial, 8 * 1024 * 1024, level=0,
+                        retries=params['retries'], force=True, src_id=src_id,
+                        remote_shell=params['transport'] == 'ssh')
+    receiver.run()
+    return receiver.stats
+
+
+def main():
+    ''' entry point: find verified copy, or get it into cache '''
+    module = AnsibleModule(
+        argument_spec = dict(
+            state = dict(required=False, type='str', default='present',
+                         choices=['present', 'find', 'absent']),
+            name = dict(required=False, type='str'),
+            checksum = dict(required=False, type='str'),
+            url = dict(required=False, type='str'),
+            src = dict(required=False, type='str'),
+            src_host = dict(required=False, type='str'),
+            src_user = dict(required=False, type='str', default='root'),
+            transport = dict(required=False, type='str', default='ssh',
+                             choices=['ssh', 'local']),
+            ssh_args = dict(required=False, type='list',
+                            default=['-o', 'StrictHostKeyChecking=no', '-o', 'BatchMode=yes',
+                                     '-o', 'ServerAliveInterval=15',
+                                     '-o', 'ServerAliveCountMax=4']),
+            python = dict(required=False, type='str', default='python'),
+            datastore = dict(required=False, type='str'),
+            datastores = dict(required=False, type='list'),
+            cache_dir = dict(required=False, type='path'),
+            timeout = dict(required=False, type='int', default=30),
+            retries = dict(required=False, type='int', default=3),
+        ),
+        supports_check_mode=True,
+    )
+    params = module.params
+    state = params['state']
+    name = params['name'] or os.path.basename((params['url'] or params['src'] or '').rstrip('/'))
+    if not name or '/' in name or name.startswith('.'):
+        module.fail_json(msg="bad bundle name, set it with name: %s" % name)
+    try:
+        digest = parse_checksum(params['checksum'])
+    except BundleError as e:
+        module.fail_json(msg=str(e))
+    started = time.time()
+
+    # new copy goes there, it is searched first
+    target = None
+    if params['cache_dir']:
+        target = BundleCache(params['cache_dir'])
+    elif params['datastore']:
+        (ds_name, ds_path) = datastore_dirs([params['datastore']])[0]
+        if not os.path.isdir(ds_path):
+            module.fail_json(msg="datastore not found: %s" % ds_path)
+        target = BundleCache(os.path.join(ds_path, CACHE_DIR), ds_name)
+    caches = [target] if target else []
+    caches.extend(cache for cache in cache_dirs(datastore_dirs(params['datastores']))
+                  if not target or os.path.realpath(cache.path) != os.path.realpath(target.path))
+
+    if state == 'absent':
+        dropped = []
+        for cache in caches:
+            for key in cache.digests(name):
+                if digest is None or key == digest:
+                    dropped.append(cache.bundle_path(key, name))
+                    if not module.check_mode:
+                        cache.drop(key)
+            if os.path.exists(cache.partial_path(name)):
+                dropped.append(cache.partial_path(name))
+                if not module.check_mode:
+                    cache.drop_partial(name)
+        module.exit_json(changed=bool(dropped), dropped=dropped)
+
+    try:
+        found = find(name, digest, caches, check_mode=module.check_mode)
+    except BundleError as e:
+        module.fail_json(msg=str(e))
+    if found:
+        (cache, path, key) = found
+        module.exit_json(changed=False, found=True, name=name, path=path, checksum=key,
+                         datastore=cache.name, seconds=round(time.time() - started, 2))
+    if state == 'find':
+        module.exit_json(changed=False, found=False, name=name)
+
+    # present
+    if target is None:
+        module.fail_json(msg="datastore or cache_dir is required to keep new copy")
+    sources = []
+    if params['src'] and (params['src_host'] or params['transport'] == 'local'):
+        sources.append('host')
+    elif params['src']:
+        sources.append('file')
+    if params['url']:
+        sources.append('url')
+    if not sources:
+        module.fail_json(msg="bundle %s not found, set url or src to get it" % name)
+    partial = target.partial_path(name)
+    result = dict(found=False, name=name, datastore=target.name)
+    if module.check_mode:
+        module.exit_json(changed=True, source=sources[0], **result)
+
+    errors = []
+    for source in sources:
+        try:
+            if not os.path.isdir(os.path.dirname(partial)):
+                os.makedirs(os.path.dirname(partial))
+            if source == 'host':
+                result.update(pull(params, partial))
+                actual = hash_file(partial).hexdigest()
+            elif source == 'file':
+                partial = params['src']
+                actual = file_sha256(partial, save=False)
+            else:
+                downloader = Downloader(params['url'], partial, timeout=params['timeout'],
+                                        retries=params['retries'])
+                actual = downloader.run()
+                result.update(downloader.stats)
+        except (BundleError, TransferError, IOError, OSError) as e:
+            errors.append('%s: %s' % (source, e))
+            continue
+        if digest is not None and actual != digest:
+            errors.append('%s: checksum mismatch, got %s' % (source, actual))
+            if source != 'file':
+                target.drop_partial(name)
+            continue
+        try:
+            path = target.store(partial, name, actual)
+            if source != 'file':
+                target.drop_partial(name)
+        except (IOError, OSError) as e:
+            module.fail_json(msg="unable to store %s in %s: %s" % (partial, target.path, e),
+                             **result)
+        seconds = round(time.time() - started, 2)
+        size = os.path.getsize(path)
+        result.update(changed=True, path=path, checksum=actual, source=source, size=size,
+                      seconds=seconds, errors=errors)
+        if seconds and source != 'file':
+            result['rate_mb'] = round(size / 1024.0 / 1024.0 / seconds, 1)
+        module.exit_json(**result)
+    module.fail_json(msg="unable to get bundle %s: %s" % (name, '; '.join(errors)), **result)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,223 @@
+#!/usr/bin/python
+'''
+source ~/tmp/ansible/hacking/env-setup
+export PATH=$PATH:~/tmp/ansible/hacking/
+test-module -m esxi_datastore.py -a '{"datastores": {"vmhba0:C0:T0:L1": "nest-test-sys"}}'
+
+export ANSIBLE_CONFIG=~/works/sysadm/ansible-study/esxi-mgmt/ansible.esxi.cfg
+ansible -m esxi_datastore -a '{"datastores": {"vmhba0:C0:T0:L1": "nest1-sys"}}' --check nest1-m8
+'''
+
+from ansible.module_utils.basic import AnsibleModule
+from ansible.module_utils.esxi_esxcli import run_esxcli
+import os
+
+ANSIBLE_METADATA = {'status': ['preview'],
+                    'supported_by': 'committer',
+                    'version': '0.1'}
+
+DOCUMENTATION = '''
+---
+module: esxi_datastore
+short_description: create and rename local VMFS datastores on ESXi host
+version_added: "2.2"
+description:
+    - 'Brings local datastores to desired state in one run: device paths and VMFS
+       extents are listed once, then datastores with wrong names are renamed (if
+       empty) and vacant LUNs are labeled, partitioned and formatted.'
+    - 'Per-datastore results are returned in C(datastores) dict keyed by device path,
+       with C(device), C(old_name), C(name), C(action) (C(rename), C(create) or none)
+       and C(changed).'
+options:
+    datastores:
+        description: 'Desired datastores as dict "device path -> name", like
+            C(local_datastores) in role vars (C({"vmhba0:C0:T0:L1": "nest-test-sys"}))'
+        required: true
+    rename:
+        description: 'Rename existing datastores with wrong names (only empty ones: module
+            fails w/o changing anything if some of them are not)'
+        default: True
+    create:
+        description: 'Create datastores on vacant LUNs (with empty partition table)'
+        default: True
+    vmfs_version:
+        description: 'Filesystem type for C(vmkfstools -C)'
+        default: "vmfs5"
+    block_size:
+        description: 'Filesystem block size for C(vmkfstools -C)'
+        default: "1m"
+    partition_guid:
+        description: 'GPT partition type for VMFS partition'
+        default: "AA31E02A400F11DB9590000C2911D1B8"
+author: alex@maxidom.ru
+notes:
+    - works w/o vcenter via C(ssh)
+    - 'datastore is empty if it has no entries except hidden VMFS metadata (C(.sf)
+       files and the like); only the first entry is read, so check is fast on big
+       volumes too'
+    - 'supports check mode: planned commands are reported, with C({last}) in place
+       of last usable sector (it is known only after new partition table is written)'
+requirements: []
+'''
+
+EXAMPLES = '''
+- name: create and rename local datastores
+  esxi_datastore:
+    datastores: "{{ local_datastores }}"
+    rename: "{{ rename_datastores }}"
+    create: "{{ create_datastores }}"
+'''
+
+VOLUMES_DIR = '/vmfs/volumes'
+DISKS_DIR = '/dev/disks'
+
+
+def get_devices_by_path(module):
+    ''' map "runtime path (like vmhba0:C0:T0:L1) -> device (like naa.NNN)" '''
+    _, recs, _, _ = run_esxcli(module, 'storage core path list', formatter='csv',
+                               fail_msg="unable to list device paths")
+    return dict((rec['RuntimeName'], rec['Device']) for rec in recs if rec.get('RuntimeName'))
+
+
+def get_volumes_by_device(module):
+    ''' map "device -> {name, partition}" for VMFS extents (1st extent of each volume) '''
+    _, recs, _, _ = run_esxcli(module, 'storage vmfs extent list', formatter='csv',
+                               types={'ExtentNumber': int, 'Partition': int},
+                               fail_msg="unable to list vmfs extents")
+    volumes = dict()
+    for rec in recs:
+        if rec.get('DeviceName') and rec.get('ExtentNumber', 0) == 0:
+            volumes[rec['DeviceName']] = {'name': rec['VolumeName'], 'partition': rec['Partition']}
+    return volumes
+
+
+def first_visible_entry(path):
+    ''' name of first non-hidden entry in directory, None if there is none '''
+    scandir = getattr(os, 'scandir', None)
+    if scandir is not None:
+        names = (entry.name for entry in scandir(path))
+    else:
+        # python 2: no scandir, have to read whole listing
+        names = os.listdir(path)
+    for name in names:
+        if not name.startswith('.'):
+            return name
+    return None
+
+
+def is_empty_ptbl(module, device):
+    ''' "partedUtil getptbl" has only label and geometry lines for empty disk '''
+    cmd = "partedUtil getptbl %s/%s" % (DISKS_DIR, device)
+    ret, out, err = module.run_command(cmd)
+    if ret != 0:
+        # like "unknown partition table": no label at all
+        return 'unknown partition table' in (out + err).lower()
+    return len([line for line in out.splitlines() if line.strip()]) <= 2
+
+
+def create_commands(module, device, name):
+    ''' commands to label, partition and format vacant LUN '''
+    params = module.params
+    disk = "%s/%s" % (DISKS_DIR, device)
+    return [
+        "partedUtil mklabel %s gpt" % disk,
+        # last usable sector is filled in just before run
+        "partedUtil setptbl %s gpt \"1 128 {last} %s 0\"" % (disk, params['partition_guid']),
+        "vmkfstools -C %s -b %s -S '%s' %s:1" % (params['vmfs_version'], params['block_size'],
+                                                  name, disk),
+    ]
+
+
+def get_last_sector(module, device):
+    ''' last usable sector (2nd field of "partedUtil getUsableSectors") '''
+    cmd = "partedUtil getUsableSectors %s/%s" % (DISKS_DIR, device)
+    ret, out, err = module.run_command(cmd)
+    fields = out.split()
+    if ret != 0 or len(fields) < 2:
+        module.fail_json(msg="unable to get usable sectors for %s" % device,
+                         cmd=cmd, rc=ret, err=err, out=out)
+    return fields[1]
+
+
+def main():
+    ''' entry point: build device index once, rename and create datastores '''
+    module = AnsibleModule(
+        argument_spec = dict(
+            datastores = dict(required=True, type='dict'),
+            rename = dict(required=False, type='bool', default=True),
+            create = dict(required=False, type='bool', default=True),
+            vmfs_version = dict(required=False, type='str', default='vmfs5'),
+            block_size = dict(required=False, type='str', default='1m'),
+            partition_guid = dict(required=False, type='str',
+                                  default='AA31E02A400F11DB9590000C2911D1B8'),
+        ),
+        supports_check_mode=True,
+    )
+    datastores = module.params['datastores']
+    dev_by_path = get_devices_by_path(module)
+    vol_by_dev = get_volumes_by_device(module)
+
+    unknown = sorted(path for path in datastores if path not in dev_by_path)
+    if unknown:
+        module.fail_json(msg="unknown device paths: %s" % ', '.join(unknown))
+
+    # plan everything (and check preconditions) before changing anything
+    results = dict()
+    plan = []
+    not_empty = []
+    not_vacant = []
+    for path in sorted(datastores):
+        device = dev_by_path[path]
+        name = datastores[path]
+        volume = vol_by_dev.get(device)
+        res = {'device': device, 'old_name': volume['name'] if volume else None,
+               'name': name, 'action': None, 'changed': False}
+        results[path] = res
+        if volume is not None:
+            if volume['name'] == name or not module.params['rename']:
+                continue
+            try:
+                busy = first_visible_entry(os.path.join(VOLUMES_DIR, volume['name']))
+            except OSError as e:
+                busy = "unreadable: %s" % e.strerror
+            if busy is not None:
+                not_empty.append("%s (%s: has %s)" % (path, volume['name'], busy))
+                continue
+            res['action'] = 'rename'
+            plan.append((path, ["vim-cmd hostsvc/datastore/rename '%s' '%s'" %
+                                (volume['name'], name)]))
+        elif module.params['create']:
+            if not is_empty_ptbl(module, device):
+                not_vacant.append("%s (%s)" % (path, device))
+                continue
+            res['action'] = 'create'
+            plan.append((path, create_commands(module, device, name)))
+    if not_empty:
+        module.fail_json(msg="cannot rename datastores, not empty: %s" % ', '.join(not_empty),
+                         datastores=results)
+    if not_vacant:
+        module.fail_json(msg="partition table is not empty on LUNs: %s" % ', '.join(not_vacant),
+                         datastores=results)
+
+    commands = []
+    for (path, cmds) in plan:
+        results[path]['changed'] = True
+        for cmd in cmds:
+            if module.check_mode:
+                # vacant LUN has no label yet to get usable sectors from: "{last}" is
+                # left as is in reported command, it is known only after "mklabel"
+                commands.append(cmd)
+                continue
+            if '{last}' in cmd:
+                cmd = cmd.format(last=get_last_sector(module, results[path]['device']))
+            commands.append(cmd)
+            ret, out, err = module.run_command(cmd)
+            if ret != 0:
+                module.fail_json(msg="unable to %s datastore %s" % (results[path]['action'], path),
+                                 cmd=cmd, rc=ret, err=err, out=out, commands=commands,
+                                 datastores=results)
+
+    module.exit_json(changed=bool(commands), commands=commands, datastores=results)
+
+if __name__ == '__main__':
+    main()
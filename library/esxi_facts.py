@@ -0,0 +1,247 @@
+#!/usr/bin/python
+'''
+source ~/tmp/ansible/hacking/env-setup
+export PATH=$PATH:~/tmp/ansible/hacking/
+test-module -m esxi_facts.py -a 'gather=hostname,portgroups'
+
+export ANSIBLE_CONFIG=~/works/sysadm/ansible-study/esxi-mgmt/ansible.esxi.cfg
+ansible -m esxi_facts -a 'advanced=/Net/BlockGuestBPDU cache_ttl=600' nest1-m8
+'''
+
+from ansible.module_utils.basic import AnsibleModule
+from ansible.module_utils.esxi_esxcli import run_esxcli, to_bool
+import re
+
+ANSIBLE_METADATA = {'status': ['preview'],
+                    'supported_by': 'committer',
+                    'version': '0.1'}
+
+DOCUMENTATION = '''
+---
+module: esxi_facts
+short_description: gather ESXi host configuration state in one go
+version_added: "2.2"
+description:
+    - 'Collects read-only host state used by C(hostconf-esxi) role in one module run
+       (instead of separate probe task for each item) and returns it as C(esxi_facts)
+       host fact.'
+    - 'Facts are C(hostname), C(domain) and C(fqdn), C(license_serial), C(portgroups)
+       (name => {name, vswitch, tag, clients}), C(accounts) (name => {name, desc}),
+       C(permissions) (principal => {principal, role, is_group}), C(advanced)
+       (option path => int or string value), C(syslog) (syslog config, snake-cased keys
+       like C(remote_host)), C(firewall) (ruleset => {name, enabled, allowed_ips}).'
+    - 'With action plugin (C(action_plugins/esxi_facts.py)) results could be cached on
+       controller, so repeated runs against same hosts do not repeat the sweep.'
+options:
+    gather:
+        description: 'Fact groups to collect'
+        choices: ["hostname", "license", "portgroups", "accounts", "permissions",
+                  "advanced", "syslog", "firewall"]
+        default: all of them
+    advanced:
+        description: 'List of advanced option paths (like C(/Net/BlockGuestBPDU)) to include
+            into C(advanced) facts; all options are listed if empty (rather slow and big)'
+        default: []
+    cache_ttl:
+        description: 'Controller-side cache lifetime in seconds, 0 to disable cache
+            (handled by action plugin)'
+        default: 0
+    cache_dir:
+        description: 'Directory for controller-side cache (handled by action plugin)'
+        default: "~/.ansible/esxi_facts_cache"
+    refresh:
+        description: 'Ignore cached facts, gather them again and update cache
+            (handled by action plugin)'
+        default: False
+    invalidate:
+        description: 'Just drop cached facts for host, do not gather anything
+            (handled by action plugin, useful as handler after changes)'
+        default: False
+author: alex@maxidom.ru
+notes:
+    - works w/o vcenter via C(ssh)
+    - 'Cached facts are valid until TTL expires or they are invalidated: notify
+       invalidation from tasks changing host state'
+requirements: []
+'''
+
+EXAMPLES = '''
+# gather everything role needs, cache for 10 minutes
+- name: gather host state
+  esxi_facts:
+    advanced:
+      - /Net/BlockGuestBPDU
+      - /UserVars/ESXiShellInteractiveTimeOut
+    cache_ttl: 600
+
+- name: assign host name
+  command: "esxcli system hostname set --fqdn {{ esxi_fqdn }}"
+  when: esxi_facts.fqdn != esxi_fqdn
+  notify: invalidate esxi facts
+
+# in handlers
+- name: invalidate esxi facts
+  esxi_facts:
+    invalidate: true
+'''
+
+GATHER_GROUPS = ['hostname', 'license', 'portgroups', 'accounts', 'permissions',
+                 'advanced', 'syslog', 'firewall']
+
+# esxcli namespaces (run with csv formatter), license is from vim-cmd
+COMMANDS = {
+    'hostname': 'system hostname get',
+    'license': 'vim-cmd vimsvc/license --show',
+    'portgroups': 'network vswitch standard portgroup list',
+    'accounts': 'system account list',
+    'permissions': 'system permission list',
+    'advanced': 'system settings advanced list',
+    'advanced_one': 'system settings advanced list -o {path}',
+    'syslog': 'system syslog config get',
+    'firewall': 'network firewall ruleset list',
+    'firewall_ips': 'network firewall ruleset allowedip list',
+}
+
+CAMEL_RE = re.compile(r'(?<=[a-z0-9])(?=[A-Z])')
+
+
+def snake(name):
+    ''' "RemoteHost" -> "remote_host" '''
+    return CAMEL_RE.sub('_', name).lower()
+
+
+def to_value(val):
+    ''' convert esxcli csv value to python type '''
+    if val in ('true', 'false'):
+        return to_bool(val)
+    return val
+
+
+def run_csv(module, cmd_name, **kwargs):
+    ''' run esxcli with csv formatter, return list of records with snake-cased keys '''
+    _, recs, _, _ = run_esxcli(module, COMMANDS[cmd_name].format(**kwargs), formatter='csv',
+                               fail_msg="unable to get %s" % cmd_name)
+    return [dict((snake(key), to_value(val)) for (key, val) in rec.items()) for rec in recs]
+
+
+def get_hostname(module):
+    recs = run_csv(module, 'hostname')
+    rec = recs[0] if recs else {}
+    return {'hostname': rec.get('host_name', ''),
+            'domain': rec.get('domain_name', ''),
+            'fqdn': rec.get('fully_qualified_domain_name', '')}
+
+
+def get_license(module):
+    ''' serial is in line like "serial: XXXXX-XXXXX-XXXXX-XXXXX-XXXXX" '''
+    ret, out, err = module.run_command(COMMANDS['license'])
+    serial = ''
+    if ret == 0:
+        for line in out.split('\n'):
+            if line.strip().startswith('serial:'):
+                serial = line.split(':', 1)[1].strip()
+                break
+    return {'license_serial': serial}
+
+
+def get_portgroups(module):
+    ''' same structure as "esxi_portgroups" in role vars (tag and clients are ints) '''
+    portgroups = dict()
+    for rec in run_csv(module, 'portgroups'):
+        portgroups[rec['name']] = {'name': rec['name'],
+                                   'vswitch': rec.get('virtual_switch'),
+                                   'tag': int(rec.get('vlanid') or 0),
+                                   'clients': int(rec.get('active_clients') or 0)}
+    return {'portgroups': portgroups}
+
+
+def get_accounts(module):
+    ''' same structure as "esxi_local_users" in role vars '''
+    return {'accounts': dict((rec['user_id'], {'name': rec['user_id'],
+                                               'desc': rec.get('description', '')})
+                             for rec in run_csv(module, 'accounts'))}
+
+
+def get_permissions(module):
+    return {'permissions': dict((rec['principal'], {'principal': rec['principal'],
+                                                    'role': rec.get('role'),
+                                                    'is_group': rec.get('is_group')})
+                                for rec in run_csv(module, 'permissions'))}
+
+
+def advanced_value(rec):
+    ''' int or string value of advanced option record, depending on its type '''
+    if rec.get('type') == 'integer':
+        return int(rec.get('int_value'))
+    return rec.get('string_value')
+
+
+def get_advanced(module, paths):
+    ''' selected options one by one (within same module run) or all at once '''
+    if paths:
+        recs = []
+        for path in paths:
+            recs.extend(run_csv(module, 'advanced_one', path=path))
+    else:
+        recs = run_csv(module, 'advanced')
+    return {'advanced': dict((rec['path'], advanced_value(rec)) for rec in recs)}
+
+
+def get_syslog(module):
+    recs = run_csv(module, 'syslog')
+    return {'syslog': recs[0] if recs else {}}
+
+
+def get_firewall(module):
+    firewall = dict()
+    for rec in run_csv(module, 'firewall'):
+        firewall[rec['name']] = {'name': rec['name'],
+                                 'enabled': rec.get('enabled') is True,
+                                 'allowed_ips': []}
+    for rec in run_csv(module, 'firewall_ips'):
+        if rec.get('ruleset') in firewall:
+            ips = rec.get('allowed_ipaddresses') or ''
+            firewall[rec['ruleset']]['allowed_ips'] = [ip for ip in re.split(r'[\s,]+', ips) if ip]
+    return {'firewall': firewall}
+
+
+def main():
+    ''' entry point: gather requested groups, return them as "esxi_facts" '''
+    module = AnsibleModule(
+        argument_spec = dict(
+            gather = dict(required=False, type='list', default=GATHER_GROUPS),
+            advanced = dict(required=False, type='list', default=[]),
+            # used by action plugin, ignored here
+            cache_ttl = dict(required=False, type='int', default=0),
+            cache_dir = dict(required=False, type='str'),
+            refresh = dict(required=False, type='bool', default=False),
+            invalidate = dict(required=False, type='bool', default=False),
+        ),
+        supports_check_mode=True,
+    )
+    gather = module.params['gather']
+    unknown = set(gather) - set(GATHER_GROUPS)
+    if unknown:
+        module.fail_json(msg="unknown gather groups: %s" % ', '.join(sorted(unknown)))
+    facts = dict()
+    if 'hostname' in gather:
+        facts.update(get_hostname(module))
+    if 'license' in gather:
+        facts.update(get_license(module))
+    if 'portgroups' in gather:
+        facts.update(get_portgroups(module))
+    if 'accounts' in gather:
+        facts.update(get_accounts(module))
+    if 'permissions' in gather:
+        facts.update(get_permissions(module))
+    if 'advanced' in gather:
+        facts.update(get_advanced(module, module.params['advanced']))
+    if 'syslog' in gather:
+        facts.update(get_syslog(module))
+    if 'firewall' in gather:
+        facts.update(get_firewall(module))
+    module.exit_json(changed=False, ansible_facts={'esxi_facts': facts})
+
+
+if __name__ == '__main__':
+    main()
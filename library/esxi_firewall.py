@@ -0,0 +1,163 @@
+#!/usr/bin/python
+'''
+source ~/tmp/ansible/hacking/env-setup
+export PATH=$PATH:~/tmp/ansible/hacking/
+test-module -m esxi_firewall.py -a '{"rulesets": {"sshClient": true, "CIMSLP": false}}'
+
+export ANSIBLE_CONFIG=~/works/sysadm/ansible-study/esxi-mgmt/ansible.esxi.cfg
+ansible -m esxi_firewall -a '{"rulesets": {"syslog": true}}' --check --diff nest1-m8
+'''
+
+from ansible.module_utils.basic import AnsibleModule
+from ansible.module_utils.esxi_esxcli import run_esxcli, to_bool
+import re
+
+ANSIBLE_METADATA = {'status': ['preview'],
+                    'supported_by': 'committer',
+                    'version': '0.1'}
+
+DOCUMENTATION = '''
+---
+module: esxi_firewall
+short_description: manage ESXi firewall rulesets in one run
+version_added: "2.2"
+description:
+    - 'Lists all firewall rulesets and their allowed IPs once, then enables or
+       disables rulesets and fixes allowed IP lists where they differ.'
+    - 'Per-ruleset results are returned in C(rulesets) dict keyed by name, with
+       C(changed), C(enabled) and C(allowed_ips) (old and new values).'
+options:
+    rulesets:
+        description:
+            - 'Dict "ruleset -> state": state is either bool (enabled or not) or dict
+               with C(enabled) and optional C(allowed_ips).'
+            - 'C(allowed_ips) is list of IPs or networks (like C(10.0.0.0/8)) to restrict
+               access to, or C(all) to allow access from everywhere; allowed IPs are
+               not changed if it is not set.'
+        required: true
+author: alex@maxidom.ru
+notes:
+    - works w/o vcenter via C(ssh)
+    - supports check mode and diff
+requirements: []
+'''
+
+EXAMPLES = '''
+- name: open firewall for clients
+  esxi_firewall:
+    rulesets:
+      sshClient: true
+      ntpClient: true
+      syslog: true
+      CIMSLP: false
+      sshServer:
+        enabled: true
+        allowed_ips: [10.0.0.0/8, 192.168.1.0/24]
+'''
+
+
+def get_rulesets(module):
+    ''' current rulesets: name -> {enabled, allowed_ips (list or "all")} '''
+    _, recs, _, _ = run_esxcli(module, 'network firewall ruleset list', formatter='csv',
+                               types={'Enabled': to_bool}, fail_msg="unable to list rulesets")
+    rulesets = dict((rec['Name'], {'enabled': rec.get('Enabled') is True, 'allowed_ips': 'all'})
+                    for rec in recs)
+    _, recs, _, _ = run_esxcli(module, 'network firewall ruleset allowedip list', formatter='csv',
+                               fail_msg="unable to list allowed ips")
+    for rec in recs:
+        if rec.get('Ruleset') not in rulesets:
+            continue
+        ips = [ip for ip in re.split(r'[\s,]+', rec.get('AllowedIPAddresses') or '') if ip]
+        rulesets[rec['Ruleset']]['allowed_ips'] = 'all' if ips in ([], ['All']) else ips
+    return rulesets
+
+
+def normalize(module, name, state):
+    ''' desired state as {enabled, allowed_ips (None if not managed)} '''
+    if isinstance(state, dict):
+        enabled = state.get('enabled', True)
+        allowed_ips = state.get('allowed_ips')
+    else:
+        enabled = state
+        allowed_ips = None
+    if not isinstance(enabled, bool):
+        enabled = str(enabled).lower() in ('true', 'yes', 'on', '1')
+    if allowed_ips is not None and allowed_ips != 'all':
+        if not isinstance(allowed_ips, list):
+            module.fail_json(msg="allowed_ips for %s must be list or 'all'" % name)
+        allowed_ips = [str(ip) for ip in allowed_ips]
+    return {'enabled': enabled, 'allowed_ips': allowed_ips}
+
+
+def plan_changes(name, curr, wanted):
+    ''' list of esxcli argv to bring ruleset to wanted state '''
+    ruleset_cmd = ['esxcli', 'network', 'firewall', 'ruleset']
+    changes = []
+    if wanted['enabled'] != curr['enabled']:
+        changes.append(ruleset_cmd + ['set', '--ruleset-id=%s' % name,
+                                      '--enabled=%s' % str(wanted['enabled']).lower()])
+    allowed = wanted['allowed_ips']
+    if allowed is None or allowed == curr['allowed_ips']:
+        return changes
+    if allowed != 'all' and curr['allowed_ips'] != 'all' and \
+            set(allowed) == set(curr['allowed_ips']):
+        return changes
+    if allowed == 'all':
+        changes.append(ruleset_cmd + ['set', '--ruleset-id=%s' % name, '--allowed-all=true'])
+        return changes
+    curr_ips = [] if curr['allowed_ips'] == 'all' else curr['allowed_ips']
+    if curr['allowed_ips'] == 'all':
+        changes.append(ruleset_cmd + ['set', '--ruleset-id=%s' % name, '--allowed-all=false'])
+    for ip in curr_ips:
+        if ip not in allowed:
+            changes.append(ruleset_cmd + ['allowedip', 'remove', '--ruleset-id=%s' % name,
+                                          '--ip-address=%s' % ip])
+    for ip in allowed:
+        if ip not in curr_ips:
+            changes.append(ruleset_cmd + ['allowedip', 'add', '--ruleset-id=%s' % name,
+                                          '--ip-address=%s' % ip])
+    return changes
+
+
+def main():
+    ''' entry point: list rulesets once, apply all differences '''
+    module = AnsibleModule(
+        argument_spec = dict(
+            rulesets = dict(required=True, type='dict'),
+        ),
+        supports_check_mode=True,
+    )
+    current = get_rulesets(module)
+    unknown = sorted(set(module.params['rulesets']) - set(current))
+    if unknown:
+        module.fail_json(msg="unknown firewall rulesets: %s" % ', '.join(unknown))
+
+    results = dict()
+    commands = []
+    before = dict()
+    after = dict()
+    for name in sorted(module.params['rulesets']):
+        curr = current[name]
+        wanted = normalize(module, name, module.params['rulesets'][name])
+        new = {'enabled': wanted['enabled'],
+               'allowed_ips': curr['allowed_ips'] if wanted['allowed_ips'] is None
+                              else wanted['allowed_ips']}
+        changes = plan_changes(name, curr, wanted)
+        for argv in changes:
+            commands.append(' '.join(argv))
+            if not module.check_mode:
+                ret, out, err = module.run_command(argv)
+                if ret != 0:
+                    module.fail_json(msg="unable to change ruleset %s" % name, cmd=commands[-1],
+                                     rc=ret, err=err, out=out, commands=commands)
+        results[name] = {'changed': bool(changes), 'enabled': [curr['enabled'], new['enabled']],
+                         'allowed_ips': [curr['allowed_ips'], new['allowed_ips']]}
+        before[name] = curr
+        after[name] = new
+
+    module.exit_json(changed=bool(commands), commands=commands, rulesets=results,
+                     diff={'before': before, 'after': after})
+
+
+if __name__ == '__main__':
+    main()
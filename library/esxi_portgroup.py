@@ -0,0 +1,168 @@
+#!/usr/bin/python
+'''
+source ~/tmp/ansible/hacking/env-setup
+export PATH=$PATH:~/tmp/ansible/hacking/
+test-module -m esxi_portgroup.py -a '{"portgroups": {"adm-srv": {"tag": 210}}, "exclusive": false}'
+
+export ANSIBLE_CONFIG=~/works/sysadm/ansible-study/esxi-mgmt/ansible.esxi.cfg
+ansible -m esxi_portgroup -a '{"portgroups": {"adm-srv": {"tag": 210}}}' --check --diff nest1-m8
+'''
+
+from ansible.module_utils.basic import AnsibleModule
+from ansible.module_utils.esxi_esxcli import run_esxcli
+
+ANSIBLE_METADATA = {'status': ['preview'],
+                    'supported_by': 'committer',
+                    'version': '0.1'}
+
+DOCUMENTATION = '''
+---
+module: esxi_portgroup
+short_description: manage standard vSwitch portgroups on ESXi host
+version_added: "2.2"
+description:
+    - 'Brings set of portgroups on standard vSwitches to desired state in one run:
+       current portgroups are listed once, then missed are added, extra are removed
+       and VLAN tags are fixed.'
+    - 'Per-portgroup results are returned in C(portgroups) dict keyed by name, with
+       C(actions) (list of C(add), C(remove), C(set_tag)), C(changed), C(old_tag)
+       and C(new_tag).'
+options:
+    portgroups:
+        description: 'Desired portgroups as dict "name -> {tag, vswitch}", like
+            C(esxi_portgroups) in role vars (C(tag) is VLAN id, default 0)'
+        required: true
+    vswitch:
+        description: 'vSwitch for portgroups w/o explicit C(vswitch)'
+        default: "vSwitch0"
+    exclusive:
+        description: 'Remove portgroups not in C(portgroups) (except C(protected) ones).
+            Module fails w/o changing anything if some of them still have active clients'
+        default: True
+    protected:
+        description: 'Portgroups never touched by module'
+        default: ["Management Network"]
+author: alex@maxidom.ru
+notes:
+    - works w/o vcenter via C(ssh)
+    - supports check mode and diff
+requirements: []
+'''
+
+EXAMPLES = '''
+- name: configure portgroups
+  esxi_portgroup:
+    portgroups: "{{ esxi_portgroups }}"
+    vswitch: "{{ vswitch_def }}"
+'''
+
+PGMOD = "esxcli network vswitch standard portgroup"
+
+
+def get_portgroups(module):
+    ''' current portgroups: name -> {name, vswitch, tag, clients} '''
+    _, recs, _, _ = run_esxcli(module, 'network vswitch standard portgroup list', formatter='csv',
+                               types={'VLANID': int, 'ActiveClients': int},
+                               fail_msg="unable to list portgroups")
+    return dict((rec['Name'], {'name': rec['Name'],
+                               'vswitch': rec.get('VirtualSwitch'),
+                               'tag': rec.get('VLANID') or 0,
+                               'clients': rec.get('ActiveClients') or 0})
+                for rec in recs)
+
+
+def normalize(module, portgroups, vswitch_def):
+    ''' desired state: name -> {name, vswitch, tag (int)} '''
+    wanted = dict()
+    for (name, pg) in portgroups.items():
+        pg = pg or {}
+        if not isinstance(pg, dict):
+            module.fail_json(msg="bad portgroup %s: expected dict with tag and vswitch" % name)
+        try:
+            tag = int(pg.get('tag') or 0)
+        except ValueError:
+            module.fail_json(msg="bad vlan tag for portgroup %s: %s" % (name, pg.get('tag')))
+        wanted[name] = {'name': name, 'vswitch': pg.get('vswitch') or vswitch_def, 'tag': tag}
+    return wanted
+
+
+def plan_changes(current, wanted, exclusive, protected):
+    '''
+    list of (name, action, command) to apply, ordered: removals first (free
+    names and uplinks), then additions and tag changes
+    '''
+    removes = []
+    adds = []
+    for name in sorted(current):
+        if exclusive and name not in wanted and name not in protected:
+            removes.append((name, 'remove', "%s remove -p '%s' -v '%s'" %
+                            (PGMOD, name, current[name]['vswitch'])))
+    for name in sorted(wanted):
+        if name in protected:
+            continue
+        pg = wanted[name]
+        curr_tag = current[name]['tag'] if name in current else 0
+        if name not in current:
+            adds.append((name, 'add', "%s add -p '%s' -v '%s'" % (PGMOD, name, pg['vswitch'])))
+        if pg['tag'] != curr_tag:
+            adds.append((name, 'set_tag', "%s set -p '%s' --vlan-id %d" % (PGMOD, name, pg['tag'])))
+    return removes + adds
+
+
+def main():
+    ''' entry point: list current portgroups once, apply all differences '''
+    module = AnsibleModule(
+        argument_spec = dict(
+            portgroups = dict(required=True, type='dict'),
+            vswitch = dict(required=False, type='str', default='vSwitch0'),
+            exclusive = dict(required=False, type='bool', default=True),
+            protected = dict(required=False, type='list', default=['Management Network']),
+        ),
+        supports_check_mode=True,
+    )
+    protected = set(module.params['protected'])
+    current = get_portgroups(module)
+    wanted = normalize(module, module.params['portgroups'], module.params['vswitch'])
+    changes = plan_changes(current, wanted, module.params['exclusive'], protected)
+
+    busy = [name for (name, action, _) in changes
+            if action == 'remove' and current[name]['clients'] > 0]
+    if busy:
+        module.fail_json(msg="portgroups to remove still have active clients: %s" %
+                         ', '.join(busy), busy=busy)
+
+    results = dict()
+    for name in set(current) | set(wanted):
+        if name in protected:
+            continue
+        results[name] = {'actions': [], 'changed': False,
+                         'old_tag': current[name]['tag'] if name in current else None,
+                         'new_tag': wanted[name]['tag'] if name in wanted else (
+                             None if module.params['exclusive'] else current[name]['tag'])}
+
+    commands = []
+    for (name, action, cmd) in changes:
+        if not module.check_mode:
+            ret, out, err = module.run_command(cmd)
+            if ret != 0:
+                module.fail_json(msg="unable to %s portgroup %s" % (action, name),
+                                 cmd=cmd, rc=ret, err=err, out=out, commands=commands)
+        commands.append(cmd)
+        results[name]['actions'].append(action)
+        results[name]['changed'] = True
+
+    before = dict((name, {'vswitch': pg['vswitch'], 'tag': pg['tag']})
+                  for (name, pg) in current.items() if name not in protected)
+    # portgroups are not moved between vSwitches
+    after = dict((name, {'vswitch': current[name]['vswitch'] if name in current else pg['vswitch'],
+                         'tag': pg['tag']})
+                 for (name, pg) in wanted.items() if name not in protected)
+    if not module.params['exclusive']:
+        for (name, pg) in before.items():
+            after.setdefault(name, pg)
+    module.exit_json(changed=bool(commands), commands=commands, portgroups=results,
+                     diff={'before': before, 'after': after})
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,196 @@
+#!/usr/bin/python
+'''
+source ~/tmp/ansible/hacking/env-setup
+export PATH=$PATH:~/tmp/ansible/hacking/
+test-module -m esxi_replace.py -a '{"path": "/tmp/test.vmdk", "regexp": "\"phoenix11([^\"]*)\"", "replace": "\"vm1\\1\""}'
+
+export ANSIBLE_CONFIG=~/works/sysadm/ansible-study/esxi-mgmt/vm_deploy/ansible-deploy.esxi.cfg
+ansible -m esxi_replace -a 'path=/vmfs/volumes/nest1-sys/vm1/vm1.vmxf regexp=">phoenix11\.vmx<" replace=">vm1.vmx<"' --check --diff nest1-m8
+'''
+
+from ansible.module_utils.basic import AnsibleModule
+from ansible.module_utils.esxi_replace import (SCOPES, Replacer, compile_replacements,
+                                               replace_bytes)
+import os
+
+ANSIBLE_METADATA = {'status': ['preview'],
+                    'supported_by': 'committer',
+                    'version': '0.1'}
+
+DOCUMENTATION = '''
+---
+module: esxi_replace
+short_description: replace regexp matches in file of any size, in one pass
+version_added: "2.2"
+description:
+    - 'Successor of bundled C(replace) fork (C(vm_deploy/replace.py-2.2_fixed_for_python3.py)):
+       works on bytes (file is not decoded, so it could be binary), streams file
+       instead of reading it into memory, and applies several replacements in one
+       pass.'
+    - 'File is not written at all when nothing matches; otherwise new content goes to
+       temp file in the same dir (so no space in C(/tmp) is needed), which is
+       renamed over original.'
+    - 'Patterns use multiline mode (C(^) and C($) match at line boundaries), like for
+       C(replace); at every position the leftmost match of any pattern wins, and
+       replaced text is not searched again.'
+options:
+    path:
+        description: 'File to modify'
+        required: true
+        aliases: [dest, destfile, name]
+    regexp:
+        description: 'Python regular expression to look for'
+        required: false
+    replace:
+        description: 'Replacement, with backreferences like C(\\1); matches are removed
+            if not set'
+        required: false
+    replacements:
+        description: 'List of C({regexp, replace}) dicts, applied together with
+            C(regexp) (which is the first one) in one pass'
+        default: []
+    scope:
+        description:
+            - 'C(line): read file in blocks of lines, patterns are matched within
+               lines only (memory use does not depend on file size)'
+            - 'C(file): C(mmap) file and match patterns in it as a whole (for ones
+               that span lines)'
+        choices: [line, file]
+        default: line
+    backup:
+        description: 'Keep backup copy of original file'
+        default: False
+    validate:
+        description: 'Command to validate new file before it replaces original, with
+            C(%s) for its path'
+        required: false
+    others:
+        description: 'All arguments accepted by M(file) module also work here'
+        required: false
+author: alex@maxidom.ru
+notes:
+    - works w/o vcenter via C(ssh)
+    - supports check mode and diff (whole file if it is small, changed lines or
+      matches otherwise)
+requirements: []
+'''
+
+EXAMPLES = '''
+- name: replace vm name in vmdk descriptor
+  esxi_replace:
+    path: "{{ dst_vm.path }}/{{ dst_vm.name }}/{{ dst_vm.name }}.vmdk"
+    regexp: '"{{ src_vm.name }}([^"]*)"'
+    replace: '"{{ dst_vm.name }}\\1"'
+
+- name: fix several names in one pass
+  esxi_replace:
+    path: /tmp/big.log
+    replacements:
+      - { regexp: 'host1', replace: 'host2' }
+      - { regexp: '^#.*$', replace: '' }
+'''
+
+# whole file in diff up to this size
+DIFF_MAX = 64 * 1024
+# else that many changed lines (or matches)
+DIFF_LINES = 100
+
+
+def to_text(data):
+    return data.decode('utf-8', 'replace')
+
+
+def make_diff(path, before, after, replacer):
+    ''' diff for small file, or list of changed lines (or matches) for large one '''
+    if before is not None:
+        return {'before_header': path, 'after_header': path,
+                'before': to_text(before), 'after': to_text(after)}
+    label = 'line' if replacer.scope == 'line' else 'offset'
+    return {'before_header': '%s (changed, by %s)' % (path, label),
+            'after_header': '%s (changed, by %s)' % (path, label),
+            'before': ''.join('%d: %s\n' % (pos, to_text(old)) for (pos, old, _) in replacer.changes),
+            'after': ''.join('%d: %s\n' % (pos, to_text(new)) for (pos, _, new) in replacer.changes)}
+
+
+def main():
+    ''' entry point: apply replacements in one pass, write only if changed '''
+    module = AnsibleModule(
+        argument_spec = dict(
+            path = dict(required=True, type='path', aliases=['dest', 'destfile', 'name']),
+            regexp = dict(required=False, type='str'),
+            replace = dict(required=False, type='str', default=''),
+            replacements = dict(required=False, type='list', default=[]),
+            scope = dict(required=False, type='str', default='line', choices=SCOPES),
+            backup = dict(required=False, type='bool', default=False),
+            validate = dict(required=False, type='str'),
+        ),
+        add_file_common_args=True,
+        supports_check_mode=True,
+    )
+    params = module.params
+    path = params['path']
+    if os.path.isdir(path):
+        module.fail_json(rc=256, msg="destination %s is a directory" % path)
+    if not os.path.exists(path):
+        module.fail_json(rc=257, msg="destination %s does not exist" % path)
+    if params['follow'] and os.path.islink(path):
+        path = os.path.realpath(path)
+    if params['validate'] and '%s' not in params['validate']:
+        module.fail_json(msg="validate must contain %%s: %s" % params['validate'])
+
+    pairs = []
+    if params['regexp'] is not None:
+        pairs.append((params['regexp'], params['replace']))
+    for item in params['replacements']:
+        if not isinstance(item, dict) or not item.get('regexp'):
+            module.fail_json(msg="bad replacement (dict with regexp expected): %s" % item)
+        pairs.append((item['regexp'], item.get('replace', '')))
+    if not pairs:
+        module.fail_json(msg="one of regexp or replacements is required")
+    try:
+        replacements = compile_replacements(pairs)
+    except ValueError as e:
+        module.fail_json(msg=str(e))
+
+    # small files are diffed as a whole, like with "replace"
+    small = module._diff and os.path.getsize(path) <= DIFF_MAX
+    replacer = Replacer(path, replacements, scope=params['scope'], dry_run=module.check_mode,
+                        diff_limit=DIFF_LINES if module._diff else 0)
+    try:
+        count = replacer.run()
+    except (IOError, OSError, ValueError) as e:
+        module.fail_json(msg="unable to process %s: %s" % (path, e))
+
+    changed = count > 0
+    result = dict(path=path, replacements=count, msg='')
+    if changed:
+        result['msg'] = '%d replacements made' % count
+        if module._diff:
+            before = after = None
+            if small:
+                with open(path, 'rb') as src:
+                    before = src.read()
+                after = replace_bytes(before, replacements, params['scope'])
+            result['diff'] = make_diff(path, before, after, replacer)
+    if changed and not module.check_mode:
+        if params['validate']:
+            (rc, out, err) = module.run_command(params['validate'] % replacer.tmp_name)
+            if rc != 0:
+                replacer.discard()
+                module.fail_json(msg="failed to validate: rc:%s error:%s" % (rc, err))
+        if params['backup']:
+            result['backup_file'] = module.backup_local(path)
+        module.atomic_move(replacer.tmp_name, path, unsafe_writes=params['unsafe_writes'])
+
+    # owner, mode etc like for "file"
+    file_args = module.load_file_common_arguments(params)
+    file_args['path'] = path
+    if module.set_file_attributes_if_different(file_args, False):
+        result['msg'] += (" and " if changed else "") + "ownership, perms or SE linux context changed"
+        changed = True
+    result['changed'] = changed
+    module.exit_json(**result)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,225 @@
+#!/usr/bin/python
+'''
+source ~/tmp/ansible/hacking/env-setup
+export PATH=$PATH:~/tmp/ansible/hacking/
+test-module -m esxi_template_cache.py -a '{"path": "/vmfs/volumes/nest-test-sys/phoenix11/phoenix11.vmdk", "state": "key"}'
+
+export ANSIBLE_CONFIG=~/works/sysadm/ansible-study/esxi-mgmt/vm_deploy/ansible-deploy.esxi.cfg
+ansible -m esxi_template_cache -a 'key=<key> dest=/vmfs/volumes/nest1-sys/vm1/vm1.vmdk state=clone' nest1-m8
+
+local run w/o ESXi: datastores are plain dirs, stand-in script for vmkfstools
+(copies descriptor with extent names changed, and extents)
+test-module -m esxi_template_cache.py -a '{"path": "/tmp/ds1/vm1/vm1.vmdk", "key": "<key>", "state": "present", "datastores": ["/tmp/ds1", "/tmp/ds2"], "max_size": 1, "vmkfstools": "/tmp/bin/vmkfstools"}'
+'''
+
+from ansible.module_utils.basic import AnsibleModule
+from ansible.module_utils.esxi_template_cache import (CacheError, DatastoreCache, KEY_RE,
+                                                      allocated_size, clone_disk,
+                                                      datastore_dirs, disk_extents, disk_key,
+                                                      find)
+import os
+import time
+
+ANSIBLE_METADATA = {'status': ['preview'],
+                    'supported_by': 'committer',
+                    'version': '0.1'}
+
+DOCUMENTATION = '''
+---
+module: esxi_template_cache
+short_description: content-addressed cache of template disks on datastores
+version_added: "2.2"
+description:
+    - 'Keeps template disks (like uploaded "phoenix11") in C(.template_cache) dir of
+       datastore, keyed by content hash, so next deployment of the same template
+       version to this host is a local C(vmkfstools -i) instead of transfer from
+       another host.'
+    - 'Key is sha1 of 8M chunk hashes of disk extents (the same as kept by
+       C(esxi_transfer)); key of source disk is saved in hidden sidecar next to it
+       and reused while disk is unchanged.'
+    - 'Every datastore cache has size budget, least recently used disks are evicted
+       to fit new one.'
+options:
+    state:
+        description:
+            - 'C(key): get content key of disk at C(path) (run on source host)'
+            - 'C(clone): clone cached disk with C(key) to C(dest), if present on any of
+               C(datastores) (datastore of C(dest) first); C(hit) is false if it is not'
+            - 'C(present): store disk at C(path) in cache on C(datastore) (checking
+               that it really has C(key))'
+            - 'C(absent): drop disk with C(key) from caches'
+        choices: [key, clone, present, absent]
+        default: clone
+    path:
+        description: 'Disk (descriptor) to get key of or to store'
+        required: false
+    key:
+        description: 'Content key (from C(state=key) on source host)'
+        required: false
+    dest:
+        description: 'Disk (descriptor) to create from cache'
+        required: false
+    datastore:
+        description: 'Datastore (name or path) to store disk on, default is the one
+            with C(path)'
+        required: false
+    datastores:
+        description: 'Datastores (names or paths) to search, default is all mounted'
+        required: false
+    max_size:
+        description: 'Cache size budget for one datastore, GB'
+        default: 100
+    vmkfstools:
+        description: 'C(vmkfstools) command (stand-in script for testing)'
+        default: vmkfstools
+author: alex@maxidom.ru
+notes:
+    - works w/o vcenter via C(ssh)
+    - supports check mode
+requirements: []
+'''
+
+EXAMPLES = '''
+- name: get template disk key
+  esxi_template_cache:
+    path: "{{ src_vm.path }}/{{ src_vm.name }}/{{ src_vm.name }}.vmdk"
+    state: key
+  delegate_to: "{{ src_vm.server }}"
+  register: tmpl_key_res
+
+- name: clone vm disk from template cache
+  esxi_template_cache:
+    key: "{{ tmpl_key_res.key }}"
+    dest: "{{ dst_vm.path }}/{{ dst_vm.name }}/{{ dst_vm.name }}.vmdk"
+  register: tmpl_cache_res
+
+- name: store vm disk in template cache
+  esxi_template_cache:
+    key: "{{ tmpl_key_res.key }}"
+    path: "{{ dst_vm.path }}/{{ dst_vm.name }}/{{ dst_vm.name }}.vmdk"
+    state: present
+  when: not tmpl_cache_res.hit
+'''
+
+GB = 1024 * 1024 * 1024
+
+
+def datastore_of(path, datastores):
+    ''' (name, real path) of datastore holding path, or None '''
+    real = os.path.realpath(os.path.dirname(path))
+    for (name, ds_path) in datastores:
+        if real == ds_path or real.startswith(ds_path + os.sep):
+            return (name, ds_path)
+    return None
+
+
+def main():
+    ''' entry point: key, clone from cache, store or drop '''
+    module = AnsibleModule(
+        argument_spec = dict(
+            state = dict(required=False, type='str', default='clone',
+                         choices=['key', 'clone', 'present', 'absent']),
+            path = dict(required=False, type='path'),
+            key = dict(required=False, type='str'),
+            dest = dict(required=False, type='path'),
+            datastore = dict(required=False, type='str'),
+            datastores = dict(required=False, type='list'),
+            max_size = dict(required=False, type='int', default=100),
+            vmkfstools = dict(required=False, type='str', default='vmkfstools'),
+        ),
+        required_if=[['state', 'key', ['path']],
+                     ['state', 'clone', ['key', 'dest']],
+                     ['state', 'present', ['key', 'path']],
+                     ['state', 'absent', ['key']]],
+        supports_check_mode=True,
+    )
+    params = module.params
+    state = params['state']
+    key = params['key']
+    if key is not None and not KEY_RE.match(key):
+        module.fail_json(msg="bad key (40 hex digits expected): %s" % key)
+    if params['max_size'] < 1:
+        module.fail_json(msg="max_size must be positive")
+    started = time.time()
+
+    if state == 'key':
+        try:
+            # sidecar is not written in check mode
+            key = disk_key(params['path'], save=not module.check_mode)
+        except CacheError as e:
+            module.fail_json(msg=str(e))
+        module.exit_json(changed=False, key=key, path=params['path'],
+                         seconds=round(time.time() - started, 2))
+
+    datastores = datastore_dirs(params['datastores'])
+
+    if state == 'clone':
+        dest = params['dest']
+        if os.path.exists(dest):
+            module.exit_json(changed=False, hit=False, dest=dest, msg="destination exists")
+        if not os.path.isdir(os.path.dirname(dest)):
+            module.fail_json(msg="destination dir not found: %s" % os.path.dirname(dest))
+        dest_ds = datastore_of(dest, datastores)
+        cache = find(key, datastores, params['vmkfstools'],
+                     prefer=dest_ds[1] if dest_ds else None)
+        if cache is None:
+            module.exit_json(changed=False, hit=False, dest=dest)
+        result = dict(hit=True, changed=True, dest=dest, cache_path=cache.disk_path(key),
+                      datastore=cache.name, local=dest_ds is not None and dest_ds[0] == cache.name)
+        if not module.check_mode:
+            cache.touch(key)
+            try:
+                clone_disk(params['vmkfstools'], cache.disk_path(key), dest)
+            except CacheError as e:
+                module.fail_json(msg=str(e), **result)
+        result['seconds'] = round(time.time() - started, 2)
+        module.exit_json(**result)
+
+    if state == 'absent':
+        dropped = []
+        for (name, path) in datastores:
+            cache = DatastoreCache(name, path, params['vmkfstools'])
+            if cache.lookup(key):
+                dropped.append(name)
+                if not module.check_mode:
+                    cache.drop(key)
+                    cache.save()
+        module.exit_json(changed=bool(dropped), dropped=dropped)
+
+    # present
+    path = params['path']
+    if params['datastore']:
+        target = datastore_dirs([params['datastore']])[0]
+    else:
+        target = datastore_of(path, datastores)
+        if target is None:
+            module.fail_json(msg="datastore of %s not found, set it explicitly" % path)
+    if not os.path.isdir(target[1]):
+        module.fail_json(msg="datastore not found: %s" % target[1])
+    cache = DatastoreCache(target[0], target[1], params['vmkfstools'])
+    if cache.lookup(key):
+        if not module.check_mode:
+            cache.touch(key)
+        module.exit_json(changed=False, key=key, cache_path=cache.disk_path(key),
+                         **cache.summary())
+    budget = params['max_size'] * GB
+    try:
+        extents = disk_extents(path)
+        needed = sum(allocated_size(extent) for extent in extents)
+        if module.check_mode:
+            module.exit_json(changed=True, key=key, needed=needed, **cache.summary())
+        # disk must really be that template version: stored disk is trusted later
+        actual = disk_key(path)
+        if actual != key:
+            module.fail_json(msg="disk %s has key %s, not %s" % (path, actual, key))
+        evicted = cache.store(path, key, budget, needed)
+    except CacheError as e:
+        module.fail_json(msg=str(e))
+    except (IOError, OSError) as e:
+        module.fail_json(msg="unable to store %s in %s: %s" % (path, cache.path, e))
+    module.exit_json(changed=True, key=key, cache_path=cache.disk_path(key), evicted=evicted,
+                     seconds=round(time.time() - started, 2), **cache.summary())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,166 @@
+#!/usr/bin/python
+'''
+source ~/tmp/ansible/hacking/env-setup
+export PATH=$PATH:~/tmp/ansible/hacking/
+test-module -m esxi_transfer.py -a '{"src": "/tmp/src.img", "dest": "/tmp/dst.img", "transport": "local"}'
+
+export ANSIBLE_CONFIG=~/works/sysadm/ansible-study/esxi-mgmt/vm_deploy/ansible-deploy.esxi.cfg
+ansible -m esxi_transfer -a 'src_host=10.1.1.10 src_user=root src=/vmfs/volumes/infra.data/phoenix11/phoenix11-flat.vmdk dest=/vmfs/volumes/nest1-sys/phoenix11/phoenix11-flat.vmdk' -e 'ansible_ssh_extra_args=-A' nest1-m8
+'''
+
+from ansible.module_utils.basic import AnsibleModule
+from ansible.module_utils.esxi_transfer import Receiver, TransferError, sender_argv, state_path
+import time
+
+ANSIBLE_METADATA = {'status': ['preview'],
+                    'supported_by': 'committer',
+                    'version': '0.1'}
+
+DOCUMENTATION = '''
+---
+module: esxi_transfer
+short_description: stream file (like VM disk) from another host, with resume
+version_added: "2.2"
+description:
+    - 'Pulls file from source host to this one in one stream (no temp copy on
+       controller): sender is started on source host via C(ssh) (with agent forwarding,
+       like for direct C(scp)), reads file in chunks and compresses them on the fly.'
+    - 'Every chunk is checked with sha1; hashes of verified chunks are saved in
+       hidden state file next to destination (C(.<name>.xfer)), so after dropped link
+       transfer is resumed from the last verified chunk: automatically (up to
+       C(retries) times) or on the next run.'
+    - 'Holes and zero blocks of source (like in thin VM disk) are not sent, and
+       destination is written sparse (see C(sparse)).'
+    - 'When source and destination are unchanged since complete transfer, re-run
+       only checks source size and mtime.'
+    - 'Block hashes of source and destination are kept in sidecar manifests
+       (C(.<name>.blocks)): when source is changed (or destination is overwritten
+       with C(force)), only chunks that differ from destination are sent; unchanged
+       chunks of source with valid manifest are not even read.'
+options:
+    src:
+        description: 'File path on source host'
+        required: true
+    dest:
+        description: 'File path on this host'
+        required: true
+    src_host:
+        description: 'Source host (name or IP, as seen from this host)'
+        required: false
+    src_user:
+        description: 'User for C(ssh) to source host'
+        default: root
+    transport:
+        description:
+            - 'C(ssh) to pull from C(src_host); C(local) to copy file on this host
+               (same stream, useful for tests)'
+        choices: [ssh, local]
+        default: ssh
+    ssh_args:
+        description: 'Extra C(ssh) options'
+        default: ['-o', 'StrictHostKeyChecking=no', '-o', 'BatchMode=yes',
+                  '-o', 'ServerAliveInterval=15', '-o', 'ServerAliveCountMax=4']
+    python:
+        description: 'Python interpreter on source host'
+        default: python
+    compress:
+        description: 'zlib level for chunks (0 to disable); mostly empty VM disks
+            compress very well even with 1'
+        default: 1
+    sparse:
+        description: 'Skip holes (found with C(SEEK_DATA)/C(SEEK_HOLE) if supported
+            on source) and zero blocks (64K) of source: only data extents are read and
+            sent, destination is sparse file with holes there'
+        default: True
+    chunk_size:
+        description: 'Chunk size in MB (unit of verification and resume)'
+        default: 8
+    retries:
+        description: 'How many times to resume after broken stream in one run'
+        default: 3
+    force:
+        description: 'Overwrite destination that is not from this transfer (existing
+            file w/o state, or changed after transfer); it is hashed first, and only
+            differing chunks are sent'
+        default: False
+author: alex@maxidom.ru
+notes:
+    - works w/o vcenter via C(ssh)
+    - supports check mode (reports resume offset only)
+requirements: []
+'''
+
+EXAMPLES = '''
+- name: stream vm disk from source host
+  esxi_transfer:
+    src_host: "{{ src_vm.host }}"
+    src_user: "{{ ansible_user_id }}"
+    src: "{{ src_vm.path }}/{{ src_vm.name }}/{{ src_vm.name }}-flat.vmdk"
+    dest: "{{ dst_vm.path }}/{{ dst_vm.name }}/{{ dst_vm.name }}-flat.vmdk"
+'''
+
+MB = 1024 * 1024
+
+
+def main():
+    ''' entry point: pull file, resuming from saved state '''
+    module = AnsibleModule(
+        argument_spec = dict(
+            src = dict(required=True, type='str'),
+            dest = dict(required=True, type='path'),
+            src_host = dict(required=False, type='str'),
+            src_user = dict(required=False, type='str', default='root'),
+            transport = dict(required=False, type='str', default='ssh',
+                             choices=['ssh', 'local']),
+            ssh_args = dict(required=False, type='list',
+                            default=['-o', 'StrictHostKeyChecking=no', '-o', 'BatchMode=yes',
+                                     '-o', 'ServerAliveInterval=15',
+                                     '-o', 'ServerAliveCountMax=4']),
+            python = dict(required=False, type='str', default='python'),
+            compress = dict(required=False, type='int', default=1),
+            sparse = dict(required=False, type='bool', default=True),
+            chunk_size = dict(required=False, type='int', default=8),
+            retries = dict(required=False, type='int', default=3),
+            force = dict(required=False, type='bool', default=False),
+        ),
+        supports_check_mode=True,
+    )
+    params = module.params
+    if params['transport'] == 'ssh' and not params['src_host']:
+        module.fail_json(msg="src_host is required for ssh transport")
+    if not 0 <= params['compress'] <= 9:
+        module.fail_json(msg="compress must be 0..9")
+    if params['chunk_size'] < 1:
+        module.fail_json(msg="chunk_size must be positive")
+
+    src = params['src']
+    if params['transport'] == 'ssh':
+        # state is valid only for the same source
+        src_id = '%s:%s' % (params['src_host'], src)
+    else:
+        src_id = src
+    receiver = Receiver(sender_argv(params), src, params['dest'], params['chunk_size'] * MB,
+                        level=params['compress'], retries=params['retries'],
+                        force=params['force'], src_id=src_id,
+                        remote_shell=params['transport'] == 'ssh', sparse=params['sparse'])
+    started = time.time()
+    try:
+        changed = receiver.run(check_mode=module.check_mode)
+    except TransferError as e:
+        module.fail_json(msg=str(e), state_file=state_path(params['dest']), **receiver.stats)
+    except (IOError, OSError) as e:
+        module.fail_json(msg="unable to write %s: %s" % (params['dest'], e),
+                         state_file=state_path(params['dest']), **receiver.stats)
+    seconds = round(time.time() - started, 2)
+    stats = receiver.stats
+    result = dict(changed=changed, src=src, dest=params['dest'], seconds=seconds,
+                  state_file=state_path(params['dest']), **stats)
+    if receiver.state.get('size') is not None:
+        result['size'] = receiver.state['size']
+    if stats['transferred'] and seconds:
+        result['rate_mb'] = round(stats['transferred'] / float(MB) / seconds, 1)
+    module.exit_json(**result)
+
+
+if __name__ == '__main__':
+    main()
@@ -3,12 +3,14 @@
 source ~/tmp/ansible/hacking/env-setup
 export PATH=$PATH:~/tmp/ansible/hacking/
 test-module -m esxi_vib.py -a 'mock=yes name=esx-ui state=present'
+test-module -m esxi_vib.py -a '{"vibs": [{"name": "esx-ui", "url": "http://x/esxui.vib"}], "state": "latest"}'
 
 export ANSIBLE_CONFIG=~/works/sysadm/ansible-study/esxi-mgmt/ansible.esxi.cfg
 ansible -m esxi_vib 'name=esx-ui state=present' --check nest1-m8
 '''
 
 from ansible.module_utils.basic import AnsibleModule
+from ansible.module_utils.esxi_esxcli import esxcli_cmd, parse_output, run_esxcli, PARSE_ERRORS
 
 ANSIBLE_METADATA = {'status': ['preview'],
                     'supported_by': 'committer',
@@ -21,12 +23,22 @@ short_description: manage VIB package installation on ESXi
 version_added: "2.2"
 description:
     - Manages installation, update and deinstallation of VIB packages on ESXi hosts.
+    - 'Several packages could be managed at once with C(vibs): installed set is listed
+       once, and all packages needing install (update, removal) are processed in one
+       C(esxcli software vib) transaction, so image database is rescanned only once.'
 options:
     name:
-        description: VIB package name
-        required: true
+        description: VIB package name (one of C(name) or C(vibs) is required)
+        required: false
     url:
         description: http url to package to install or update
+    vibs:
+        description:
+          - List of packages as dicts with C(name), C(url) and optional C(state)
+            (default is module C(state)).
+          - Per-package results are returned in C(vibs) dict keyed by name, with
+            C(action), C(changed), C(old_version) and C(new_version).
+        required: false
     state:
         description:
           - C(present) will make sure the package is installed.
@@ -49,47 +61,65 @@ EXAMPLES = '''
     name: esx-ui
     url:  http://distr.internal/vibs/esxui-signed-4974903.vib
 
+# install or update several packages in one transaction
+- name: inst vibs
+  esxi_vib:
+    vibs: "{{ vib_list }}"
+    state: latest
 '''
 
 
-def parse_cmd_responce(lines, skip_empty = True):
-    ''' parse multiline responce from "esxcli software vib", looking like
+def get_installed(module):
+    '''
+    snapshot of all installed VIBs: map "name -> record" from one
+    "esxcli software vib list"; keys are like "Name", "Version", "ID"
+    '''
+    _, recs, _, _ = run_esxcli(module, 'software vib list', formatter='csv',
+                               fail_msg="unable to list installed vibs")
+    return dict((rec['Name'], rec) for rec in recs if rec.get('Name'))
+
+
+def plan_action(state_new, installed):
+    ''' action (or None) to bring package to new state '''
+    if state_new == 'absent':
+        return 'remove' if installed else None
+    elif state_new == 'present':
+        return None if installed else 'install'
+    return 'update' if installed else 'install'
 
-              VMware_bootbank_esx-ui_0.0.2-0.1.3172496
-                 Name: esx-ui
-                 Version: 0.0.2-0.1.3172496
 
-        and extracts interesting attrs, mapping name to shorter version
-        mb using "esxcli --formatter=xml" would be wiser :)
+def run_transaction(module, action, vibs):
     '''
-    res = dict()
-    title = None
-    for line in lines.split('\n'):
-        if title is None:
-            title = line
-        elif line.startswith('   '):
-            key, val = line.lstrip().split(":", 1)
-            vals = val.lstrip()
-            if not (skip_empty and vals == ''):
-                res[key] = val.lstrip()
-
-    res['Title'] = title
-    return res
-
-
-def get_vib_state(module, vib_name, skip_empty = True):
-    ''' gets current state of VIB (installed or not) and version if installed'''
-    # also: 'esxcli software profile get' to view installed
-    ret, out, err = module.run_command("esxcli software vib get -n %s" % vib_name)
-    if ret != 0:
-        if out.lstrip().startswith('[NoMatchError]'):
-            return "absent", None
-        module.fail_json(msg="unable to get vib info", rc=ret, err=err, out=out)
-    details = parse_cmd_responce(out, skip_empty)
-    if 'Version' in details:
-        return "present", details
+    run one "esxcli software vib <action>" for all packages, returns
+    (command, result) where result is "InstallationResult" structure like
+    {"Message": "...", "Reboot Required": False, "VIBs Installed": [ids],
+     "VIBs Removed": [...], "VIBs Skipped": [...]}
+    '''
+    if action == 'remove':
+        args = ' '.join("-n {0}".format(vib['name']) for vib in vibs)
     else:
-        module.fail_json(msg="package %s is neither present nor absent" % vib_name, out=out, err=err)
+        args = ' '.join("-v {0}".format(vib['url']) for vib in vibs)
+    full_cmd = esxcli_cmd("software vib {0} {1}".format(action, args)) + \
+        (" --dry-run" if module.check_mode else '')
+    ret, out, err = module.run_command(full_cmd)
+    # "vib update" sometimes fail with empty message, but actual result is ok
+    if ret != 0 and action == 'update' and ret == 1 and err == "" and out.strip() in ("", "''"):
+        ret, out, err = module.run_command(full_cmd)
+        # result of retry does not matter: versions are compared after transaction
+        ret = 0
+    if ret != 0:
+        module.fail_json(msg="command failed", cmd=full_cmd, rc=ret, err=err, out=out)
+    try:
+        result = parse_output(out) or {}
+    except PARSE_ERRORS:
+        # failed update retried above: no usable output
+        result = {}
+    return full_cmd, result
+
+
+def planned_change(result):
+    ''' "InstallationResult" (of dry run) installs or removes something '''
+    return bool(result.get('VIBs Installed') or result.get('VIBs Removed'))
 
 
 def main():
@@ -98,55 +128,74 @@ def main():
     '''
     module = AnsibleModule(
         argument_spec = dict(
-            name = dict(required=True),
+            name = dict(required=False),
             state = dict(required=False, default='present', choices=['present', 'latest', 'absent']),
-            url = dict(required=False)
+            url = dict(required=False),
+            vibs = dict(required=False, type='list'),
         ),
         supports_check_mode=True,
+        required_one_of=[['name', 'vibs']],
+        mutually_exclusive=[['name', 'vibs']],
     )
-    vib_name = module.params['name']
-    vib_url = module.params['url']
-    state_new = module.params['state']
-    state_curr, details_curr = get_vib_state(module, vib_name)
-    command = None
-    action = None
-    if state_new == 'absent':
-        if state_curr != 'absent':
-            command = "esxcli software vib remove -n {0}".format(vib_name)
-            action = 'remove'
-    elif state_new == 'present':
-        if state_curr != 'present':
-            command = "esxcli software vib install -v {0}".format(vib_url)
-            action = 'install'
-    elif state_new == 'latest':
-        if state_curr == 'present':
-            command = "esxcli software vib update -v {0}".format(vib_url)
-            action = 'update'
-        else:
-            command = "esxcli software vib install -v {0}".format(vib_url)
-            action = 'install'
+    single = module.params['vibs'] is None
+    if single:
+        vibs = [{'name': module.params['name'], 'url': module.params['url']}]
     else:
-        module.fail_json(msg="unknown new state %s" % state_new)
-
-    if action is None:
-        module.exit_json(changed=False, msg="already ok: %s" % state_curr, details = details_curr)
-
-    full_cmd = command + (" --dry-run" if module.check_mode else '')
-    ret, out, err = module.run_command(full_cmd)
-    if ret != 0:
-        # "vib update" sometimes fail with empty message, but actual result is ok
-        if action == 'update' and ret == 1 and err == "" and out == "''\n":
-            ret2, out2, err2 = module.run_command(full_cmd)
-            state_new, details_new = get_vib_state(module, vib_name)
-            if details_curr['Version'] != details_new['Version']:
-                module.exit_json(changed = True, msg="update finished mostly ok :)")
-            else:
-                module.exit_json(changed = False, msg="update skipped mostly ok :)")
-        else:
-            module.fail_json(msg="command failed", cmd=full_cmd, rc=ret, err=err, out=out)
-    res_details = parse_cmd_responce(out)
-    changed = ('VIBs Installed' in res_details or 'VIBs Removed' in res_details)
-    module.exit_json(changed=changed, command=full_cmd, details=res_details)
+        vibs = module.params['vibs']
+    for vib in vibs:
+        if not isinstance(vib, dict) or not vib.get('name'):
+            module.fail_json(msg="bad vib entry (name is required): %s" % vib)
+        vib['state'] = vib.get('state') or module.params['state']
+        if vib['state'] not in ('present', 'latest', 'absent'):
+            module.fail_json(msg="unknown new state %s for %s" % (vib['state'], vib['name']))
+
+    installed = get_installed(module)
+    by_action = dict()
+    results = dict()
+    for vib in vibs:
+        curr = installed.get(vib['name'])
+        action = plan_action(vib['state'], curr)
+        results[vib['name']] = {'action': action, 'changed': False,
+                                'old_version': curr['Version'] if curr else None}
+        if action is not None:
+            if action != 'remove' and not vib.get('url'):
+                module.fail_json(msg="url is required to %s %s" % (action, vib['name']))
+            by_action.setdefault(action, []).append(vib)
+
+    if not by_action:
+        if single:
+            state_curr = 'present' if vibs[0]['name'] in installed else 'absent'
+            module.exit_json(changed=False, msg="already ok: %s" % state_curr,
+                             details=installed.get(vibs[0]['name']))
+        module.exit_json(changed=False, msg="already ok", vibs=results)
+
+    commands = []
+    res_details = dict()
+    # removals first, then installs and updates: one transaction each
+    for action in ('remove', 'install', 'update'):
+        if action not in by_action:
+            continue
+        full_cmd, res_details[action] = run_transaction(module, action, by_action[action])
+        commands.append(full_cmd)
+
+    if module.check_mode:
+        # nothing is changed yet: trust dry-run results
+        for (action, details) in res_details.items():
+            planned = planned_change(details)
+            for vib in by_action[action]:
+                results[vib['name']]['changed'] = planned
+    else:
+        installed_new = get_installed(module)
+        for vib in vibs:
+            res = results[vib['name']]
+            curr = installed_new.get(vib['name'])
+            res['new_version'] = curr['Version'] if curr else None
+            res['changed'] = res['new_version'] != res['old_version']
+    changed = any(res['changed'] for res in results.values())
+    if single:
+        module.exit_json(changed=changed, command=commands[0],
+                         details=res_details[results[vibs[0]['name']]['action']])
+    module.exit_json(changed=changed, commands=commands, details=res_details, vibs=results)
 
 if __name__ == '__main__':
     main()
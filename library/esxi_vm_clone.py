@@ -0,0 +1,620 @@
+#!/usr/bin/python
+'''
+source ~/tmp/ansible/hacking/env-setup
+export PATH=$PATH:~/tmp/ansible/hacking/
+test-module -m esxi_vm_clone.py -a '{"src": "/vmfs/volumes/nest-test-sys/phoenix11/phoenix11.vmx", "name": "vm1", "datastore": "nest-test-sys"}'
+
+export ANSIBLE_CONFIG=~/works/sysadm/ansible-study/esxi-mgmt/vm_deploy/ansible-deploy.esxi.cfg
+ansible -m esxi_vm_clone -a 'src=/vmfs/volumes/nest1-sys/phoenix11/phoenix11.vmx name=vm1 datastore=nest1-sys' --check nest1-m8
+
+local dry run w/o ESXi: stand-in scripts for vmkfstools (last arg is created file) and
+vim-cmd (prints VM id), datastores are plain dirs
+test-module -m esxi_vm_clone.py -a '{"src": "/tmp/ds1/tmpl/tmpl.vmx", "vms": [{"name": "vm1"}, {"name": "vm2"}], "datastore": "/tmp/ds1", "vmkfstools": "/tmp/bin/vmkfstools", "vim_cmd": "/tmp/bin/vim-cmd"}'
+'''
+
+from ansible.module_utils.basic import AnsibleModule
+from ansible.module_utils.esxi_vmx import VmxConfig, apply_operations
+import io
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+import time
+
+ANSIBLE_METADATA = {'status': ['preview'],
+                    'supported_by': 'committer',
+                    'version': '0.1'}
+
+DOCUMENTATION = '''
+---
+module: esxi_vm_clone
+short_description: clone VM from local template in one run
+version_added: "2.2"
+description:
+    - 'Clones VM on the same host in one remote run: checks source and destination,
+       prepares new config in memory (VM name in values, volatile params removed,
+       customizations from C(operations), extra disks), clones disks with
+       C(vmkfstools -i) while creating extra disks in parallel, writes configs
+       and registers new VM (optionally powering it on).'
+    - 'Everything is checked before the first change; if some step fails later,
+       all done so far is rolled back (processes stopped, VM unregistered, created
+       folders removed).'
+    - 'Time spent in each phase is returned in C(timings) (seconds, phases are
+       C(validate), C(config), C(queued), C(disks), C(register), C(power_on) and
+       C(total); C(config) is done right before disk jobs are started).'
+    - 'With C(vms) list several VMs are cloned in one run: all of them are checked
+       first, then disk jobs of all VMs are run in parallel, at most
+       C(datastore_limit) at once on each datastore (clone counts for both source and
+       destination one); each VM is registered as soon as its disks are done. Failed
+       VM is rolled back alone, others are kept. Results are in C(vms) dict keyed
+       by VM name (same fields as for single VM), order of completion in C(finished).'
+options:
+    src:
+        description: 'Path to source VM config (.vmx); disks must be in VM folder'
+        required: true
+    name:
+        description: 'New VM name (also folder and file names), required unless C(vms)
+            is set'
+    datastore:
+        description: 'Destination datastore, name or C(/vmfs/volumes/) path'
+        required: true
+    disk_format:
+        description: 'Format for cloned and created disks'
+        choices: [thin, zeroedthick, eagerzeroedthick]
+        default: thin
+    disks:
+        description:
+            - 'Extra empty disks, list of C({size, datastore}), like C({size: 10G,
+               datastore: nest-test-apps}); default datastore is the VM one.'
+            - 'Disks are named C(<name>-diskN.vmdk) and attached to free C(scsi0)
+               units.'
+        default: []
+    remove:
+        description: 'Volatile config keys to remove (shell-style patterns)'
+        default: [ethernet0.generatedAddress, uuid.location, uuid.bios, vc.uuid,
+                  sched.swap.derivedName]
+    operations:
+        description: 'Extra config changes, list of operations as for C(esxi_vmx)
+            (applied after VM rename and cleanup)'
+        default: []
+    register:
+        description: 'Register new VM'
+        default: True
+    power_on:
+        description: 'Power on new VM after registration'
+        default: False
+    vms:
+        description: 'List of VMs to clone, each is dict with C(name) and any of C(src),
+            C(datastore), C(disk_format), C(disks), C(remove), C(operations),
+            C(register), C(power_on) (defaults are module params)'
+        required: false
+    datastore_limit:
+        description: 'Max number of disk jobs running at once on each datastore'
+        default: 2
+    progress_file:
+        description: 'File on host to append progress lines to (like
+            C(12:01:02 vm1 finished /vmfs/.../vm1.vmdk in 43.1s)), for C(tail -f)'
+        required: false
+    vmkfstools:
+        description: 'C(vmkfstools) command (stand-in script for testing)'
+        default: vmkfstools
+    vim_cmd:
+        description: 'C(vim-cmd) command (stand-in script for testing)'
+        default: vim-cmd
+author: alex@maxidom.ru
+notes:
+    - works w/o vcenter via C(ssh)
+    - supports check mode (only validation is done)
+requirements: []
+'''
+
+EXAMPLES = '''
+- name: clone VM from template
+  esxi_vm_clone:
+    src: "{{ src_vm.path }}/{{ src_vm.name }}/{{ src_vm.name }}.vmx"
+    name: "{{ dst_vm.name }}"
+    datastore: "{{ dst_vm.path }}"
+    disks:
+      - { size: 10G, datastore: nest-test-apps }
+    operations:
+      - set:
+          annotation: "{{ dst_vm.desc }}"
+      - ovf_env:
+          hostname: "{{ dst_vm.name }}"
+    power_on: true
+  register: clone_res
+
+- name: clone branch stack, 2 disk copies per datastore at once
+  esxi_vm_clone:
+    src: "/vmfs/volumes/nest1-sys/phoenix11/phoenix11.vmx"
+    datastore: nest1-sys
+    vms:
+      - { name: dc1-vm }
+      - { name: files-vm, datastore: nest1-apps, disks: [{ size: 100G }] }
+    datastore_limit: 2
+    progress_file: /tmp/clone.log
+'''
+
+VOLUMES_DIR = '/vmfs/volumes'
+DISK_KEY_RE = re.compile(r'^(scsi|sata|ide|nvme)\d+:\d+\.filename$', re.IGNORECASE)
+SIZE_RE = re.compile(r'^\d+[KkMmGgTt]?$')
+DISK_FORMATS = ['thin', 'zeroedthick', 'eagerzeroedthick']
+# copied as is (besides .vmx)
+CONFIG_FILES = ['nvram', 'vmsd']
+DEFAULT_VOLATILE = ['ethernet0.generatedAddress', 'uuid.location', 'uuid.bios', 'vc.uuid',
+                    'sched.swap.derivedName']
+# per-VM params in "vms", defaults are taken from module params
+SPEC_PARAMS = ['src', 'name', 'datastore', 'disk_format', 'disks', 'remove', 'operations',
+               'register', 'power_on']
+# unit 7 is the controller itself
+SCSI_UNITS = [unit for unit in range(16) if unit != 7]
+POLL_INTERVAL = 0.5
+
+
+class CloneError(Exception):
+    ''' VM could not be cloned: bad params or failed step '''
+
+    def __init__(self, msg, **details):
+        Exception.__init__(self, msg)
+        self.details = details
+
+
+def datastore_path(datastore):
+    ''' "/vmfs/volumes/<ds>" from name or path '''
+    if datastore.startswith('/'):
+        return datastore.rstrip('/')
+    return os.path.join(VOLUMES_DIR, datastore)
+
+
+def source_disks(vmx, src_dir):
+    ''' list of (key, file name) for disks in source config '''
+    disks = []
+    for key in vmx.keys():
+        value = vmx.get(key)
+        if not DISK_KEY_RE.match(key) or not value.lower().endswith('.vmdk'):
+            continue
+        if '/' in value:
+            raise CloneError("only disks in VM folder could be cloned: %s = %s" % (key, value))
+        if not os.path.isfile(os.path.join(src_dir, value)):
+            raise CloneError("source disk not found: %s = %s" % (key, value))
+        disks.append((key, value))
+    return disks
+
+
+def extra_disks(vmx, disks_spec, name, dst_dir):
+    ''' list of {size, dir, path, unit} for extra disks, checked '''
+    disks = []
+    if not disks_spec:
+        return disks
+    if vmx.get('scsi0.present', '').lower() != 'true':
+        raise CloneError("extra disks require scsi0 controller in source config")
+    units = [unit for unit in SCSI_UNITS
+             if 'scsi0:%d.present' % unit not in vmx and 'scsi0:%d.fileName' % unit not in vmx]
+    for (num, disk) in enumerate(disks_spec, 1):
+        if not isinstance(disk, dict) or not SIZE_RE.match(str(disk.get('size', ''))):
+            raise CloneError("bad extra disk (dict with size like 10G expected): %s" % disk)
+        if not units:
+            raise CloneError("no free scsi0 units for extra disk %d" % num)
+        disk_dir = dst_dir
+        if disk.get('datastore'):
+            ds_path = datastore_path(disk['datastore'])
+            if not os.path.isdir(ds_path):
+                raise CloneError("datastore for extra disk %d not found: %s" % (num, ds_path))
+            disk_dir = os.path.join(ds_path, name)
+            if disk_dir != dst_dir and os.path.exists(disk_dir):
+                raise CloneError("folder for extra disk %d already exists: %s" % (num, disk_dir))
+        disks.append({'size': str(disk['size']), 'dir': disk_dir, 'unit': units.pop(0),
+                      'path': os.path.join(disk_dir, "%s-disk%d.vmdk" % (name, num))})
+    return disks
+
+
+def extra_disk_conf(disk, dst_dir):
+    ''' "set" operation to attach extra disk '''
+    prefix = 'scsi0:%d.' % disk['unit']
+    file_name = disk['path']
+    if disk['dir'] == dst_dir:
+        file_name = os.path.basename(file_name)
+    return {'set': {prefix + 'deviceType': 'scsi-hardDisk', prefix + 'fileName': file_name,
+                    prefix + 'present': 'TRUE', prefix + 'redo': ''}}
+
+
+class Job(object):
+    ''' background disk command (clone or create) '''
+
+    def __init__(self, vm, argv, label, datastores):
+        self.vm = vm
+        self.argv = argv
+        self.label = label
+        # real paths of datastores used by command, for concurrency limits
+        self.datastores = datastores
+        self.proc = None
+        self.output = None
+        self.started = None
+
+    def start(self):
+        ''' start command, output is kept in temp file '''
+        self.vm.commands.append(' '.join(self.argv))
+        self.output = tempfile.TemporaryFile()
+        self.proc = subprocess.Popen(self.argv, stdout=self.output, stderr=subprocess.STDOUT)
+        self.started = time.time()
+
+    def stop(self):
+        if self.proc.poll() is None:
+            self.proc.terminate()
+            self.proc.wait()
+
+    def read_output(self):
+        self.output.seek(0)
+        return self.output.read().decode('utf-8', 'replace')
+
+
+class VmClone(object):
+    ''' one VM: checked clone plan, progress, timings and things to roll back '''
+
+    def __init__(self, module, spec):
+        self.module = module
+        self.name = spec['name']
+        self.commands = []
+        self.created_dirs = []
+        self.jobs = []
+        self.vmid = None
+        self.error = None
+        self.details = dict()
+        self.rollback_errors = []
+        self.ready = False
+        self.finished_at = None
+        self.disks_started = None
+        self.timings = dict()
+        self.disk_timings = dict()
+        started = time.time()
+        self.prepare(spec)
+        self.timings['validate'] = round(time.time() - started, 2)
+
+    def prepare(self, spec):
+        ''' check everything and build new config in memory; raises CloneError '''
+        for param in ['src', 'name', 'datastore']:
+            if not spec.get(param):
+                raise CloneError("%s is required" % param)
+        if spec['disk_format'] not in DISK_FORMATS:
+            raise CloneError("disk_format must be one of %s" % ', '.join(DISK_FORMATS))
+        if spec['power_on'] and not spec['register']:
+            raise CloneError("power_on requires register")
+        self.register = spec['register']
+        self.power_on = spec['power_on']
+        name = self.name
+        src_vmx = spec['src']
+        src_dir = os.path.dirname(src_vmx)
+        src_name = os.path.basename(src_vmx)
+        if src_name.endswith('.vmx'):
+            src_name = src_name[:-len('.vmx')]
+        try:
+            with io.open(src_vmx, encoding='utf-8', newline='') as vmx_file:
+                vmx = VmxConfig(vmx_file.read())
+        except (IOError, OSError) as e:
+            raise CloneError("unable to read source config %s: %s" % (src_vmx, e))
+        dst_root = datastore_path(spec['datastore'])
+        if not os.path.isdir(dst_root):
+            raise CloneError("destination datastore not found: %s" % dst_root)
+        dst_dir = os.path.join(dst_root, name)
+        if os.path.exists(dst_dir):
+            raise CloneError("destination folder already exists: %s" % dst_dir)
+
+        src_disks = source_disks(vmx, src_dir)
+        new_disks = extra_disks(vmx, spec['disks'], name, dst_dir)
+        config_files = [(os.path.join(src_dir, "%s.%s" % (src_name, ext)),
+                         os.path.join(dst_dir, "%s.%s" % (name, ext))) for ext in CONFIG_FILES]
+        self.config_files = [(src, dst) for (src, dst) in config_files if os.path.isfile(src)]
+
+        operations = [{'rename_prefix': {src_name: name}},
+                      {'remove': spec['remove']},
+                      {'set': {'displayName': name}}]
+        operations.extend(spec['operations'])
+        operations.extend(extra_disk_conf(disk, dst_dir) for disk in new_disks)
+        try:
+            self.changed_keys = apply_operations(vmx, operations)
+        except ValueError as e:
+            raise CloneError(str(e))
+        # cloned disk names: from new config, after rename
+        disks = [{'src': os.path.join(src_dir, src_file), 'dst': vmx.get(key)}
+                 for (key, src_file) in src_disks]
+        dst_files = [disk['dst'] for disk in disks]
+        if len(set(dst_files)) != len(dst_files) or any('/' in dst for dst in dst_files):
+            raise CloneError("cloned disk names are not unique or not in VM folder: %s" %
+                             ', '.join(dst_files))
+        for disk in disks:
+            disk['dst'] = os.path.join(dst_dir, disk['dst'])
+
+        self.vmx = vmx
+        self.vmx_path = os.path.join(dst_dir, name + '.vmx')
+        self.dst_dir = dst_dir
+        self.dirs = [dst_dir] + sorted(set(disk['dir'] for disk in new_disks) - set([dst_dir]))
+        self.disks = disks
+        self.new_disks = new_disks
+        src_ds = os.path.realpath(os.path.dirname(src_dir))
+        dst_ds = os.path.realpath(dst_root)
+        vmkfstools = self.module.params['vmkfstools']
+        for disk in disks:
+            self.jobs.append(Job(self, [vmkfstools, '-i', disk['src'], '-d', spec['disk_format'],
+                                        disk['dst']],
+                                 disk['dst'], set([src_ds, dst_ds])))
+        for disk in new_disks:
+            self.jobs.append(Job(self, [vmkfstools, '-c', disk['size'], '-d', spec['disk_format'],
+                                        disk['path']],
+                                 disk['path'], set([os.path.realpath(os.path.dirname(disk['dir']))])))
+        self.jobs_left = len(self.jobs)
+
+    def run(self, argv):
+        ''' run command, returns (ret, out, err) '''
+        self.commands.append(' '.join(argv))
+        return self.module.run_command(argv)
+
+    def setup(self):
+        ''' create folders and write configs (once, before the first disk job) '''
+        if self.ready:
+            return
+        started = time.time()
+        try:
+            for path in self.dirs:
+                os.mkdir(path)
+                self.created_dirs.append(path)
+            with io.open(self.vmx_path, 'w', encoding='utf-8', newline='') as vmx_file:
+                vmx_file.write(self.vmx.render())
+            for (src, dst) in self.config_files:
+                shutil.copyfile(src, dst)
+        except (IOError, OSError) as e:
+            raise CloneError("unable to write config: %s" % e)
+        self.ready = True
+        self.timings['config'] = round(time.time() - started, 2)
+
+    def job_started(self, job, run_started):
+        if self.disks_started is None:
+            self.disks_started = job.started
+            self.timings['queued'] = round(job.started - run_started, 2)
+
+    def job_done(self, job):
+        self.jobs_left -= 1
+        self.disk_timings[job.label] = round(time.time() - job.started, 2)
+        if not self.jobs_left:
+            self.timings['disks'] = round(time.time() - self.disks_started, 2)
+
+    def finish(self):
+        ''' register and power on; raises CloneError '''
+        if self.register:
+            started = time.time()
+            ret, out, err = self.run([self.module.params['vim_cmd'], 'solo/registervm',
+                                      self.vmx_path, self.name])
+            if ret != 0 or not out.strip().isdigit():
+                raise CloneError("unable to register VM", rc=ret, out=out, err=err)
+            self.vmid = out.strip()
+            self.timings['register'] = round(time.time() - started, 2)
+        if self.power_on:
+            started = time.time()
+            ret, out, err = self.run([self.module.params['vim_cmd'], 'vmsvc/power.on', self.vmid])
+            if ret != 0:
+                raise CloneError("unable to power on VM", rc=ret, out=out, err=err)
+            self.timings['power_on'] = round(time.time() - started, 2)
+
+    def fail(self, msg, **details):
+        ''' undo everything done so far for this VM (disk jobs are already stopped) '''
+        self.error = msg
+        self.details = details
+        if self.vmid is not None:
+            ret, out, err = self.module.run_command([self.module.params['vim_cmd'],
+                                                     'vmsvc/unregister', self.vmid])
+            if ret != 0:
+                self.rollback_errors.append("unable to unregister VM %s: %s" %
+                                            (self.vmid, err or out))
+            else:
+                self.vmid = None
+        for path in reversed(self.created_dirs):
+            try:
+                shutil.rmtree(path)
+            except (IOError, OSError) as e:
+                self.rollback_errors.append("unable to remove %s: %s" % (path, e))
+
+    def result(self, run_started):
+        ''' per-VM result dict '''
+        res = dict(vmx=self.vmx_path, changed_keys=self.changed_keys, commands=self.commands,
+                   disks=[{'src': disk['src'], 'dst': disk['dst']} for disk in self.disks],
+                   extra_disks=[{'path': disk['path'], 'size': disk['size'],
+                                 'unit': 'scsi0:%d' % disk['unit']} for disk in self.new_disks],
+                   disk_timings=self.disk_timings, timings=self.timings,
+                   changed=bool(self.created_dirs) and not self.error)
+        if self.finished_at is not None:
+            self.timings['total'] = round(self.finished_at - run_started, 2)
+        if self.vmid is not None:
+            res['vmid'] = int(self.vmid)
+        if self.error is not None:
+            res.update(self.details)
+            res.update(msg=self.error, failed=True, rolled_back=not self.rollback_errors,
+                       rollback_errors=self.rollback_errors)
+        return res
+
+
+def progress_logger(path):
+    ''' function to append "time vm event" lines to progress file (if set) '''
+    def log(vm, event):
+        if not path:
+            return
+        try:
+            with open(path, 'a') as progress_file:
+                progress_file.write("%s %s %s\n" % (time.strftime('%H:%M:%S'), vm.name, event))
+        except (IOError, OSError):
+            pass
+    return log
+
+
+def run_clones(vms, limit, progress):
+    '''
+    run disk jobs of all VMs with at most "limit" jobs per datastore at once (clone
+    counts for both source and destination); each VM is registered as soon as its
+    disks are done; returns VMs in order of completion
+    '''
+    run_started = time.time()
+    pending = [job for vm in vms for job in vm.jobs]
+    running = []
+    busy = dict()
+    finished = []
+
+    def release(job):
+        running.remove(job)
+        for ds in job.datastores:
+            busy[ds] -= 1
+
+    def done(vm, error=None):
+        if error is not None:
+            for job in [job for job in running if job.vm is vm]:
+                job.stop()
+                release(job)
+            vm.fail(str(error), **error.details)
+            progress(vm, "failed: %s" % error)
+        else:
+            progress(vm, "done" + (" (vmid %s)" % vm.vmid if vm.vmid else ""))
+        vm.finished_at = time.time()
+        finished.append(vm)
+
+    for vm in vms:
+        if not vm.jobs:
+            try:
+                vm.setup()
+                vm.finish()
+            except CloneError as e:
+                done(vm, e)
+            else:
+                done(vm)
+    while pending or running:
+        for job in list(pending):
+            if job.vm.error is not None:
+                pending.remove(job)
+                continue
+            if any(busy.get(ds, 0) >= limit for ds in job.datastores):
+                continue
+            pending.remove(job)
+            try:
+                job.vm.setup()
+                job.start()
+            except (IOError, OSError) as e:
+                done(job.vm, CloneError("unable to start %s: %s" % (job.argv[0], e)))
+                continue
+            except CloneError as e:
+                done(job.vm, e)
+                continue
+            running.append(job)
+            for ds in job.datastores:
+                busy[ds] = busy.get(ds, 0) + 1
+            job.vm.job_started(job, run_started)
+            progress(job.vm, "started %s" % job.label)
+        for job in list(running):
+            if job not in running:
+                # stopped with failed VM
+                continue
+            ret = job.proc.poll()
+            if ret is None:
+                continue
+            release(job)
+            if ret != 0:
+                done(job.vm, CloneError("unable to create disk %s" % job.label,
+                                        rc=ret, out=job.read_output()))
+                continue
+            job.vm.job_done(job)
+            progress(job.vm, "finished %s in %.1fs" % (job.label, job.vm.disk_timings[job.label]))
+            if not job.vm.jobs_left:
+                try:
+                    job.vm.finish()
+                except CloneError as e:
+                    done(job.vm, e)
+                else:
+                    done(job.vm)
+        if running:
+            time.sleep(POLL_INTERVAL)
+    return finished
+
+
+def main():
+    ''' entry point: validate all VMs, then clone them with limited concurrency '''
+    module = AnsibleModule(
+        argument_spec = dict(
+            src = dict(required=False, type='path'),
+            name = dict(required=False, type='str'),
+            datastore = dict(required=False, type='str'),
+            disk_format = dict(required=False, type='str', default='thin', choices=DISK_FORMATS),
+            disks = dict(required=False, type='list', default=[]),
+            remove = dict(required=False, type='list', default=DEFAULT_VOLATILE),
+            operations = dict(required=False, type='list', default=[]),
+            register = dict(required=False, type='bool', default=True),
+            power_on = dict(required=False, type='bool', default=False),
+            vms = dict(required=False, type='list'),
+            datastore_limit = dict(required=False, type='int', default=2),
+            progress_file = dict(required=False, type='path'),
+            vmkfstools = dict(required=False, type='str', default='vmkfstools'),
+            vim_cmd = dict(required=False, type='str', default='vim-cmd'),
+        ),
+        mutually_exclusive=[['vms', 'name']],
+        supports_check_mode=True,
+    )
+    params = module.params
+    batch = params['vms'] is not None
+    if params['datastore_limit'] < 1:
+        module.fail_json(msg="datastore_limit must be positive")
+    started = time.time()
+
+    # validate everything before the first change
+    defaults = dict((param, params[param]) for param in SPEC_PARAMS)
+    specs = []
+    for item in (params['vms'] if batch else [dict()]):
+        if not isinstance(item, dict):
+            module.fail_json(msg="bad VM spec (dict expected): %s" % item)
+        unknown = sorted(set(item) - set(SPEC_PARAMS))
+        if unknown:
+            module.fail_json(msg="unknown VM spec params: %s" % ', '.join(unknown))
+        spec = dict(defaults)
+        spec.update(item)
+        specs.append(spec)
+    names = [spec['name'] for spec in specs]
+    dups = sorted(set(name for name in names if names.count(name) > 1))
+    if dups:
+        module.fail_json(msg="duplicate VM names: %s" % ', '.join(dups))
+    vms = []
+    errors = []
+    for spec in specs:
+        try:
+            vms.append(VmClone(module, spec))
+        except CloneError as e:
+            if not batch:
+                module.fail_json(msg=str(e), **e.details)
+            errors.append("%s: %s" % (spec['name'], e))
+    if errors:
+        module.fail_json(msg="; ".join(errors))
+    timings = dict(validate=round(time.time() - started, 2))
+
+    if module.check_mode:
+        for vm in vms:
+            vm.commands = [' '.join(job.argv) for job in vm.jobs]
+    else:
+        finished = run_clones(vms, params['datastore_limit'], progress_logger(params['progress_file']))
+    timings['total'] = round(time.time() - started, 2)
+
+    if not batch:
+        vm = vms[0]
+        result = vm.result(started)
+        if module.check_mode:
+            result['changed'] = True
+        if vm.error is not None:
+            module.fail_json(**result)
+        module.exit_json(**result)
+
+    results = dict((vm.name, vm.result(started)) for vm in vms)
+    result = dict(vms=results, timings=timings,
+                  changed=module.check_mode or any(res['changed'] for res in results.values()))
+    if not module.check_mode:
+        result['finished'] = [vm.name for vm in finished]
+        failed = [vm.name for vm in vms if vm.error is not None]
+        if failed:
+            module.fail_json(msg="unable to clone VMs: %s" % ', '.join(failed),
+                             failed_vms=failed, **result)
+    module.exit_json(**result)
+
+
+if __name__ == '__main__':
+    main()
@@ -2,13 +2,18 @@
 '''
 source ~/tmp/ansible/hacking/env-setup
 export PATH=$PATH:~/tmp/ansible/hacking/
-test-module -m esxi_vm_list.py -a 'mock=yes'
+test-module -m esxi_vm_list.py -a 'mock=yes mock_dir=experiments/mocks'
+test-module -m esxi_vm_list.py -a 'mock=yes mock_dir=experiments/mocks get_power_state=yes power_method=loop'
 
 export ANSIBLE_CONFIG=~/works/sysadm/ansible-study/esxi-mgmt/ansible.esxi.cfg
 ansible -m esxi_vm_list nest1-m8
 '''
 
 from ansible.module_utils.basic import AnsibleModule
+from ansible.module_utils.esxi_inventory import load_inventory, LOAD_ERRORS as INVENTORY_ERRORS
+from ansible.module_utils.esxi_vimcmd import parse_autostart_seq, parse as parse_vimcmd
+import csv
+import os
 import re
 
 ANSIBLE_METADATA = {'status': ['preview'],
@@ -27,7 +32,20 @@ description:
     - 'Optional are C(start_by_vm) (VM name => autostart sequence number, absent
       if VM is not started automatically) and C(power_by_vm) (VM name => current power
       state, C(true) if powered on).'
+    - 'Extended facts are selected with C(gather) and collected for all VMs in one
+      remote shell loop: C(resources_by_vm), C(disks_by_vm), C(guest_by_vm), keyed by
+      VM name like C(id_by_vm).'
 options:
+    gather:
+        description:
+            - 'List of attribute groups to collect, any of C(start) (same as
+              C(get_start_state)), C(power) (same as C(get_power_state)),
+              C(resources) (CPUs, memory, storage usage), C(disks) (virtual disks
+              with backing file, size and thin flag), C(guest) (guest OS, hostname,
+              IP and tools state, requires VMware tools in guest).'
+            - 'C(resources) and C(guest) come from C(vmsvc/get.summary), C(disks) from
+              C(vmsvc/device.getdevices); groups not requested cost nothing.'
+        default: []
     get_start_state:
         description: include C(start_by_vm) dictionary with startup sequence
         default: False
@@ -35,13 +53,39 @@ options:
         description:
             - include C(power_by_vm) dictionary with power state.
             - C(true) means VM is currently powered on.
-            - Takes longer to calculate.
         default: False
+    power_method:
+        description:
+            - 'How to collect power state: C(process_list) parses single
+              C(esxcli vm process list) (running VMs have VMX process),
+              C(loop) runs C(power.getstate) for all VMs in one remote shell loop,
+              C(per_vm) calls C(power.getstate) separately for each VM (slowest).'
+        choices: ["process_list", "loop", "per_vm"]
+        default: "process_list"
+    vm_list_source:
+        description:
+            - 'Where to get VM list from: C(inventory) reads hostd C(vmInventory.xml) and
+              VM names from C(.vmx) directly (result is cached on host while files are not
+              changed), C(vim-cmd) parses C(vim-cmd vmsvc/getallvms), C(auto) tries
+              inventory first and falls back to C(vim-cmd).'
+            - 'Source actually used is returned as C(vm_list_source).'
+        choices: ["auto", "inventory", "vim-cmd"]
+        default: "auto"
+    mock:
+        description: 'Use mock files from C(mock_dir) instead of real commands (for testing)'
+        default: False
+    mock_dir:
+        description:
+            - 'Dir with mock files (on host where module runs): C(getallvms.txt),
+              C(get_autostartseq.txt), C(power.getstate.txt), C(power.getstate.loop.txt),
+              C(vm_process_list.csv), C(vm_details.txt).'
+        default: "mocks"
 requirements: []
 author: alex@maxidom.ru
 notes:
     - works w/o vcenter via C(ssh)
     - VM id is string as C(vm_by_id) key because C(int) could not be a key in JSON
+    - C(commands_run) in result is number of commands executed on host (to compare methods)
 '''
 
 EXAMPLES = '''
@@ -59,20 +103,88 @@ EXAMPLES = '''
     order: "{{ item.order | default(omit) }}"
   with_items: "{{ vms_to_start }}"
   when: item.name in vminfo.id_by_vm
+
+# capacity planning: CPU/memory and disks of all VMs
+- name: get vm resources
+  esxi_vm_info:
+    gather: [power, resources, disks]
+  register: vminfo
 '''
 
-MOCK_DIR = '/Users/alex/works/sysadm/ansible-study/esxi-mgmt/experiments/mocks'
+# either cat mock files from "mock_dir" (for test) or run actual cmds (for real)
+COMMANDS = {
+    'real': {
+        'get_vmlist': 'vim-cmd vmsvc/getallvms',
+        'get_autoruns': 'vim-cmd hostsvc/autostartmanager/get_autostartseq',
+        'get_power': 'vim-cmd vmsvc/power.getstate {vm_id}',
+        # one shell for all VMs: still a hostd call per VM, but no per-call ssh/exec overhead
+        'get_power_loop': 'for id in {vm_ids}; do ' +
+                          'echo "$id $(vim-cmd vmsvc/power.getstate $id | tail -n 1)"; done',
+        'get_processes': 'esxcli --formatter=csv vm process list',
+        # details for all VMs in one go, separated with marker lines
+        'get_details_loop': 'for id in {vm_ids}; do echo "{marker} $id"; {body}done',
+        'get_summary': 'vim-cmd vmsvc/get.summary $id; ',
+        'get_devices': 'echo "{marker}"; vim-cmd vmsvc/device.getdevices $id; ',
+    },
+    'mock': {
+        'get_vmlist': 'cat {mock_dir}/getallvms.txt',
+        'get_autoruns': 'cat {mock_dir}/get_autostartseq.txt',
+        'get_power': 'cat {mock_dir}/power.getstate.txt',
+        'get_power_loop': 'cat {mock_dir}/power.getstate.loop.txt',
+        'get_processes': 'cat {mock_dir}/vm_process_list.csv',
+        'get_details_loop': 'cat {mock_dir}/vm_details.txt',
+        'get_summary': '',
+        'get_devices': '',
+    },
+}
+
+DETAILS_MARKER = '@@esxi_vm_info'
+DETAILS_SPLIT_RE = re.compile(r'^%s( \d+)?$' % DETAILS_MARKER, re.MULTILINE)
+GATHER_GROUPS = ['start', 'power', 'resources', 'disks', 'guest']
+
+
+class CmdRunner(object):
+    ''' runs real or mock commands, counting them for stats '''
+
+    def __init__(self, module):
+        self.module = module
+        self.mock = module.params['mock']
+        self.mock_dir = module.params['mock_dir']
+        if self.mock:
+            self.commands = COMMANDS['mock']
+        else:
+            self.commands = COMMANDS['real']
+        self.count = 0
+
+    def run(self, cmd_name, fail_msg=None, use_unsafe_shell=False, **kwargs):
+        ''' run named command with args, fail with fail_msg on error if set '''
+        cmd = self.commands[cmd_name].format(mock_dir=self.mock_dir, **kwargs)
+        self.count += 1
+        ret, out, err = self.module.run_command(cmd, use_unsafe_shell=use_unsafe_shell)
+        if ret != 0 and fail_msg is not None:
+            self.module.fail_json(msg=fail_msg, cmd=cmd, rc=ret, err=err)
+        return ret, out, err
 
 
-def load_vm_list(module):
-    ''' construct map "vm_name -> vm_id" from file or program '''
+def load_vm_list(runner, source='auto'):
+    '''
+    construct maps "vm_name -> vm_id", "vm_id -> vm_name" and "vm_name -> vmx path"
+    from hostd inventory file (cached) or "vim-cmd vmsvc/getallvms" output
+    '''
     id_by_vm = dict()
     vm_by_id = dict()
     path_by_vm = dict()
-    # ret, out, err = module.run_command('cat %s/getallvms.txt' % MOCK_DIR)
-    ret, out, err = module.run_command('vim-cmd vmsvc/getallvms')
-    if ret != 0:
-        module.fail_json(msg="unable to get vm list", rc=ret, err=err)
+    if source != 'vim-cmd' and not runner.mock:
+        try:
+            for vm in load_inventory():
+                id_by_vm[vm['name']] = vm['id']
+                vm_by_id[str(vm['id'])] = vm['name']
+                path_by_vm[vm['name']] = vm['path']
+            return vm_by_id, id_by_vm, path_by_vm, 'inventory'
+        except INVENTORY_ERRORS as e:
+            if source == 'inventory':
+                runner.module.fail_json(msg="unable to read vm inventory: %s" % e)
+    ret, out, err = runner.run('get_vmlist', fail_msg="unable to get vm list")
     for line in out.split('\n'):
         if line.startswith('Vmid') or line == '':
             continue
@@ -83,85 +195,223 @@ def load_vm_list(module):
         id_by_vm[lparts.group("name")] = int(lparts.group("id"))
         vm_by_id[lparts.group("id")] = lparts.group("name")
         path_by_vm[lparts.group("name")] = "/vmfs/volumes/" + lparts.group("store") + "/" + lparts.group("path") + "/" + lparts.group("file") + ".vmx"
-    return vm_by_id, id_by_vm, path_by_vm
+    return vm_by_id, id_by_vm, path_by_vm, 'vim-cmd'
 
 
-def load_startup_list(module, vm_by_id):
+def load_startup_list(runner, vm_by_id):
     '''
     construct map "vm_name -> autostart_order" for autostart
     if machine is not in list
     '''
     sinfo = dict()
-    vm_name = ''
-    vm_enabled = False
-    vm_order = 0
-    # for line in file(STARTUP_FILE):
-    # or subprocess.Popen + res.stdout.readlines
-    # for line in os.popen("cat %s" % STARTUP_FILE).readlines():
-    ret, out, err = module.run_command('vim-cmd hostsvc/autostartmanager/get_autostartseq')
-    if ret != 0:
-        module.fail_json(msg="unable go get startup list", rc=ret, err=err)
-    for line in out.split('\n'):
-        if line.lstrip().startswith(('(', '}', ']')) or line == '':
-            continue
-        (key, _, val) = line.strip("', \n").strip().split()
-        if key == 'key':
-            # key = 'vim.VirtualMachine:3',
-            vm_name = vm_by_id[val.split(":")[1]]
-            vm_enabled = False
-            vm_order = 0
-        elif key == 'startOrder':
-            vm_order = int(val)
-            if vm_enabled:
-                sinfo[vm_name] = vm_order
-            #sinfo[vm_name] = vm_order
-        elif key == 'startAction':
-            # could be 'PowerOn' and 'powerOn'
-            if str.lower(val.strip('"')) == 'poweron':
-                vm_enabled = True
-                if vm_order > 0:
-                    sinfo[vm_name] = vm_order
-            else:
-                vm_enabled = False
+    ret, out, err = runner.run('get_autoruns', fail_msg="unable go get startup list")
+    for (vm_id, entry) in parse_autostart_seq(out).items():
+        vm_name = vm_by_id.get(str(vm_id))
+        # could be 'PowerOn' and 'powerOn'
+        if vm_name is not None and entry['order'] > 0 and \
+                str(entry['action']).lower() == 'poweron':
+            sinfo[vm_name] = entry['order']
     return sinfo
 
 
-def load_power_list(module, vm_by_id):
+def load_power_list(runner, vm_by_id):
     '''
-    make map "vm_name -> power_state
+    make map "vm_name -> power_state", one power.getstate call per VM
     '''
     pinfo = dict()
     for (vm_id, vm_name) in vm_by_id.items():
-        ret, out, err = module.run_command('vim-cmd vmsvc/power.getstate %s' % vm_id)
+        ret, out, err = runner.run('get_power', vm_id=vm_id)
         if out.endswith("on\n"):
             pinfo[vm_name] = True
         else:
             pinfo[vm_name] = False
     return pinfo
 
+
+def load_power_list_loop(runner, vm_by_id):
+    '''
+    make map "vm_name -> power_state" with one shell loop over all VMs;
+    output lines are like "12 Powered on"
+    '''
+    pinfo = dict((vm_name, False) for vm_name in vm_by_id.values())
+    if not vm_by_id:
+        return pinfo
+    ret, out, err = runner.run('get_power_loop', fail_msg="unable to get power states",
+                               use_unsafe_shell=True, vm_ids=' '.join(sorted(vm_by_id)))
+    for line in out.split('\n'):
+        lparts = line.split(' ', 1)
+        if len(lparts) == 2 and lparts[0] in vm_by_id:
+            pinfo[vm_by_id[lparts[0]]] = lparts[1].rstrip().endswith("on")
+    return pinfo
+
+
+def load_power_list_processes(runner, vm_by_id, path_by_vm):
+    '''
+    make map "vm_name -> power_state" from single "esxcli vm process list":
+    powered on VM is the one with running VMX process; csv columns are like
+      ConfigFile,DisplayName,ProcessID,UUID,VMXCartelID,WorldID,
+    process config path is on datastore UUID, not name, so if display name does
+    not match (renamed VM) resolve both paths to compare
+    '''
+    pinfo = dict((vm_name, False) for vm_name in vm_by_id.values())
+    ret, out, err = runner.run('get_processes', fail_msg="unable to get vm process list")
+    unmatched = []
+    for rec in csv.DictReader(out.splitlines()):
+        vm_name = rec.get('DisplayName')
+        if vm_name in pinfo:
+            pinfo[vm_name] = True
+        elif rec.get('ConfigFile'):
+            unmatched.append(os.path.realpath(rec['ConfigFile']))
+    if unmatched:
+        name_by_path = dict((os.path.realpath(path), vm_name)
+                            for (vm_name, path) in path_by_vm.items())
+        for path in unmatched:
+            if path in name_by_path:
+                pinfo[name_by_path[path]] = True
+    return pinfo
+
+def load_details(runner, vm_by_id, summary, devices):
+    '''
+    run get.summary and/or device.getdevices for all VMs in one shell loop,
+    return maps "vm_name -> parsed summary" and "vm_name -> parsed devices"
+    '''
+    summary_by_vm = dict()
+    devices_by_vm = dict()
+    if not vm_by_id or not (summary or devices):
+        return summary_by_vm, devices_by_vm
+    body = ''
+    if summary:
+        body += runner.commands['get_summary']
+    if devices:
+        body += runner.commands['get_devices'].format(marker=DETAILS_MARKER)
+    ret, out, err = runner.run('get_details_loop', fail_msg="unable to get vm details",
+                               use_unsafe_shell=True, vm_ids=' '.join(sorted(vm_by_id)),
+                               marker=DETAILS_MARKER, body=body)
+    # split gives ['', ' id1', summary, None, devices, ' id2', ...]
+    parts = DETAILS_SPLIT_RE.split(out)
+    vm_name = None
+    in_devices = False
+    for idx in range(1, len(parts), 2):
+        if parts[idx] is not None:
+            vm_name = vm_by_id.get(parts[idx].strip())
+            in_devices = False
+        else:
+            in_devices = True
+        if vm_name is None:
+            continue
+        parsed = parse_vimcmd(parts[idx + 1])
+        if parsed is None:
+            continue
+        if in_devices:
+            devices_by_vm[vm_name] = parsed
+        else:
+            summary_by_vm[vm_name] = parsed
+    return summary_by_vm, devices_by_vm
+
+
+def compact_resources(summary):
+    ''' resources group from parsed get.summary '''
+    config = summary.get('config') or {}
+    storage = summary.get('storage') or {}
+    stats = summary.get('quickStats') or {}
+    return {'cpus': config.get('numCpu'),
+            'memory_mb': config.get('memorySizeMB'),
+            'nics': config.get('numEthernetCards'),
+            'disks': config.get('numVirtualDisks'),
+            'storage_committed': storage.get('committed'),
+            'storage_uncommitted': storage.get('uncommitted'),
+            'cpu_usage_mhz': stats.get('overallCpuUsage'),
+            'memory_usage_mb': stats.get('guestMemoryUsage')}
+
+
+def compact_guest(summary):
+    ''' guest group from parsed get.summary '''
+    guest = summary.get('guest') or {}
+    return {'guest_os': guest.get('guestFullName'),
+            'hostname': guest.get('hostName'),
+            'ip': guest.get('ipAddress'),
+            'tools_status': guest.get('toolsRunningStatus')}
+
+
+def compact_disks(devices):
+    ''' list of virtual disks from parsed device.getdevices '''
+    disks = []
+    for dev in devices.get('device') or []:
+        if not isinstance(dev, dict) or dev.get('_type') != 'vim.vm.device.VirtualDisk':
+            continue
+        backing = dev.get('backing') or {}
+        disks.append({'label': (dev.get('deviceInfo') or {}).get('label'),
+                      'file': backing.get('fileName'),
+                      'capacity_kb': dev.get('capacityInKB'),
+                      'thin': backing.get('thinProvisioned')})
+    return disks
+
+
 def main():
     ''' entry point, simple one for now
-        run mock: test-module -m esxi_vm_list.py
+        run mock: test-module -m esxi_vm_list.py -a "mock=yes mock_dir=..."
         run real: ansible     -m esxi_vm_list nest1-m8
     '''
     module = AnsibleModule(
         argument_spec = dict(
             get_start_state = dict(required=False, type='bool', default=False),
             get_power_state = dict(required=False, type='bool', default=False),
+            gather = dict(required=False, type='list', default=[]),
+            power_method = dict(required=False, type='str', default='process_list',
+                                choices=['process_list', 'loop', 'per_vm']),
+            vm_list_source = dict(required=False, type='str', default='auto',
+                                  choices=['auto', 'inventory', 'vim-cmd']),
+            mock = dict(required=False, type='bool', default=False),
+            mock_dir = dict(required=False, type='path', default='mocks'),
             ),
         supports_check_mode=True,
     )
     # module.debug('stated')
     # mgr = VMStartMgr(module)
     ret_dict = dict()
-    vm_by_id, id_by_vm, path_by_vm = load_vm_list(module)
+    runner = CmdRunner(module)
+    vm_by_id, id_by_vm, path_by_vm, vm_list_source = load_vm_list(runner, module.params['vm_list_source'])
     ret_dict['vm_by_id'] = vm_by_id
     ret_dict['id_by_vm'] = id_by_vm
     ret_dict['path_by_vm'] = path_by_vm
+    ret_dict['vm_list_source'] = vm_list_source
+    gather = set(module.params['gather'] or [])
+    if not gather.issubset(GATHER_GROUPS):
+        module.fail_json(msg="unknown gather groups: %s" % ', '.join(sorted(gather - set(GATHER_GROUPS))))
     if module.params['get_start_state']:
-        ret_dict['start_by_vm'] = load_startup_list(module, vm_by_id)
+        gather.add('start')
     if module.params['get_power_state']:
-        ret_dict['power_by_vm'] = load_power_list(module, vm_by_id)
+        gather.add('power')
+
+    summary_by_vm, devices_by_vm = load_details(
+        runner, vm_by_id,
+        summary = bool(gather & set(['resources', 'guest'])),
+        devices = 'disks' in gather)
+    if 'resources' in gather:
+        ret_dict['resources_by_vm'] = dict((vm_name, compact_resources(summary))
+                                           for (vm_name, summary) in summary_by_vm.items())
+    if 'guest' in gather:
+        ret_dict['guest_by_vm'] = dict((vm_name, compact_guest(summary))
+                                       for (vm_name, summary) in summary_by_vm.items())
+    if 'disks' in gather:
+        ret_dict['disks_by_vm'] = dict((vm_name, compact_disks(devices))
+                                       for (vm_name, devices) in devices_by_vm.items())
+    if 'start' in gather:
+        ret_dict['start_by_vm'] = load_startup_list(runner, vm_by_id)
+    if 'power' in gather:
+        power_method = module.params['power_method']
+        if summary_by_vm:
+            # already have it for free
+            ret_dict['power_by_vm'] = dict(
+                (vm_name, (summary_by_vm.get(vm_name, {}).get('runtime') or {}).get('powerState') == 'poweredOn')
+                for vm_name in id_by_vm)
+        elif power_method == 'process_list':
+            ret_dict['power_by_vm'] = load_power_list_processes(runner, vm_by_id, path_by_vm)
+        elif power_method == 'loop':
+            ret_dict['power_by_vm'] = load_power_list_loop(runner, vm_by_id)
+        else:
+            ret_dict['power_by_vm'] = load_power_list(runner, vm_by_id)
+    ret_dict['commands_run'] = runner.count
     module.exit_json(changed = False, **ret_dict)
 
 if __name__ == '__main__':
@@ -0,0 +1,150 @@
+#!/usr/bin/python
+'''
+source ~/tmp/ansible/hacking/env-setup
+export PATH=$PATH:~/tmp/ansible/hacking/
+test-module -m esxi_vmx.py -a '{"path": "/tmp/test.vmx", "set": {"numvcpus": "2"}, "remove": ["uuid.*"]}'
+
+export ANSIBLE_CONFIG=~/works/sysadm/ansible-study/esxi-mgmt/vm_deploy/ansible-deploy.esxi.cfg
+ansible -m esxi_vmx -a 'path=/vmfs/volumes/nest1-sys/vm1/vm1.vmx set={"memSize":"4096"}' --check --diff nest1-m8
+'''
+
+from ansible.module_utils.basic import AnsibleModule
+from ansible.module_utils.esxi_vmx import VmxConfig, apply_operations
+import io
+import os
+import tempfile
+
+ANSIBLE_METADATA = {'status': ['preview'],
+                    'supported_by': 'committer',
+                    'version': '0.1'}
+
+DOCUMENTATION = '''
+---
+module: esxi_vmx
+short_description: edit VM config (.vmx) in one go
+version_added: "2.2"
+description:
+    - 'Applies list of operations to VM config in memory and writes it back once
+       (atomically, only if something is changed); order of entries, comments and
+       formatting of unchanged lines are preserved.'
+    - 'Values are unescaped on read and escaped on write (VMware C(|XX) codes like
+       C(|22) for double quote and C(|0A) for newline), so plain strings are passed
+       to module and returned in C(changed_keys) and diff.'
+options:
+    path:
+        description: 'Path to .vmx file'
+        required: true
+    operations:
+        description:
+            - 'List of operations, applied in order; each one is a dict with one of'
+            - 'C(rename_prefix): dict "old -> new" value prefixes (like VM name in
+               C("vm1.vmdk") or C("vm1.nvram"))'
+            - 'C(remove): list of keys, could be shell-style patterns like C(uuid.*)'
+            - 'C(set): dict "key -> value" (values are strings); with C(skip_empty: true)
+               in same operation empty values are skipped ("leave as is")'
+            - 'C(ovf_env): OVF properties (dict or list of C({key, value})) for
+               C(guestinfo.ovfEnv), like C({"hostname": "vm1", "ip": "10.1.1.1"})'
+        default: []
+    rename_prefix:
+        description: 'Shortcut for C(rename_prefix) operation, applied 1st'
+        required: false
+    remove:
+        description: 'Shortcut for C(remove) operation, applied after C(rename_prefix)'
+        required: false
+    set:
+        description: 'Shortcut for C(set) operation (with C(skip_empty)), applied after
+            C(remove) and before C(operations)'
+        required: false
+    backup:
+        description: 'Keep backup copy of original file'
+        default: False
+author: alex@maxidom.ru
+notes:
+    - works w/o vcenter via C(ssh)
+    - supports check mode and diff
+requirements: []
+'''
+
+EXAMPLES = '''
+- name: customize cloned config
+  esxi_vmx:
+    path: "{{ dst_vm.path }}/{{ dst_vm.name }}/{{ dst_vm.name }}.vmx"
+    rename_prefix:
+      "{{ src_vm.name }}": "{{ dst_vm.name }}"
+    remove:
+      - ethernet0.generatedAddress
+      - uuid.location
+      - uuid.bios
+    set:
+      annotation: "{{ dst_vm.desc }}"
+      numvcpus: "{{ dst_vm.cpus }}"
+    operations:
+      - ovf_env:
+          - { key: hostname, value: "{{ vm_conf.hostname }}" }
+          - { key: ip, value: "{{ vm_conf.ip }}" }
+'''
+
+def write_atomic(module, path, text):
+    ''' write to temp file in same dir, then rename over original '''
+    (fd, tmp_name) = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.vmx-')
+    with io.open(fd, 'w', encoding='utf-8', newline='') as tmp_file:
+        tmp_file.write(text)
+    module.atomic_move(tmp_name, path)
+
+
+def main():
+    ''' entry point: read config, apply operations in memory, write once '''
+    module = AnsibleModule(
+        argument_spec = dict(
+            path = dict(required=True, type='path'),
+            operations = dict(required=False, type='list', default=[]),
+            rename_prefix = dict(required=False, type='dict'),
+            remove = dict(required=False, type='list'),
+            set = dict(required=False, type='dict'),
+            backup = dict(required=False, type='bool', default=False),
+        ),
+        supports_check_mode=True,
+    )
+    path = module.params['path']
+    operations = []
+    if module.params['rename_prefix']:
+        operations.append({'rename_prefix': module.params['rename_prefix']})
+    if module.params['remove']:
+        operations.append({'remove': module.params['remove']})
+    if module.params['set']:
+        operations.append({'set': module.params['set'], 'skip_empty': True})
+    operations.extend(module.params['operations'])
+
+    try:
+        with io.open(path, encoding='utf-8', newline='') as vmx_file:
+            before = vmx_file.read()
+    except (IOError, OSError) as e:
+        module.fail_json(msg="unable to read %s: %s" % (path, e))
+    except ValueError as e:
+        # UnicodeDecodeError: like vmx with other ".encoding"
+        module.fail_json(msg="unable to read %s as UTF-8: %s" % (path, e))
+    vmx = VmxConfig(before)
+
+    try:
+        changed_keys = apply_operations(vmx, operations)
+    except ValueError as e:
+        module.fail_json(msg=str(e))
+
+    after = vmx.render()
+    changed = after != before
+    backup_file = None
+    if changed and not module.check_mode:
+        if module.params['backup']:
+            backup_file = module.backup_local(path)
+        write_atomic(module, path, after)
+
+    result = dict(changed=changed, path=path, changed_keys=changed_keys,
+                  diff={'before': before, 'after': after,
+                        'before_header': path, 'after_header': path})
+    if backup_file:
+        result['backup_file'] = backup_file
+    module.exit_json(**result)
+
+
+if __name__ == '__main__':
+    main()
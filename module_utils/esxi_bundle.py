@@ -0,0 +1,353 @@
+'''
+checksum-keyed cache of offline bundles (depot zips) and resumable download of them
+
+- cache is a dir (".bundle_cache" on datastore, or any dir on controller), every
+  bundle is in "<sha256>/<name>", so copies are found by content, not just by name
+- sha256 of cached bundle is kept in sidecar ".<name>.sha256" next to it, valid
+  while its size and mtime are the same: bundle of several hundred MB is hashed once,
+  and later lookups are just "stat"; copy that does not match its dir is dropped
+- download goes to ".partial/<name>" in cache, with url, size and validator (ETag
+  or Last-Modified) in ".partial/.<name>.http": broken download is resumed with
+  "Range" request (in the same run, up to "retries" times, or on the next one);
+  "If-Range" makes server send the whole file if it was changed, and server w/o
+  range support just sends it all again
+- sha256 is computed while downloading (part that is already there is hashed first)
+- bundle from another source (stream from other host, upload) is put into
+  ".partial" too, and moved into cache only after its sha256 is checked
+'''
+
+import hashlib
+import json
+import os
+import re
+import shutil
+import socket
+import time
+try:
+    from urllib.request import Request, urlopen
+    from urllib.error import HTTPError, URLError
+except ImportError:
+    from urllib2 import Request, urlopen, HTTPError, URLError
+try:
+    # like IncompleteRead on dropped connection
+    from http.client import HTTPException
+except ImportError:
+    from httplib import HTTPException
+
+CACHE_DIR = '.bundle_cache'
+PARTIAL_DIR = '.partial'
+READ_SIZE = 1024 * 1024
+
+KEY_RE = re.compile(r'^[0-9a-f]{64}$')
+# like "bytes 1000-1999/5000"
+CONTENT_RANGE_RE = re.compile(r'^bytes\s+(\d+)-(\d+)/(\d+|\*)$')
+
+
+class BundleError(Exception):
+    ''' bad checksum or cache, failed download '''
+
+
+def parse_checksum(value):
+    ''' sha256 hex digest from "sha256:<hex>" or just "<hex>", None if not set '''
+    if not value:
+        return None
+    (algo, _, digest) = value.rpartition(':')
+    digest = digest.strip().lower()
+    if algo not in ('', 'sha256') or not KEY_RE.match(digest):
+        raise BundleError("bad checksum (sha256 expected): %s" % value)
+    return digest
+
+
+def sidecar_path(path):
+    ''' ".<name>.sha256" next to file '''
+    return os.path.join(os.path.dirname(path), '.%s.sha256' % os.path.basename(path))
+
+
+def file_stamp(path):
+    ''' [size, mtime in ns] (ns from float mtime on python w/o st_mtime_ns) '''
+    st = os.stat(path)
+    return [st.st_size, getattr(st, 'st_mtime_ns', None) or int(st.st_mtime * 1000000000)]
+
+
+def hash_file(path, hasher=None, length=None):
+    ''' sha256 object updated with first "length" bytes of file (whole by default) '''
+    hasher = hasher or hashlib.sha256()
+    with open(path, 'rb') as src:
+        while length is None or length > 0:
+            data = src.read(READ_SIZE if length is None else min(READ_SIZE, length))
+            if not data:
+                break
+            hasher.update(data)
+            if length is not None:
+                length -= len(data)
+    return hasher
+
+
+def file_sha256(path, save=True):
+    ''' sha256 of file, from sidecar if file is unchanged since it was saved '''
+    stamp = file_stamp(path)
+    try:
+        with open(sidecar_path(path)) as sfile:
+            saved = json.load(sfile)
+        if saved.get('stamp') == stamp and KEY_RE.match(saved.get('sha256', '')):
+            return saved['sha256']
+    except (IOError, OSError, ValueError, AttributeError):
+        pass
+    digest = hash_file(path).hexdigest()
+    if save:
+        save_sha256(path, digest, stamp)
+    return digest
+
+
+def save_sha256(path, digest, stamp=None):
+    ''' write sidecar, errors are ignored (like on read-only datastore) '''
+    try:
+        tmp_name = sidecar_path(path) + '.tmp'
+        with open(tmp_name, 'w') as sfile:
+            json.dump({'stamp': stamp or file_stamp(path), 'sha256': digest}, sfile)
+        os.rename(tmp_name, sidecar_path(path))
+    except (IOError, OSError):
+        pass
+
+
+class BundleCache(object):
+    ''' bundle cache in one dir '''
+
+    def __init__(self, path, name=None):
+        self.path = path
+        # datastore name for reports
+        self.name = name or path
+
+    def exists(self):
+        return os.path.isdir(self.path)
+
+    def bundle_path(self, digest, name):
+        return os.path.join(self.path, digest, name)
+
+    def partial_path(self, name):
+        return os.path.join(self.path, PARTIAL_DIR, name)
+
+    def digests(self, name):
+        ''' keys of cached copies of bundle "name" '''
+        if not self.exists():
+            return []
+        return sorted(entry for entry in os.listdir(self.path)
+                      if KEY_RE.match(entry) and os.path.isfile(self.bundle_path(entry, name)))
+
+    def lookup(self, name, digest=None, check_mode=False):
+        '''
+        (path, sha256) of verified copy of bundle (with "digest" if set) or None;
+        copies that do not match their key are dropped
+        '''
+        for key in self.digests(name):
+            if digest is not None and key != digest:
+                continue
+            path = self.bundle_path(key, name)
+            try:
+                actual = file_sha256(path, save=not check_mode)
+            except (IOError, OSError):
+                continue
+            if actual == key:
+                return (path, key)
+            if not check_mode:
+                self.drop(key)
+        return None
+
+    def drop(self, digest):
+        shutil.rmtree(os.path.join(self.path, digest), ignore_errors=True)
+
+    def drop_partial(self, name):
+        ''' partial file with its download or transfer state '''
+        partial = self.partial_path(name)
+        for path in [partial] + [os.path.join(os.path.dirname(partial), '.%s.%s' % (name, suffix))
+                                 for suffix in ('http', 'xfer', 'blocks')]:
+            if os.path.exists(path):
+                os.unlink(path)
+
+    def store(self, path, name, digest):
+        '''
+        move file at "path" (with known sha256 "digest") into cache, returns its
+        path there; block manifest from transfer is moved along
+        '''
+        dest_dir = os.path.join(self.path, digest)
+        if not os.path.isdir(dest_dir):
+            os.makedirs(dest_dir)
+        dest = os.path.join(dest_dir, name)
+        src_dir = os.path.dirname(path)
+        src_name = os.path.basename(path)
+        # block manifest stays valid: mtime is kept by rename (and by copy2 across
+        # filesystems), so this copy could be source for "esxi_transfer" at once
+        manifest = os.path.join(src_dir, '.%s.blocks' % src_name)
+        if os.path.exists(manifest):
+            shutil.move(manifest, os.path.join(dest_dir, '.%s.blocks' % name))
+        shutil.move(path, dest)
+        save_sha256(dest, digest)
+        return dest
+
+
+def cache_dirs(datastores):
+    ''' BundleCache for every datastore from [(name, real path)] '''
+    return [BundleCache(os.path.join(path, CACHE_DIR), name) for (name, path) in datastores]
+
+
+def find(name, digest, caches, check_mode=False):
+    ''' (cache, path, sha256) of first verified copy in caches, or None '''
+    for cache in caches:
+        found = cache.lookup(name, digest, check_mode)
+        if found:
+            return (cache, found[0], found[1])
+    return None
+
+
+def state_path(partial):
+    ''' ".<name>.http" next to partial download '''
+    return os.path.join(os.path.dirname(partial), '.%s.http' % os.path.basename(partial))
+
+
+class Downloader(object):
+    '''
+    resumable download of "url" into "dest" (partial file), sha256 is computed on
+    the way; "retries" is how many times to resume broken download in one run
+    '''
+
+    def __init__(self, url, dest, timeout=30, retries=3, retry_delay=2):
+        self.url = url
+        self.dest = dest
+        self.timeout = timeout
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.state_file = state_path(dest)
+        self.state = None
+        self.hasher = None
+        self.stats = dict(downloaded=0, resumed_from=0, restarts=0, retries=0)
+
+    def load_state(self):
+        ''' saved state if it is for the same url '''
+        try:
+            with open(self.state_file) as sfile:
+                state = json.load(sfile)
+        except (IOError, OSError, ValueError):
+            return None
+        if state.get('url') != self.url:
+            return None
+        return state
+
+    def save_state(self):
+        tmp_name = self.state_file + '.tmp'
+        with open(tmp_name, 'w') as sfile:
+            json.dump(self.state, sfile)
+        os.rename(tmp_name, self.state_file)
+
+    def start_over(self):
+        self.state = {'url': self.url, 'size': None, 'validator': None}
+        self.hasher = hashlib.sha256()
+        with open(self.dest, 'wb'):
+            pass
+        return 0
+
+    def resume_offset(self):
+        ''' size of partial file that is valid for resume, with its part hashed '''
+        self.state = self.load_state()
+        if self.state is None or not os.path.exists(self.dest):
+            return self.start_over()
+        offset = os.path.getsize(self.dest)
+        if self.state.get('size') is not None and offset > self.state['size']:
+            return self.start_over()
+        self.hasher = hash_file(self.dest, length=offset)
+        return offset
+
+    def request(self, offset):
+        headers = {'User-Agent': 'esxi_bundle'}
+        if offset:
+            headers['Range'] = 'bytes=%d-' % offset
+            if self.state.get('validator'):
+                headers['If-Range'] = self.state['validator']
+        return urlopen(Request(self.url, headers=headers), timeout=self.timeout)
+
+    def open(self, offset):
+        '''
+        (response or None if nothing is left, offset it starts at, total size or None)
+        '''
+        try:
+            resp = self.request(offset)
+        except HTTPError as e:
+            if e.code == 416 and offset:
+                # nothing after offset: complete if size is known to be the same
+                if self.state.get('size') == offset:
+                    return (None, offset, offset)
+                self.stats['restarts'] += 1
+                return self.open(self.start_over())
+            raise BundleError("unable to download %s: HTTP %s %s" % (self.url, e.code, e.reason))
+        info = resp.info()
+        validator = info.get('ETag') or info.get('Last-Modified')
+        if offset and resp.getcode() == 206:
+            match = CONTENT_RANGE_RE.match(info.get('Content-Range') or '')
+            if not match or int(match.group(1)) != offset:
+                resp.close()
+                raise BundleError("bad range in response: %s" % info.get('Content-Range'))
+            total = int(match.group(3)) if match.group(3) != '*' else None
+        else:
+            if offset:
+                # server sent the whole file (no range support, or it was changed)
+                self.stats['restarts'] += 1
+                offset = self.start_over()
+            length = info.get('Content-Length')
+            total = int(length) if length and length.isdigit() else None
+        if total is not None and self.state.get('size') not in (None, total):
+            # changed w/o validator: partial data is of other file
+            resp.close()
+            self.stats['restarts'] += 1
+            return self.open(self.start_over())
+        self.state['size'] = total
+        self.state['validator'] = validator
+        self.save_state()
+        return (resp, offset, total)
+
+    def receive(self, resp, offset, total):
+        ''' append response body to partial file, returns new offset '''
+        with open(self.dest, 'r+b') as dfile:
+            dfile.seek(offset)
+            try:
+                while True:
+                    data = resp.read(READ_SIZE)
+                    if not data:
+                        break
+                    dfile.write(data)
+                    self.hasher.update(data)
+                    offset += len(data)
+                    self.stats['downloaded'] += len(data)
+            finally:
+                resp.close()
+                dfile.truncate(offset)
+        if total is not None and offset != total:
+            raise IOError("connection closed at %d of %d bytes" % (offset, total))
+        return offset
+
+    def run(self, check_mode=False):
+        ''' download (or resume), returns sha256; raises BundleError '''
+        if check_mode:
+            state = self.load_state()
+            if state is not None and os.path.exists(self.dest):
+                self.stats['resumed_from'] = os.path.getsize(self.dest)
+            return None
+        if not os.path.isdir(os.path.dirname(self.dest)):
+            os.makedirs(os.path.dirname(self.dest))
+        offset = self.stats['resumed_from'] = self.resume_offset()
+        attempt = 0
+        while True:
+            try:
+                (resp, offset, total) = self.open(offset)
+                if resp is not None:
+                    offset = self.receive(resp, offset, total)
+                break
+            except (URLError, HTTPException, socket.error, socket.timeout, IOError) as e:
+                attempt += 1
+                if attempt > self.retries:
+                    raise BundleError("unable to download %s: %s, gave up after %d retries" %
+                                      (self.url, e, self.retries))
+                self.stats['retries'] = attempt
+                time.sleep(self.retry_delay)
+                offset = self.resume_offset()
+        self.state['size'] = offset
+        self.save_state()
+        return self.hasher.hexdigest()
@@ -0,0 +1,151 @@
+'''
+"esxcli" runner with machine-readable output instead of scraping text
+
+- xml formatter (--formatter=xml) keeps value types: output like
+
+    <output xmlns="http://www.vmware.com/Products/ESX/5.0/esxcli">
+    <root>
+       <structure typeName="InstallationResult">
+          <field name="Message"><string>Operation finished successfully.</string></field>
+          <field name="Reboot Required"><boolean>false</boolean></field>
+          <field name="VIBs Installed"><list type="string"><string>...</string></list></field>
+       </structure>
+    </root>
+    </output>
+
+  is converted with iterparse (elements are dropped as soon as they are used)
+  to dict like {"Message": "...", "Reboot Required": False, "VIBs Installed": [...]};
+  listings (like "network vswitch standard portgroup list") are lists of dicts
+
+- csv formatter (--formatter=csv) is faster and smaller for big flat tables
+  (like full "advanced list"), values are strings unless converted with "types"
+
+field names are the same for both formatters ("Name", "VLANID", "IntValue"); some
+have spaces ("VIBs Installed", "Reboot Required")
+'''
+
+import csv
+import io
+import xml.etree.ElementTree as ET
+
+ESXCLI = 'esxcli'
+
+# what parse_output could raise on broken or unexpected output
+PARSE_ERRORS = (ET.ParseError, ValueError)
+
+
+def to_bool(val):
+    return val.strip().lower() == 'true'
+
+
+SCALARS = {
+    'string': lambda val: val,
+    'integer': int,
+    'long': int,
+    'float': float,
+    'boolean': to_bool,
+}
+
+
+class Field(object):
+    ''' placeholder for structure field while its value is parsed '''
+    __slots__ = ('name', 'value')
+
+    def __init__(self, name):
+        self.name = name
+        self.value = None
+
+
+def local_name(tag):
+    ''' tag w/o namespace '''
+    return tag.rsplit('}', 1)[-1]
+
+
+def parse_xml(data):
+    '''
+    parse esxcli xml output into python values: "structure" is dict,
+    "list" is list, scalars are converted by their tags; returns value
+    under "root" (None if it is empty)
+    '''
+    if not isinstance(data, bytes):
+        data = data.encode('utf-8')
+    stack = [[]]
+    for (event, elem) in ET.iterparse(io.BytesIO(data), events=('start', 'end')):
+        tag = local_name(elem.tag)
+        if event == 'start':
+            if tag == 'list':
+                stack.append([])
+            elif tag == 'structure':
+                stack.append({})
+            elif tag == 'field':
+                stack.append(Field(elem.get('name')))
+            continue
+        if tag == 'list' or tag == 'structure':
+            value = stack.pop()
+        elif tag == 'field':
+            field = stack.pop()
+            stack[-1][field.name] = field.value
+            elem.clear()
+            continue
+        elif tag in SCALARS:
+            value = SCALARS[tag](elem.text or '')
+        else:
+            # "root", "output" and unknown wrappers
+            continue
+        top = stack[-1]
+        if isinstance(top, Field):
+            top.value = value
+        elif isinstance(top, list):
+            top.append(value)
+        elem.clear()
+    return stack[0][0] if stack[0] else None
+
+
+def parse_csv(data, types=None):
+    '''
+    parse esxcli csv output (header is like "ActiveClients,Name,VLANID,VirtualSwitch,",
+    note the trailing comma) into list of dicts; "types" is optional map
+    "field -> converter" like {"VLANID": int}
+    '''
+    types = types or {}
+    res = []
+    for rec in csv.DictReader(data.splitlines()):
+        rec.pop('', None)
+        rec.pop(None, None)
+        for (key, conv) in types.items():
+            if rec.get(key) not in (None, ''):
+                rec[key] = conv(rec[key])
+        res.append(rec)
+    return res
+
+
+def parse_output(out, formatter='xml', types=None):
+    ''' parse output of esxcli run with given formatter '''
+    if formatter == 'xml':
+        return parse_xml(out) if out.strip() else None
+    if formatter == 'csv':
+        return parse_csv(out, types)
+    raise ValueError("unsupported esxcli formatter: %s" % formatter)
+
+
+def esxcli_cmd(args, formatter='xml'):
+    ''' command line for esxcli namespace command like "software vib list" '''
+    return '%s --formatter=%s %s' % (ESXCLI, formatter, args)
+
+
+def run_esxcli(module, args, formatter='xml', types=None, fail_msg=None):
+    '''
+    run "esxcli --formatter=<formatter> <args>" and parse its output
+    returns (ret, parsed, out, err); on error fails with "fail_msg" if set,
+    else returns None as parsed result
+    '''
+    cmd = esxcli_cmd(args, formatter)
+    ret, out, err = module.run_command(cmd)
+    if ret != 0:
+        if fail_msg is not None:
+            module.fail_json(msg=fail_msg, cmd=cmd, rc=ret, err=err, out=out)
+        return ret, None, out, err
+    try:
+        return ret, parse_output(out, formatter, types), out, err
+    except PARSE_ERRORS as e:
+        module.fail_json(msg="unable to parse esxcli output: %s" % e, cmd=cmd, out=out)
@@ -0,0 +1,155 @@
+'''
+VM inventory straight from hostd files, w/o "vim-cmd vmsvc/getallvms"
+
+- registered VMs are in /etc/vmware/hostd/vmInventory.xml, like
+
+    <ConfigRoot>
+      <ConfigEntry id="0000">
+        <objID>1</objID>
+        <secDomain>23</secDomain>
+        <vmxCfgPath>/vmfs/volumes/5a1b.../phoenix11/phoenix11.vmx</vmxCfgPath>
+      </ConfigEntry>
+    </ConfigRoot>
+
+- VM name is "displayName" from .vmx
+- volume UUID in path is replaced by datastore name (from /vmfs/volumes symlinks)
+
+results are cached in small json file: while inventory mtime and size are the
+same, XML is not parsed again, and .vmx is re-read only if its mtime changed
+'''
+
+import json
+import os
+import re
+import tempfile
+import xml.etree.ElementTree as ET
+
+INVENTORY_FILE = '/etc/vmware/hostd/vmInventory.xml'
+CACHE_FILE = '/tmp/ansible-esxi-vminventory.json'
+VOLUMES_DIR = '/vmfs/volumes'
+CACHE_VERSION = 1
+
+# what load_inventory could raise if inventory is not readable
+LOAD_ERRORS = (IOError, OSError, ValueError, ET.ParseError)
+
+# on raw bytes: "|XX" codes of non-ascii names are bytes of UTF-8 sequence
+DISPLAY_NAME_RE = re.compile(br'^displayName\s*=\s*"(.*)"\s*$')
+VMX_ESCAPE_RE = re.compile(br'\|([0-9A-Fa-f]{2})')
+
+
+def parse_inventory(inventory_file=INVENTORY_FILE):
+    ''' list of (vm_id, vmx_path) from inventory xml, parsed incrementally '''
+    res = []
+    vm_id = None
+    vmx_path = None
+    for (_, elem) in ET.iterparse(inventory_file):
+        if elem.tag == 'objID':
+            vm_id = elem.text
+        elif elem.tag == 'vmxCfgPath':
+            vmx_path = elem.text
+        elif elem.tag == 'ConfigEntry':
+            if vm_id is not None and vmx_path:
+                res.append((int(vm_id.strip()), vmx_path.strip()))
+            vm_id = None
+            vmx_path = None
+            elem.clear()
+    return res
+
+
+def read_display_name(vmx_path):
+    ''' "displayName" from vmx file (unescaped), None if not found '''
+    with open(vmx_path, 'rb') as vmx_file:
+        for line in vmx_file:
+            match = DISPLAY_NAME_RE.match(line.strip())
+            if match:
+                name = VMX_ESCAPE_RE.sub(lambda m: bytes(bytearray([int(m.group(1), 16)])),
+                                         match.group(1))
+                return name.decode('utf-8', 'replace')
+    return None
+
+
+def volume_names(volumes_dir=VOLUMES_DIR):
+    ''' map "volume uuid -> datastore name" from symlinks in /vmfs/volumes '''
+    names = dict()
+    for entry in os.listdir(volumes_dir):
+        full = os.path.join(volumes_dir, entry)
+        if os.path.islink(full):
+            names[os.path.basename(os.readlink(full))] = entry
+    return names
+
+
+def datastore_path(vmx_path, vol_names, volumes_dir=VOLUMES_DIR):
+    ''' replace volume uuid in path with datastore name if known '''
+    prefix = volumes_dir.rstrip('/') + '/'
+    if not vmx_path.startswith(prefix):
+        return vmx_path
+    (volume, _, rest) = vmx_path[len(prefix):].partition('/')
+    return prefix + vol_names.get(volume, volume) + '/' + rest
+
+
+def load_cache(cache_file):
+    ''' cached inventory or None if missing, broken or of other version '''
+    try:
+        with open(cache_file) as cfile:
+            cache = json.load(cfile)
+        if cache.get('version') == CACHE_VERSION:
+            return cache
+    except (IOError, OSError, ValueError):
+        pass
+    return None
+
+
+def save_cache(cache_file, cache):
+    ''' write cache atomically; errors are ignored, it is just a cache '''
+    try:
+        (fd, tmp_name) = tempfile.mkstemp(dir=os.path.dirname(cache_file))
+        with os.fdopen(fd, 'w') as cfile:
+            json.dump(cache, cfile)
+        os.rename(tmp_name, cache_file)
+    except (IOError, OSError):
+        pass
+
+
+def load_inventory(inventory_file=INVENTORY_FILE, cache_file=CACHE_FILE,
+                   volumes_dir=VOLUMES_DIR):
+    '''
+    list of registered VMs as dicts {"id": int, "name": str, "path": vmx path
+    with datastore name}; VMs with missing or unreadable .vmx are skipped (like
+    "invalid" ones in getallvms); raises one of LOAD_ERRORS if inventory could
+    not be read
+    '''
+    inv_stat = os.stat(inventory_file)
+    cache = load_cache(cache_file) if cache_file else None
+    if cache is not None and cache['inv_mtime'] == inv_stat.st_mtime and \
+            cache['inv_size'] == inv_stat.st_size:
+        entries = cache['vms']
+        inv_changed = False
+    else:
+        entries = [{'id': vm_id, 'vmx': vmx_path, 'vmx_mtime': None, 'name': None}
+                   for (vm_id, vmx_path) in parse_inventory(inventory_file)]
+        inv_changed = True
+
+    vmx_changed = False
+    for entry in entries:
+        try:
+            vmx_mtime = os.stat(entry['vmx']).st_mtime
+            if vmx_mtime != entry['vmx_mtime']:
+                entry['name'] = read_display_name(entry['vmx'])
+                entry['vmx_mtime'] = vmx_mtime
+                vmx_changed = True
+        except (IOError, OSError):
+            if entry['name'] is not None or entry['vmx_mtime'] is not None:
+                vmx_changed = True
+            entry['name'] = None
+            entry['vmx_mtime'] = None
+
+    if cache_file and (inv_changed or vmx_changed):
+        save_cache(cache_file, {'version': CACHE_VERSION,
+                                'inv_mtime': inv_stat.st_mtime,
+                                'inv_size': inv_stat.st_size,
+                                'vms': entries})
+
+    vol_names = volume_names(volumes_dir) if os.path.isdir(volumes_dir) else {}
+    return [{'id': entry['id'], 'name': entry['name'],
+             'path': datastore_path(entry['vmx'], vol_names, volumes_dir)}
+            for entry in entries if entry['name'] is not None]
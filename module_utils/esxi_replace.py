@@ -0,0 +1,327 @@
+'''
+regexp replace in files of any size, in bytes (no decoding of possibly binary data)
+
+- several (pattern, replacement) pairs are applied in one pass: at every position
+  the leftmost match of any pattern wins (first listed one on tie), replaced text
+  is not searched again; patterns are compiled with re.MULTILINE like for "replace"
+- replacement templates (like '"vm1\\1"') are parsed once, not for every match
+- "line" scope: file is read in blocks of whole lines, and patterns are matched in
+  the whole block (w/o last newline), so "^" and "$" are line boundaries; block
+  where some match spans lines is redone line by line, so matches never cross
+  lines; memory is proportional to block size (or the longest line); whole-file
+  anchors like "\\A" are for "file" scope
+- "file" scope: file is mmap'ed and searched as a whole, for patterns spanning lines
+- nothing is written until the first change; then output goes to temp file next
+  to original (unchanged head is copied from original), and it is renamed over it
+'''
+
+import mmap
+import os
+import re
+import tempfile
+
+COPY_SIZE = 1024 * 1024
+BLOCK_SIZE = 1024 * 1024
+SCOPES = ['line', 'file']
+
+# the same as in re.sub templates
+TEMPLATE_ESCAPES = {b'a': b'\a', b'b': b'\b', b'f': b'\f', b'n': b'\n', b'r': b'\r',
+                    b't': b'\t', b'v': b'\v', b'\\': b'\\'}
+GROUP_NAME_RE = re.compile(br'\\g<([^>]*)>')
+OCTAL_RE = re.compile(br'\\([0-7]{3}|0[0-7]{0,2})')
+GROUP_NUM_RE = re.compile(br'\\([1-9][0-9]?)')
+
+
+class SpansLines(Exception):
+    ''' match crosses line boundary in "line" scope '''
+
+
+def to_bytes(value):
+    if isinstance(value, bytes):
+        return value
+    return value.encode('utf-8')
+
+
+def compile_template(pattern, template):
+    '''
+    list of literal bytes and group numbers from replacement template (with the
+    same escapes and group references as for re.sub)
+    '''
+    parts = []
+    literal = []
+    pos = 0
+    while pos < len(template):
+        char = template[pos:pos + 1]
+        if char != b'\\':
+            literal.append(char)
+            pos += 1
+            continue
+        group = None
+        match = GROUP_NAME_RE.match(template, pos)
+        if match:
+            name = match.group(1).decode('ascii', 'replace')
+            if name.isdigit():
+                group = int(name)
+            elif name in pattern.groupindex:
+                group = pattern.groupindex[name]
+            else:
+                raise ValueError("unknown group name in replacement: %s" % name)
+        else:
+            match = OCTAL_RE.match(template, pos)
+            if match and (len(match.group(1)) < 3 or int(match.group(1), 8) <= 0o377):
+                literal.append(bytes(bytearray([int(match.group(1), 8)])))
+                pos = match.end()
+                continue
+            match = GROUP_NUM_RE.match(template, pos)
+            if match:
+                group = int(match.group(1))
+        if group is not None:
+            if group > pattern.groups:
+                raise ValueError("invalid group reference in replacement: %d" % group)
+            if literal:
+                parts.append(b''.join(literal))
+                literal = []
+            parts.append(group)
+            pos = match.end()
+            continue
+        escaped = template[pos + 1:pos + 2]
+        if escaped in TEMPLATE_ESCAPES:
+            literal.append(TEMPLATE_ESCAPES[escaped])
+        elif escaped.isalpha():
+            raise ValueError("bad escape in replacement: \\%s" % escaped.decode('ascii'))
+        else:
+            literal.append(b'\\' + escaped)
+        pos += 2
+    if literal:
+        parts.append(b''.join(literal))
+    return parts
+
+
+def compile_replacements(pairs):
+    ''' [(compiled bytes pattern, template parts)] from [(regexp, replace)] '''
+    compiled = []
+    for (regexp, replace) in pairs:
+        try:
+            pattern = re.compile(to_bytes(regexp), re.MULTILINE)
+        except re.error as e:
+            raise ValueError("bad regexp %r: %s" % (regexp, e))
+        compiled.append((pattern, compile_template(pattern, to_bytes(replace or ''))))
+    return compiled
+
+
+def expand(match, parts):
+    return b''.join(part if isinstance(part, bytes) else (match.group(part) or b'')
+                    for part in parts)
+
+
+def copy_range(data, start, end, out):
+    ''' big gaps (like in mmap) are written in pieces, not copied at once '''
+    while end - start > COPY_SIZE:
+        out(data[start:start + COPY_SIZE])
+        start += COPY_SIZE
+    out(data[start:end])
+
+
+def matches(data, replacements):
+    ''' (match, template parts) in order, leftmost match of any pattern wins '''
+    if len(replacements) == 1:
+        # most common case, with exact re.sub semantics
+        (pattern, parts) = replacements[0]
+        for match in pattern.finditer(data):
+            yield (match, parts)
+        return
+    end = len(data)
+    pos = 0
+    found = [pattern.search(data, 0) for (pattern, _) in replacements]
+    while True:
+        best = None
+        for (num, match) in enumerate(found):
+            if match is not None and match.start() < pos:
+                match = found[num] = replacements[num][0].search(data, pos)
+            if match is not None and (best is None or match.start() < found[best].start()):
+                best = num
+        if best is None:
+            return
+        match = found[best]
+        yield (match, replacements[best][1])
+        pos = match.end()
+        if match.end() == match.start():
+            # after empty match, the next one starts after next char
+            if pos >= end:
+                return
+            pos += 1
+
+
+def substitute(data, replacements, out, changes=None, limit=0, one_line=False):
+    '''
+    write "data" (bytes or mmap) with all replacements applied to "out" (callable),
+    returns number of replacements that changed something; (start, matched,
+    replaced) are appended to "changes" list (up to "limit" items); with
+    "one_line" raises SpansLines if some match has newline in it
+    '''
+    pos = 0
+    count = 0
+    for (match, parts) in matches(data, replacements):
+        matched = match.group(0)
+        if one_line and b'\n' in matched:
+            raise SpansLines()
+        replaced = expand(match, parts)
+        copy_range(data, pos, match.start(), out)
+        out(replaced)
+        pos = match.end()
+        if replaced != matched:
+            count += 1
+            if changes is not None and len(changes) < limit:
+                changes.append((match.start(), matched, replaced))
+    copy_range(data, pos, len(data), out)
+    return count
+
+
+def replace_bytes(data, replacements, scope='line'):
+    ''' new content of small file (like for diff), in memory '''
+    pieces = []
+    if scope == 'file':
+        substitute(data, replacements, pieces.append)
+    elif data:
+        # lines are split on "\n" only, like in Replacer ("\r" is part of line)
+        body = data[:-1] if data.endswith(b'\n') else data
+        for (num, line) in enumerate(body.split(b'\n')):
+            if num:
+                pieces.append(b'\n')
+            substitute(line, replacements, pieces.append)
+        pieces.append(data[len(body):])
+    return b''.join(pieces)
+
+
+class Replacer(object):
+    '''
+    apply replacements to "path" in given scope; "run" returns number of
+    replacements, and new content is in "tmp_name" (None if nothing was changed
+    or in dry run); "changes" has (line number or offset, before, after) of first
+    "diff_limit" replacements
+    '''
+
+    def __init__(self, path, replacements, scope='line', dry_run=False, diff_limit=0):
+        self.path = path
+        self.replacements = replacements
+        self.scope = scope
+        self.dry_run = dry_run
+        self.diff_limit = diff_limit
+        self.changes = []
+        self.tmp_name = None
+        self.tmp_file = None
+
+    def start_output(self, head):
+        ''' temp file next to original, with unchanged first "head" bytes copied '''
+        if self.dry_run:
+            return
+        (fd, self.tmp_name) = tempfile.mkstemp(dir=os.path.dirname(self.path) or '.',
+                                               prefix='.replace-')
+        self.tmp_file = os.fdopen(fd, 'wb')
+        with open(self.path, 'rb') as src:
+            while head:
+                data = src.read(min(COPY_SIZE, head))
+                if not data:
+                    break
+                self.tmp_file.write(data)
+                head -= len(data)
+
+    def write(self, data):
+        if self.tmp_file is not None:
+            self.tmp_file.write(data)
+
+    def discard(self):
+        if self.tmp_file is not None:
+            self.tmp_file.close()
+        if self.tmp_name is not None and os.path.exists(self.tmp_name):
+            os.unlink(self.tmp_name)
+        self.tmp_name = self.tmp_file = None
+
+    def run(self):
+        try:
+            if self.scope == 'file':
+                count = self.run_file()
+            else:
+                count = self.run_lines()
+            if self.tmp_file is not None:
+                self.tmp_file.close()
+                self.tmp_file = None
+            if not count:
+                # only replacements with the same text
+                self.discard()
+        except Exception:
+            self.discard()
+            raise
+        return count
+
+    def replace_block(self, block, lineno):
+        ''' (count, output pieces, changes by line number) for block of whole lines '''
+        body = block[:-1] if block.endswith(b'\n') else block
+        pieces = []
+        changes = []
+        try:
+            count = substitute(body, self.replacements, pieces.append, changes,
+                               self.diff_limit, one_line=True)
+            changes = [(lineno + body.count(b'\n', 0, start), old, new)
+                       for (start, old, new) in changes]
+        except SpansLines:
+            (count, pieces, changes) = (0, [], [])
+            for (num, line) in enumerate(body.split(b'\n')):
+                if num:
+                    pieces.append(b'\n')
+                line_changes = []
+                count += substitute(line, self.replacements, pieces.append, line_changes,
+                                    self.diff_limit)
+                changes.extend((lineno + num, old, new) for (_, old, new) in line_changes)
+        pieces.append(block[len(body):])
+        return (count, pieces, changes)
+
+    def run_lines(self):
+        total = 0
+        offset = 0
+        lineno = 1
+        with open(self.path, 'rb') as src:
+            while True:
+                block = src.read(BLOCK_SIZE)
+                if not block:
+                    break
+                if not block.endswith(b'\n'):
+                    block += src.readline()
+                count = 0
+                # most blocks do not match at all
+                if any(pattern.search(block) for (pattern, _) in self.replacements):
+                    (count, pieces, changes) = self.replace_block(block, lineno)
+                if count:
+                    if self.tmp_file is None:
+                        self.start_output(offset)
+                    total += count
+                    self.changes.extend(changes[:self.diff_limit - len(self.changes)])
+                    for piece in pieces:
+                        self.write(piece)
+                else:
+                    self.write(block)
+                lineno += block.count(b'\n')
+                offset += len(block)
+        return total
+
+    def run_file(self):
+        if os.path.getsize(self.path) == 0:
+            # empty file can not be mmap'ed, but "^", "$" or "a*" still match in it
+            replaced = replace_bytes(b'', self.replacements, 'file')
+            if not replaced:
+                return 0
+            self.start_output(0)
+            self.write(replaced)
+            if self.diff_limit:
+                self.changes.append((0, b'', replaced))
+            return 1
+        with open(self.path, 'rb') as src:
+            data = mmap.mmap(src.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                if not any(pattern.search(data) for (pattern, _) in self.replacements):
+                    return 0
+                self.start_output(0)
+                return substitute(data, self.replacements, self.write, self.changes,
+                                  self.diff_limit)
+            finally:
+                data.close()
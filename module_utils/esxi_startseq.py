@@ -0,0 +1,158 @@
+'''
+planner for ESXi autostart sequence changes
+
+ESXi autostart manager keeps VMs in sequential list (orders 1..N); setting
+order of some entry with "update_autostartentry" removes it from its current
+place and inserts it at new one, shifting rest of list. Known problems:
+  - moving existing entry to the very end of list corrupts it
+  - setting order to -1 (or wrong number) removes entry from sequence
+
+Planner computes minimal list of updates to turn current sequence into desired
+one: entries forming longest increasing subsequence (in target order) are left
+in place, rest is inserted before their (already placed) successors, so no
+existing entry is moved to the end of list.
+
+Pure python, no ansible deps, usable like
+
+    moves = plan_moves(vm_start_info, [3, 1, 2])
+    new_seq = apply_moves(start_sequence(vm_start_info), moves)
+'''
+
+from bisect import bisect_left
+
+
+def start_sequence(start_info):
+    ''' current startup sequence: list of vm_ids with order > 0, sorted by order '''
+    return [vm_id for (vm_id, info) in
+            sorted(start_info.items(), key=lambda x: x[1]['order'])
+            if info['order'] > 0]
+
+
+def is_started(start_info, vm_id):
+    ''' VM is in startup sequence with "PowerOn" (or "powerOn") action '''
+    info = start_info.get(vm_id)
+    return info is not None and info['order'] > 0 and \
+        str(info['action']).lower() == 'poweron'
+
+
+def longest_increasing(values):
+    '''
+    indexes of longest strictly increasing subsequence of "values"
+    (patience sorting, O(n log n))
+    '''
+    tails = []
+    tail_idx = []
+    prev = [-1] * len(values)
+    for (idx, val) in enumerate(values):
+        pos = bisect_left(tails, val)
+        if pos > 0:
+            prev[idx] = tail_idx[pos - 1]
+        if pos == len(tails):
+            tails.append(val)
+            tail_idx.append(idx)
+        else:
+            tails[pos] = val
+            tail_idx[pos] = idx
+    res = []
+    idx = tail_idx[-1] if tail_idx else -1
+    while idx != -1:
+        res.append(idx)
+        idx = prev[idx]
+    res.reverse()
+    return res
+
+
+def plan_moves(start_info, target, disable=()):
+    '''
+    compute updates to bring autostart sequence to desired state
+
+    - start_info: current state, map "vm_id -> {'order': N, 'action': 'PowerOn'}"
+      (like VMStartMgr.vm_start_info)
+    - target: list of vm_ids to be started, in desired order; VMs already in
+      sequence but not in target (and not in "disable") are kept after them in
+      current relative order
+    - disable: vm_ids to remove from autostart
+
+    returns list of (vm_id, order) to apply in that order, order -1 means
+    "disable"; each order is valid for list state after previous updates
+    '''
+    target_set = set(target)
+    disable_set = set(disable) - target_set
+    moves = []
+    seq = start_sequence(start_info)
+
+    # disables go first: they only shrink the list
+    for vm_id in disable:
+        if vm_id in disable_set and vm_id in start_info and \
+                start_info[vm_id]['action'] != 'PowerOff':
+            moves.append((vm_id, -1))
+            disable_set.discard(vm_id)
+    removed = set(vm_id for (vm_id, _) in moves)
+    # not started entries still holding a place (like "PowerOff" with order set)
+    # could not be moved w/o enabling them, so take them out of sequence too
+    for vm_id in seq:
+        if vm_id not in target_set and vm_id not in removed and \
+                not is_started(start_info, vm_id):
+            moves.append((vm_id, -1))
+            removed.add(vm_id)
+    seq = [vm_id for vm_id in seq if vm_id not in removed]
+
+    final = list(target) + [vm_id for vm_id in seq if vm_id not in target_set]
+    final_pos = dict((vm_id, pos) for (pos, vm_id) in enumerate(final))
+
+    # entries with wrong action need an update anyway, so only "clean" ones are
+    # candidates to stay in place
+    clean = [vm_id for vm_id in seq if is_started(start_info, vm_id)]
+    clean_vals = [final_pos[vm_id] for vm_id in clean]
+    kept = set(clean[idx] for idx in longest_increasing(clean_vals))
+
+    # last entry could not be moved to its place (that is "move to end"):
+    # either keep it in place, or remove it and add again (2 updates)
+    if final and final[-1] in seq and final[-1] not in kept:
+        last = final[-1]
+        if last in clean:
+            cut = clean.index(last)
+            kept_last = set(clean[idx] for idx in longest_increasing(clean_vals[:cut]))
+            if len(kept_last) + 2 >= len(kept):
+                kept = kept_last
+                kept.add(last)
+        if last not in kept:
+            moves.append((last, -1))
+            seq.remove(last)
+
+    # place the rest in reverse order, each one right before its successor
+    cur = list(seq)
+    for pos in range(len(final) - 1, -1, -1):
+        vm_id = final[pos]
+        if vm_id in kept:
+            continue
+        if vm_id in cur:
+            cur.remove(vm_id)
+        if pos == len(final) - 1:
+            # only new (or re-added) entry could get here
+            order = len(cur) + 1
+        else:
+            order = cur.index(final[pos + 1]) + 1
+        cur.insert(order - 1, vm_id)
+        moves.append((vm_id, order))
+    return moves
+
+
+def apply_moves(seq, moves):
+    '''
+    simulate updates on startup sequence (list of vm_ids); returns new list,
+    raises ValueError on move of existing entry to the end of list
+    '''
+    seq = list(seq)
+    for (vm_id, order) in moves:
+        present = vm_id in seq
+        if present:
+            seq.remove(vm_id)
+        if order == -1:
+            continue
+        if order < 1 or order > len(seq) + 1:
+            raise ValueError("bad order %d for vm %s" % (order, vm_id))
+        if present and order == len(seq) + 1 and len(seq) > 0:
+            raise ValueError("vm %s is moved to the end of list" % vm_id)
+        seq.insert(order - 1, vm_id)
+    return seq
@@ -0,0 +1,242 @@
+'''
+content-addressed cache of template disks on datastores, to clone them locally
+instead of shipping them from another host again
+
+- cache is ".template_cache" dir on datastore, every disk is in its own subdir
+  "<key>/<key>.vmdk" (plus extents), made with "vmkfstools -i ... -d thin"
+- key is content hash of disk extents: sha1 of concatenated hex sha1 of 8M chunks,
+  from block hash manifests of "esxi_transfer" (".<extent>.blocks", written for
+  both ends of transfer), so just streamed disk is stored w/o reading it again;
+  manifest is written for source disk too and is reused while extent size and
+  mtime are the same
+- "manifest.json" in cache dir has entries like
+
+    {"<key>": {"name": "phoenix11.vmdk", "size": 3221225472,
+               "added": 1500000000, "used": 1500000000}}
+
+  size is allocated size (thin disks are much smaller than provisioned); "used" is
+  updated on every hit, least recently used entries are evicted to keep cache
+  under size budget
+- manifest is replaced atomically (write + rename); concurrent runs on shared
+  datastore could lose "used" update, that is harmless
+'''
+
+import json
+import os
+import re
+import shutil
+import subprocess
+import time
+from ansible.module_utils.esxi_transfer import file_hashes, root_hash
+
+VOLUMES_DIR = '/vmfs/volumes'
+CACHE_DIR = '.template_cache'
+MANIFEST = 'manifest.json'
+MANIFEST_VERSION = 1
+CHUNK_SIZE = 8 * 1024 * 1024
+
+KEY_RE = re.compile(r'^[0-9a-f]{40}$')
+# like 'RW 20971520 VMFS "phoenix11-flat.vmdk"'
+EXTENT_RE = re.compile(r'^(?:RW|RDONLY|NOACCESS)\s+\d+\s+\S+\s+"([^"]+)"')
+
+
+class CacheError(Exception):
+    ''' bad disk or cache, or failed clone '''
+
+
+def disk_extents(descriptor):
+    ''' extent paths from vmdk descriptor (in the same dir) '''
+    disk_dir = os.path.dirname(descriptor)
+    extents = []
+    try:
+        with open(descriptor, 'rb') as dfile:
+            # descriptor is small text; do not read binary (sparse) disks whole
+            head = dfile.read(64 * 1024)
+    except (IOError, OSError) as e:
+        raise CacheError("unable to read disk descriptor %s: %s" % (descriptor, e))
+    for line in head.decode('utf-8', 'replace').splitlines():
+        match = EXTENT_RE.match(line.strip())
+        if match:
+            extents.append(os.path.join(disk_dir, match.group(1)))
+    if not extents:
+        raise CacheError("no extents in disk descriptor %s" % descriptor)
+    return extents
+
+
+def allocated_size(path):
+    st = os.stat(path)
+    return getattr(st, 'st_blocks', 0) * 512 or st.st_size
+
+
+def disk_key(descriptor, save=True):
+    ''' content key of disk (all extents) '''
+    hashes = []
+    for extent in disk_extents(descriptor):
+        try:
+            hashes.extend(file_hashes(extent, CHUNK_SIZE, save))
+        except (IOError, OSError) as e:
+            raise CacheError("unable to read disk extent %s: %s" % (extent, e))
+    return root_hash(hashes)
+
+
+def datastore_dirs(datastores=None):
+    '''
+    list of (name, real path) for given datastores (names or paths), or for all
+    mounted ones: /vmfs/volumes has both UUID dirs and name symlinks, so names
+    are taken from symlinks and dirs are de-duplicated by real path
+    '''
+    if datastores:
+        result = []
+        for datastore in datastores:
+            path = datastore if datastore.startswith('/') else os.path.join(VOLUMES_DIR, datastore)
+            result.append((os.path.basename(path.rstrip('/')), os.path.realpath(path)))
+        return result
+    names = dict()
+    try:
+        entries = sorted(os.listdir(VOLUMES_DIR))
+    except OSError:
+        return []
+    for entry in entries:
+        path = os.path.join(VOLUMES_DIR, entry)
+        real = os.path.realpath(path)
+        if not os.path.isdir(real):
+            continue
+        if os.path.islink(path) or real not in names:
+            names[real] = entry
+    return sorted((name, real) for (real, name) in names.items())
+
+
+class DatastoreCache(object):
+    ''' template cache on one datastore '''
+
+    def __init__(self, name, path, vmkfstools='vmkfstools'):
+        self.name = name
+        self.path = os.path.join(path, CACHE_DIR)
+        self.vmkfstools = vmkfstools
+        self.entries = None
+
+    def exists(self):
+        return os.path.isdir(self.path)
+
+    def load(self):
+        self.entries = dict()
+        try:
+            with open(os.path.join(self.path, MANIFEST)) as mfile:
+                manifest = json.load(mfile)
+        except (IOError, OSError, ValueError):
+            return self.entries
+        if manifest.get('version') == MANIFEST_VERSION:
+            self.entries = manifest.get('entries', {})
+        return self.entries
+
+    def save(self):
+        if not self.exists():
+            os.mkdir(self.path)
+        tmp_name = os.path.join(self.path, MANIFEST + '.tmp')
+        with open(tmp_name, 'w') as mfile:
+            json.dump({'version': MANIFEST_VERSION, 'entries': self.entries}, mfile,
+                      indent=1, sort_keys=True)
+        os.rename(tmp_name, os.path.join(self.path, MANIFEST))
+
+    def disk_path(self, key):
+        return os.path.join(self.path, key, key + '.vmdk')
+
+    def lookup(self, key):
+        ''' cached disk path for key or None; entries w/o disk are dropped '''
+        if not self.exists():
+            return None
+        self.load()
+        if key not in self.entries:
+            return None
+        if not os.path.isfile(self.disk_path(key)):
+            del self.entries[key]
+            self.save()
+            return None
+        return self.disk_path(key)
+
+    def touch(self, key):
+        self.entries[key]['used'] = int(time.time())
+        self.save()
+
+    def total_size(self):
+        return sum(entry['size'] for entry in self.entries.values())
+
+    def drop(self, key):
+        shutil.rmtree(os.path.join(self.path, key), ignore_errors=True)
+        self.entries.pop(key, None)
+
+    def evict(self, budget, needed=0, keep=None):
+        '''
+        drop least recently used entries until total size plus "needed" fits into
+        "budget" (bytes), returns list of evicted keys
+        '''
+        evicted = []
+        by_use = sorted((entry['used'], key) for (key, entry) in self.entries.items()
+                        if key != keep)
+        while by_use and self.total_size() + needed > budget:
+            (_, key) = by_use.pop(0)
+            self.drop(key)
+            evicted.append(key)
+        return evicted
+
+    def stale_dirs(self):
+        ''' leftovers of interrupted stores: key dirs w/o manifest entries '''
+        return [name for name in os.listdir(self.path)
+                if KEY_RE.match(name) and name not in self.entries]
+
+    def store(self, descriptor, key, budget, needed):
+        '''
+        clone disk into cache (after LRU eviction to fit budget), returns list of
+        evicted keys; raises CacheError if disk does not fit at all
+        '''
+        if needed > budget:
+            raise CacheError("disk (%d bytes) is larger than cache budget (%d bytes)" %
+                             (needed, budget))
+        if not self.exists():
+            os.mkdir(self.path)
+        self.load()
+        for name in self.stale_dirs():
+            shutil.rmtree(os.path.join(self.path, name), ignore_errors=True)
+        evicted = self.evict(budget, needed, keep=key)
+        self.save()
+        os.mkdir(os.path.join(self.path, key))
+        try:
+            clone_disk(self.vmkfstools, descriptor, self.disk_path(key))
+        except CacheError:
+            shutil.rmtree(os.path.join(self.path, key), ignore_errors=True)
+            raise
+        now = int(time.time())
+        size = sum(allocated_size(extent) for extent in disk_extents(self.disk_path(key)))
+        self.entries[key] = {'name': os.path.basename(descriptor), 'size': size,
+                             'added': now, 'used': now}
+        # real size could differ from estimate
+        evicted.extend(self.evict(budget, keep=key))
+        self.save()
+        return evicted
+
+    def summary(self):
+        return {'datastore': self.name, 'path': self.path, 'entries': len(self.entries or {}),
+                'size': self.total_size() if self.entries else 0}
+
+
+def clone_disk(vmkfstools, src, dest):
+    ''' thin clone with "vmkfstools -i" '''
+    proc = subprocess.Popen([vmkfstools, '-i', src, dest, '-d', 'thin'],
+                            stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    out = proc.communicate()[0].decode('utf-8', 'replace').strip()
+    if proc.returncode != 0:
+        raise CacheError("unable to clone %s to %s: %s" % (src, dest, out))
+
+
+def find(key, datastores, vmkfstools='vmkfstools', prefer=None):
+    '''
+    DatastoreCache holding key or None, "prefer" (real path of datastore) is
+    checked first
+    '''
+    if prefer:
+        datastores = sorted(datastores, key=lambda ds: ds[1] != prefer)
+    for (name, path) in datastores:
+        cache = DatastoreCache(name, path, vmkfstools)
+        if cache.lookup(key):
+            return cache
+    return None
@@ -0,0 +1,639 @@
+'''
+streaming file copy between hosts (like VM disks from one ESXi to another) in one pipe
+
+- receiver (module on destination host) starts sender on source host, usually as
+  "ssh user@src python - <args>" with SENDER script passed on stdin (or just locally
+  with "local" transport, for same-host copy and tests)
+- sender writes JSON header line with source size and mtime, then frames: fixed
+  header (offset, raw length, payload length, flags, sha1 of raw data) and payload,
+  zlib-compressed if it is worth it; frame with zero length marks the end
+- with "sparse" sender skips holes (found with SEEK_DATA/SEEK_HOLE where supported)
+  and zero blocks: chunk with them is sent as extent map (count, then offset and
+  length of every data extent in chunk) followed by extent data, and receiver
+  writes only extents, so destination is sparse too (thin, like for "vmkfstools -i
+  ... -d thin"); sha1 is still for the whole chunk, zeros included
+- receiver checks sha1 of every chunk and records hashes of verified chunks in
+  state file next to destination (".<name>.xfer"), saved every few seconds: after
+  dropped link transfer is resumed from the last verified chunk (in the same run,
+  up to "retries" times, or on the next run)
+- state of complete transfer is kept too, so re-run with unchanged source and
+  destination is just a "stat" of source
+- block hashes of both source and destination are kept in sidecar manifests
+  (".<name>.blocks", valid while file size and mtime are the same as recorded;
+  mtime is in ns, and manifest is neither saved nor trusted for file modified
+  less than RACY_SECONDS before hashing, like "racy" entries of git index: change
+  in the same tick of coarse filesystem clock would go unnoticed):
+  source with changed mtime but the same content (root hash from manifest) is not
+  transferred again, and when destination already has some data (changed source,
+  or forced copy over existing file) receiver passes its block hashes to sender,
+  and chunks that are the same are sent as hash-only frames, rsync-style; with
+  valid manifest of source they are not even read
+- destination gets mtime of source (like with "rsync -t"), so its manifest is not
+  racy and it could be source for next copy at once
+'''
+
+import binascii
+import hashlib
+import json
+import os
+import struct
+import subprocess
+import time
+import zlib
+try:
+    from shlex import quote
+except ImportError:
+    from pipes import quote
+
+# offset, raw length, payload length, flags, sha1 of raw data
+FRAME = struct.Struct('>QIIB20s')
+FLAG_ZLIB = 1
+FLAG_EXTENTS = 2
+FLAG_SAME = 4
+# extent count, then (offset in chunk, length) for every extent
+EXTENT_COUNT = struct.Struct('>I')
+EXTENT = struct.Struct('>II')
+STATE_INTERVAL = 5
+STATE_VERSION = 1
+RACY_SECONDS = 2
+# how long sender is waited for after the end frame (it could be saving manifest)
+SENDER_WAIT = 30
+
+SENDER = r'''
+import binascii, errno, hashlib, json, os, struct, sys, time, zlib
+path, offset, chunk_size, level = sys.argv[1], int(sys.argv[2]), int(sys.argv[3]), int(sys.argv[4])
+sparse = len(sys.argv) > 5 and sys.argv[5] == '1'
+frame = struct.Struct('>QIIB20s')
+ecount, extent = struct.Struct('>I'), struct.Struct('>II')
+block = 64 * 1024
+zeros = b'\0' * block
+zero_digests = {}
+out = getattr(sys.stdout, 'buffer', sys.stdout)
+
+def mtime_ns(st):
+    return getattr(st, 'st_mtime_ns', None) or int(st.st_mtime * 1000000000)
+
+def racy(mtime, started):
+    return mtime >= int((started - RACY_SECONDS) * 1000000000)
+
+started = time.time()
+st = os.stat(path)
+manifest = os.path.join(os.path.dirname(path), '.%s.blocks' % os.path.basename(path))
+header = {'size': st.st_size, 'mtime': mtime_ns(st)}
+# block hashes of unchanged source from previous runs
+stamp = [st.st_size, mtime_ns(st), chunk_size]
+saved = None
+try:
+    with open(manifest) as mfile:
+        saved = json.load(mfile)
+        saved_at = os.fstat(mfile.fileno()).st_mtime
+    if saved.get('stamp') != stamp or racy(stamp[1], saved_at):
+        saved = None
+    else:
+        header['root'] = hashlib.sha1(''.join(saved['hashes']).encode('ascii')).hexdigest()
+except (IOError, OSError, ValueError, KeyError):
+    saved = None
+out.write((json.dumps(header) + '\n').encode('ascii'))
+out.flush()
+src = open(path, 'rb')
+seek_data = sparse and hasattr(os, 'SEEK_DATA')
+
+def allocated(start, end):
+    # (start, end) of allocated ranges, whole range if holes are not supported
+    global seek_data
+    if not seek_data:
+        return [(start, end)]
+    ranges, pos = [], start
+    while pos < end:
+        try:
+            data = os.lseek(src.fileno(), pos, os.SEEK_DATA)
+        except OSError as e:
+            if e.errno == errno.ENXIO:
+                break
+            seek_data = False
+            return [(start, end)]
+        if data >= end:
+            break
+        hole = os.lseek(src.fileno(), data, os.SEEK_HOLE)
+        ranges.append((data, min(hole, end)))
+        pos = hole
+    return ranges
+
+def extents(start, length):
+    # [(offset in chunk, data)] w/o holes and zero blocks
+    result = []
+    for (rstart, rend) in allocated(start, start + length):
+        src.seek(rstart)
+        data = src.read(rend - rstart)
+        pos = 0
+        while pos < len(data):
+            # zero blocks are aligned to file offset
+            size = min(block - (rstart + pos) % block, len(data) - pos)
+            if data[pos:pos + size] != zeros[:size]:
+                rel = rstart + pos - start
+                if result and result[-1][0] + len(result[-1][1]) == rel:
+                    result[-1][1] += data[pos:pos + size]
+                else:
+                    result.append([rel, bytearray(data[pos:pos + size])])
+            pos += size
+    return result
+
+def chunk(offset, length):
+    # (sha1, flags, payload) of chunk
+    if not sparse:
+        src.seek(offset)
+        data = src.read(length)
+        return hashlib.sha1(data).digest(), 0, data
+    parts = extents(offset, length)
+    if len(parts) == 1 and parts[0][0] == 0 and len(parts[0][1]) == length:
+        data = bytes(parts[0][1])
+        return hashlib.sha1(data).digest(), 0, data
+    payload = ecount.pack(len(parts)) + b''.join(
+        extent.pack(rel, len(part)) for (rel, part) in parts) + b''.join(
+        bytes(part) for (rel, part) in parts)
+    if not parts:
+        # whole chunk is a hole: hash zeros only once
+        if length not in zero_digests:
+            zero_digests[length] = hashlib.sha1(b'\0' * length).digest()
+        return zero_digests[length], 2, payload
+    data = bytearray(length)
+    for (rel, part) in parts:
+        data[rel:rel + len(part)] = part
+    return hashlib.sha1(bytes(data)).digest(), 2, payload
+
+# chunks with these hashes are already at destination (or None)
+known = KNOWN
+hashes = []
+while offset < st.st_size:
+    length = min(chunk_size, st.st_size - offset)
+    num = offset // chunk_size
+    if known is not None and num < len(known):
+        if saved is not None and saved['hashes'][num] == known[num]:
+            # unchanged chunk, not even read
+            out.write(frame.pack(offset, length, 0, 4, binascii.unhexlify(known[num])))
+            hashes.append(known[num])
+            offset += length
+            continue
+    digest, flags, payload = chunk(offset, length)
+    hashes.append(binascii.hexlify(digest).decode('ascii'))
+    if known is not None and num < len(known) and hashes[-1] == known[num]:
+        flags, payload = 4, b''
+    elif level:
+        packed = zlib.compress(payload, level)
+        if len(packed) < len(payload):
+            flags, payload = flags | 1, packed
+    out.write(frame.pack(offset, length, len(payload), flags, digest))
+    out.write(payload)
+    offset += length
+out.write(frame.pack(offset, 0, 0, 0, b'\0' * 20))
+out.flush()
+if saved is None and len(hashes) * chunk_size >= st.st_size and not racy(stamp[1], started):
+    # whole source was hashed: save manifest for next runs (if source dir is writable)
+    try:
+        with open(manifest + '.tmp', 'w') as mfile:
+            json.dump({'stamp': stamp, 'hashes': hashes}, mfile)
+        os.rename(manifest + '.tmp', manifest)
+    except (IOError, OSError):
+        pass
+'''
+
+
+class TransferError(Exception):
+    ''' transfer failed, not worth retrying (like missing source) '''
+
+
+class LinkError(Exception):
+    ''' stream broken or corrupted: worth resuming '''
+
+
+def sender_argv(params):
+    '''
+    command to run python (reading script from stdin) on source host, from module
+    params (transport, python, ssh_args, src_user, src_host)
+    '''
+    if params['transport'] == 'local':
+        return [params['python'], '-']
+    return (['ssh'] + params['ssh_args'] + ['%s@%s' % (params['src_user'], params['src_host']),
+            params['python'], '-'])
+
+
+def state_path(dest):
+    ''' ".<name>.xfer" next to destination '''
+    return os.path.join(os.path.dirname(dest), '.%s.xfer' % os.path.basename(dest))
+
+
+def manifest_path(path):
+    ''' ".<name>.blocks" next to file '''
+    return os.path.join(os.path.dirname(path), '.%s.blocks' % os.path.basename(path))
+
+
+def root_hash(hashes):
+    ''' hash of whole file from block hashes '''
+    return hashlib.sha1(''.join(hashes).encode('ascii')).hexdigest()
+
+
+def mtime_ns(st):
+    ''' full-precision mtime (from float one on python w/o st_mtime_ns) '''
+    return getattr(st, 'st_mtime_ns', None) or int(st.st_mtime * 1000000000)
+
+
+def file_stamp(path, chunk_size):
+    st = os.stat(path)
+    return [st.st_size, mtime_ns(st), chunk_size]
+
+
+def is_racy(stamp, started):
+    ''' file of "stamp" was modified too close to "started" (time) to trust its hashes '''
+    return stamp[1] >= int((started - RACY_SECONDS) * 1000000000)
+
+
+def load_manifest(path, chunk_size):
+    ''' block hashes from manifest, None if there is none or file was changed since '''
+    try:
+        with open(manifest_path(path)) as mfile:
+            manifest = json.load(mfile)
+            saved_at = os.fstat(mfile.fileno()).st_mtime
+        stamp = file_stamp(path, chunk_size)
+        if manifest.get('stamp') == stamp and not is_racy(stamp, saved_at):
+            return manifest['hashes']
+    except (IOError, OSError, ValueError, KeyError):
+        pass
+    return None
+
+
+def save_manifest(path, chunk_size, hashes, stamp=None, started=None):
+    '''
+    write manifest of file hashed since "started" (time, now by default), unless it
+    is racy; errors are ignored (like on read-only datastore)
+    '''
+    try:
+        stamp = stamp or file_stamp(path, chunk_size)
+        if is_racy(stamp, started or time.time()):
+            return
+        tmp_name = manifest_path(path) + '.tmp'
+        with open(tmp_name, 'w') as mfile:
+            json.dump({'stamp': stamp, 'hashes': hashes}, mfile)
+        os.rename(tmp_name, manifest_path(path))
+    except (IOError, OSError):
+        pass
+
+
+def set_mtime(path, mtime):
+    ''' set mtime (ns) of file, atime is set to now '''
+    try:
+        os.utime(path, ns=(int(time.time() * 1000000000), mtime))
+    except TypeError:
+        # python w/o "ns"
+        os.utime(path, (time.time(), mtime / 1000000000.0))
+
+
+def file_hashes(path, chunk_size, save=True):
+    ''' block hashes from manifest if it is still valid, else read (and saved if "save") '''
+    hashes = load_manifest(path, chunk_size)
+    if hashes is not None:
+        return hashes
+    started = time.time()
+    stamp = file_stamp(path, chunk_size)
+    hashes = []
+    with open(path, 'rb') as hfile:
+        while True:
+            data = hfile.read(chunk_size)
+            if not data:
+                break
+            hashes.append(hashlib.sha1(data).hexdigest())
+    if save:
+        save_manifest(path, chunk_size, hashes, stamp, started)
+    return hashes
+
+
+def file_sha1(fobj, offset, length):
+    fobj.seek(offset)
+    return hashlib.sha1(fobj.read(length)).hexdigest()
+
+
+def read_exactly(stream, size):
+    ''' read "size" bytes, None on EOF before that '''
+    chunks = []
+    while size:
+        data = stream.read(size)
+        if not data:
+            return None
+        chunks.append(data)
+        size -= len(data)
+    return b''.join(chunks)
+
+
+def unpack_extents(payload, raw_len, offset):
+    ''' (whole chunk data, list of (start, length) of extents) from extent map payload '''
+    try:
+        (count,) = EXTENT_COUNT.unpack_from(payload, 0)
+        pos = EXTENT_COUNT.size
+        extents = []
+        for _ in range(count):
+            extents.append(EXTENT.unpack_from(payload, pos))
+            pos += EXTENT.size
+    except struct.error:
+        raise LinkError("bad extent map for chunk at %d" % offset)
+    data = bytearray(raw_len)
+    for (start, length) in extents:
+        if start + length > raw_len or pos + length > len(payload):
+            raise LinkError("bad extent map for chunk at %d" % offset)
+        data[start:start + length] = payload[pos:pos + length]
+        pos += length
+    return (bytes(data), extents)
+
+
+class Receiver(object):
+    '''
+    pull "src" via "sender_argv" (command that runs python reading script from stdin,
+    like ['ssh', 'host', 'python', '-']) into local "dest"; "src_id" identifies
+    source in state (like "host:path"), "remote_shell" means that sender args are
+    passed through shell (like with ssh) and have to be quoted
+    '''
+
+    def __init__(self, sender_argv, src, dest, chunk_size, level=1, retries=3,
+                 retry_delay=2, force=False, src_id=None, remote_shell=False, sparse=True):
+        self.sender_argv = sender_argv
+        self.remote_shell = remote_shell
+        self.src = src
+        self.src_id = src_id or src
+        self.dest = dest
+        self.chunk_size = chunk_size
+        self.level = level
+        self.sparse = sparse
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.force = force
+        self.state_file = state_path(dest)
+        self.state = None
+        # hashes of chunks already at destination, for delta transfer
+        self.known = None
+        self.zero_digests = dict()
+        self.stats = dict(transferred=0, wire_bytes=0, sparse_bytes=0, same_bytes=0, chunks=0,
+                          retries=0, resumed_from=0, source_changed=False)
+
+    # state
+
+    def load_state(self):
+        ''' saved state if it is for the same source and chunk size '''
+        try:
+            with open(self.state_file) as sfile:
+                state = json.load(sfile)
+        except (IOError, OSError, ValueError):
+            return None
+        if (state.get('version') != STATE_VERSION or state.get('src') != self.src_id or
+                state.get('chunk_size') != self.chunk_size):
+            return None
+        return state
+
+    def save_state(self):
+        tmp_name = self.state_file + '.tmp'
+        with open(tmp_name, 'w') as sfile:
+            json.dump(self.state, sfile)
+        os.rename(tmp_name, self.state_file)
+
+    def new_state(self, size=None, mtime=None):
+        return {'version': STATE_VERSION, 'src': self.src_id, 'chunk_size': self.chunk_size,
+                'size': size, 'mtime': mtime, 'hashes': [], 'complete': False}
+
+    def dest_stat(self):
+        st = os.stat(self.dest)
+        return [st.st_size, mtime_ns(st)]
+
+    def verified_offset(self):
+        '''
+        drop chunks that are not on disk as recorded (like after crash before
+        data hit the disk), truncate destination to the last verified one (unless
+        the rest is still needed for delta transfer)
+        '''
+        hashes = self.state['hashes']
+        if not os.path.exists(self.dest):
+            del hashes[:]
+            return 0
+        with open(self.dest, 'r+b') as dfile:
+            dsize = os.fstat(dfile.fileno()).st_size
+            while hashes:
+                start = (len(hashes) - 1) * self.chunk_size
+                length = min(self.chunk_size, self.state['size'] - start)
+                if start + length <= dsize and file_sha1(dfile, start, length) == hashes[-1]:
+                    break
+                hashes.pop()
+            offset = min(len(hashes) * self.chunk_size, self.state['size'] or 0)
+            if self.known is None:
+                dfile.truncate(offset)
+        return offset
+
+    def zero_digest(self, length):
+        if length not in self.zero_digests:
+            self.zero_digests[length] = hashlib.sha1(b'\0' * length).digest()
+        return self.zero_digests[length]
+
+    # stream
+
+    def start_sender(self, offset):
+        args = [self.src, str(offset), str(self.chunk_size), str(self.level),
+                '1' if self.sparse else '0']
+        if self.remote_shell:
+            args = [quote(arg) for arg in args]
+        argv = self.sender_argv + args
+        proc = subprocess.Popen(argv, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                stderr=subprocess.PIPE)
+        # hex hashes only, no quotes to escape
+        script = "import json\nKNOWN = json.loads('%s')\nRACY_SECONDS = %d\n%s" % (
+            json.dumps(self.known), RACY_SECONDS, SENDER)
+        proc.stdin.write(script.encode('ascii'))
+        proc.stdin.close()
+        return proc
+
+    def stop_sender(self, proc, complete=False):
+        '''
+        returns stderr of sender; sender that sent the end frame ("complete") is
+        waited for, as it could be saving source manifest, and killed only if it
+        takes longer than SENDER_WAIT; one stopped early (error, nothing to send)
+        is killed at once
+        '''
+        if complete:
+            proc.stdout.close()
+            deadline = time.time() + SENDER_WAIT
+            while proc.poll() is None and time.time() < deadline:
+                time.sleep(0.05)
+        if proc.poll() is None:
+            proc.kill()
+        err = proc.stderr.read()
+        proc.wait()
+        return err.decode('utf-8', 'replace').strip()
+
+    def read_header(self, proc):
+        line = proc.stdout.readline()
+        try:
+            header = json.loads(line.decode('ascii'))
+            return header['size'], header['mtime'], header.get('root')
+        except (ValueError, KeyError, UnicodeDecodeError):
+            err = self.stop_sender(proc)
+            if not line:
+                # sender did not start or source is not readable
+                raise TransferError("unable to start transfer: %s" % (err or "no output"))
+            raise LinkError("bad stream header: %r" % line[:80])
+
+    def receive(self, proc, offset):
+        ''' read frames into destination, returns True when complete '''
+        mode = 'r+b' if os.path.exists(self.dest) else 'wb'
+        saved = time.time()
+        with open(self.dest, mode) as dfile:
+            if self.known is None:
+                # holes are not written: nothing past offset must be left from older copy
+                dfile.truncate(offset)
+            dfile.seek(offset)
+            while True:
+                header = read_exactly(proc.stdout, FRAME.size)
+                if header is None:
+                    raise LinkError("stream ended at %d" % offset)
+                (foffset, raw_len, data_len, flags, digest) = FRAME.unpack(header)
+                if foffset != offset:
+                    raise LinkError("unexpected offset %d (%d expected)" % (foffset, offset))
+                if raw_len == 0:
+                    # destination could be longer (like older copy with "force")
+                    dfile.truncate(offset)
+                    return True
+                if flags & FLAG_SAME:
+                    # chunk is already here: check that sender means the same one
+                    num = offset // self.chunk_size
+                    hexdigest = binascii.hexlify(digest).decode('ascii')
+                    if self.known is None or num >= len(self.known) or self.known[num] != hexdigest:
+                        raise LinkError("unexpected unchanged chunk at %d" % offset)
+                    offset += raw_len
+                    dfile.seek(offset)
+                    self.state['hashes'].append(hexdigest)
+                    self.stats['same_bytes'] += raw_len
+                    self.stats['wire_bytes'] += FRAME.size
+                    continue
+                payload = read_exactly(proc.stdout, data_len)
+                if payload is None:
+                    raise LinkError("stream ended at %d" % offset)
+                data = payload
+                if flags & FLAG_ZLIB:
+                    try:
+                        data = zlib.decompress(payload)
+                    except zlib.error as e:
+                        raise LinkError("bad compressed chunk at %d: %s" % (offset, e))
+                extents = None
+                if flags & FLAG_EXTENTS:
+                    (data, extents) = unpack_extents(data, raw_len, offset)
+                if extents == []:
+                    actual = self.zero_digest(raw_len)
+                else:
+                    actual = hashlib.sha1(data).digest()
+                if len(data) != raw_len or actual != digest:
+                    raise LinkError("checksum mismatch for chunk at %d" % offset)
+                if extents is None or self.known is not None:
+                    # over older data (delta) zeros have to be written too
+                    dfile.write(data)
+                else:
+                    for (start, length) in extents:
+                        dfile.seek(offset + start)
+                        dfile.write(data[start:start + length])
+                    dfile.seek(offset + raw_len)
+                    self.stats['sparse_bytes'] += raw_len - sum(length for (_, length) in extents)
+                offset += raw_len
+                self.state['hashes'].append(binascii.hexlify(actual).decode('ascii'))
+                self.stats['transferred'] += raw_len
+                self.stats['wire_bytes'] += FRAME.size + data_len
+                self.stats['chunks'] += 1
+                if time.time() - saved > STATE_INTERVAL:
+                    dfile.flush()
+                    os.fsync(dfile.fileno())
+                    self.save_state()
+                    saved = time.time()
+
+    def flush_state(self):
+        ''' save state after data is synced to disk '''
+        if os.path.exists(self.dest):
+            with open(self.dest, 'r+b') as dfile:
+                os.fsync(dfile.fileno())
+        self.save_state()
+
+    def run(self, check_mode=False):
+        '''
+        transfer (or resume), returns True if destination was changed;
+        raises TransferError
+        '''
+        self.state = self.load_state()
+        if self.state is not None and self.state['complete']:
+            if not os.path.exists(self.dest):
+                self.state = None
+            elif self.dest_stat() != self.state.get('dest'):
+                if not self.force:
+                    raise TransferError("destination %s was changed after transfer, "
+                                        "use force to overwrite it" % self.dest)
+                self.state = None
+        elif self.state is None and os.path.exists(self.dest) and not self.force:
+            raise TransferError("destination %s exists and is not a transfer in progress, "
+                                "use force to overwrite it" % self.dest)
+        if self.state is None:
+            self.state = self.new_state()
+            offset = 0
+            if os.path.exists(self.dest) and not check_mode:
+                # forced over existing file: send only chunks that differ
+                self.known = file_hashes(self.dest, self.chunk_size, save=False)
+        elif self.state['complete']:
+            # just check that source is still the same
+            offset = self.state['size']
+        else:
+            offset = self.verified_offset()
+        self.stats['resumed_from'] = offset
+        if check_mode:
+            return not self.state['complete']
+
+        attempt = 0
+        changed = True
+        while True:
+            proc = self.start_sender(offset)
+            try:
+                (size, mtime, root) = self.read_header(proc)
+                if self.state['hashes'] and [size, mtime] != [self.state['size'],
+                                                            self.state['mtime']]:
+                    self.stop_sender(proc)
+                    if (self.state['complete'] and root is not None and
+                            root == self.state.get('root')):
+                        # source was touched but content is the same
+                        self.state['size'] = size
+                        self.state['mtime'] = mtime
+                        self.save_state()
+                        return False
+                    # source changed since last (partial or complete) run: start over,
+                    # sending only chunks that differ from those already here
+                    self.stats['source_changed'] = True
+                    self.known = self.state['hashes']
+                    self.state = self.new_state(size, mtime)
+                    self.stats['resumed_from'] = offset = 0
+                    continue
+                if self.state['complete']:
+                    self.stop_sender(proc)
+                    return False
+                self.state['size'] = size
+                self.state['mtime'] = mtime
+                dest_size = os.path.getsize(self.dest) if os.path.exists(self.dest) else None
+                self.receive(proc, offset)
+                self.stop_sender(proc, complete=True)
+                # delta over the same file changes nothing
+                changed = self.known is None or self.stats['transferred'] > 0 or \
+                    dest_size != size
+                break
+            except LinkError as e:
+                err = self.stop_sender(proc)
+                self.flush_state()
+                attempt += 1
+                if attempt > self.retries:
+                    raise TransferError("%s (%s), gave up after %d retries" % (e, err, self.retries))
+                self.stats['retries'] = attempt
+                time.sleep(self.retry_delay)
+                offset = self.verified_offset()
+        self.state['complete'] = True
+        self.state['root'] = root_hash(self.state['hashes'])
+        self.flush_state()
+        set_mtime(self.dest, self.state['mtime'])
+        self.state['dest'] = self.dest_stat()
+        self.save_state()
+        # destination could be source for next copy
+        save_manifest(self.dest, self.chunk_size, self.state['hashes'])
+        return changed
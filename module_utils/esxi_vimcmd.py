@@ -0,0 +1,138 @@
+'''
+parser for "vim-cmd" managed object dumps, looking like
+
+    (vim.host.AutoStartManager.AutoPowerInfo) [
+       (vim.host.AutoStartManager.AutoPowerInfo) {
+          key = 'vim.VirtualMachine:3',
+          startOrder = 1,
+          startAction = "PowerOn",
+          stopDelay = -1,
+       }
+    ]
+
+objects are converted to dicts (with object type in "_type"), arrays to lists,
+values to str/int/bool (C(<unset>) is None); text before first object (like
+"Listsummary:") is skipped
+
+output is tokenized with one regexp scan (no per-line splitting or string copies),
+parser is iterative, so deeply nested dumps like "vmsvc/get.config" are ok too
+'''
+
+import re
+
+# leading whitespace is eaten with each token
+TOKEN_RE = re.compile(r'''
+    \s*(?:
+    \((?P<type>[\w.\[\]$]+)\)
+  | (?P<lbrace>\{)
+  | (?P<rbrace>\})
+  | (?P<lbrack>\[)
+  | (?P<rbrack>\])
+  | (?P<sep>[=,])
+  | "(?P<dq>[^"\\]*(?:\\.[^"\\]*)*)"
+  | '(?P<sq>[^']*)'
+  | (?P<bare>[^\s,={}\[\]"']+)
+  )
+''', re.VERBOSE | re.DOTALL)
+
+INT_RE = re.compile(r'^-?\d+$')
+
+UNESCAPE_RE = re.compile(r'\\(.)', re.DOTALL)
+
+
+def convert_bare(val):
+    ''' convert unquoted value to python type '''
+    if INT_RE.match(val):
+        return int(val)
+    if val == 'true':
+        return True
+    if val == 'false':
+        return False
+    if val == '<unset>':
+        return None
+    return val
+
+
+def parse(text):
+    '''
+    parse vim-cmd dump into nested dicts and lists; returns first top-level
+    object or list, or None if there is none
+    '''
+    root = None
+    stack = []
+    key = None
+    pending_type = None
+    for match in TOKEN_RE.finditer(text):
+        kind = match.lastgroup
+        if kind == 'sep' or kind is None:
+            continue
+        if kind == 'type':
+            pending_type = match.group('type')
+            continue
+        if kind == 'lbrace' or kind == 'lbrack':
+            if kind == 'lbrace':
+                new = {'_type': pending_type} if pending_type else {}
+            else:
+                new = []
+            pending_type = None
+            if not stack:
+                root = new
+            elif isinstance(stack[-1], list):
+                stack[-1].append(new)
+            else:
+                stack[-1][key] = new
+                key = None
+            stack.append(new)
+            continue
+        if kind == 'rbrace' or kind == 'rbrack':
+            if stack:
+                stack.pop()
+                if not stack:
+                    return root
+            key = None
+            continue
+        # scalars: dict key or value
+        if not stack:
+            # preamble like "Listsummary:"
+            continue
+        if kind == 'dq':
+            val = match.group('dq')
+            if '\\' in val:
+                val = UNESCAPE_RE.sub(r'\1', val)
+        elif kind == 'sq':
+            val = match.group('sq')
+        else:
+            val = match.group('bare')
+        container = stack[-1]
+        if isinstance(container, list):
+            container.append(convert_bare(val) if kind == 'bare' else val)
+        elif key is None:
+            key = val
+        else:
+            container[key] = convert_bare(val) if kind == 'bare' else val
+            key = None
+        pending_type = None
+    return root
+
+
+def moref_id(ref):
+    ''' id from managed object reference like 'vim.VirtualMachine:3' '''
+    return ref.rsplit(':', 1)[-1]
+
+
+def parse_autostart_seq(text):
+    '''
+    parse "hostsvc/autostartmanager/get_autostartseq" output to map
+    "vm_id (int) -> {'order': startOrder, 'action': startAction}"
+    '''
+    sinfo = dict()
+    for entry in parse(text) or []:
+        if not isinstance(entry, dict) or 'key' not in entry:
+            continue
+        try:
+            vm_id = int(moref_id(entry['key']))
+        except ValueError:
+            continue
+        sinfo[vm_id] = {'order': entry.get('startOrder', -1),
+                        'action': entry.get('startAction', '')}
+    return sinfo
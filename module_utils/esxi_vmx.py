@@ -0,0 +1,188 @@
+'''
+order-preserving editor for VM configs (.vmx), looking like
+
+    .encoding = "UTF-8"
+    displayName = "phoenix11"
+    annotation = "test|0Aserver"
+    ethernet0.networkName = "adm-srv"
+
+- unchanged lines (comments, blank lines, odd formatting) are kept as is
+- keys are case-insensitive (like for VMware), changed entries keep their place,
+  new ones are added at the end
+- values are unescaped on read and escaped on write: VMware encodes special chars
+  as "|XX" hex codes (|22 for double quote, |0A for newline, |7C for "|" itself)
+- edits are described by list of operations (see "apply_operations"), shared by
+  "esxi_vmx" and "esxi_vm_clone" modules
+'''
+
+import fnmatch
+import re
+
+ENTRY_RE = re.compile(r'^\s*(?P<key>[^\s=#]+)\s*=\s*(?:"(?P<quoted>.*)"|(?P<bare>.*?))\s*$')
+# run of codes: non-ascii chars are escaped as bytes of their UTF-8 sequence
+UNESCAPE_RE = re.compile(r'(?:\|[0-9A-Fa-f]{2})+')
+# "|" itself, quotes and control chars
+ESCAPE_RE = re.compile(r'[|"\x00-\x1f\x7f]')
+OPERATIONS = ['rename_prefix', 'remove', 'set', 'ovf_env']
+
+
+def unescape(value):
+    ''' "a|22b|0A" -> 'a"b\\n', "|D0|AF" -> u'\\u042f' '''
+    return UNESCAPE_RE.sub(lambda m: bytearray(int(code, 16) for code in m.group(0).split('|')[1:])
+                           .decode('utf-8', 'replace'), value)
+
+
+def escape(value):
+    ''' 'a"b\\n' -> "a|22b|0A" '''
+    return ESCAPE_RE.sub(lambda m: '|%02X' % ord(m.group(0)), value)
+
+
+def xml_attr(value):
+    ''' value for double-quoted xml attribute '''
+    return value.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;') \
+                .replace('"', '&quot;')
+
+
+def ovf_env(properties):
+    '''
+    "guestinfo.ovfEnv" value (unescaped) from list of (key, value) like
+    '<Property oe:key="hostname" oe:value="vm1"/>\\n...'
+    '''
+    return ''.join('<Property oe:key="%s" oe:value="%s"/>\n' % (xml_attr(key), xml_attr(str(value)))
+                   for (key, value) in properties)
+
+
+class VmxConfig(object):
+    ''' parsed .vmx: list of lines, each either entry [key, value, raw] or [None, None, raw] '''
+
+    def __init__(self, text):
+        self.lines = []
+        self.index = dict()
+        self.trailing_newline = text.endswith('\n')
+        # CRLF file is written back with CRLF, so unchanged one stays the same
+        self.newline = '\r\n' if '\r\n' in text else '\n'
+        lines = text.split('\n') if text else []
+        if self.trailing_newline:
+            lines.pop()
+        for raw in lines:
+            if raw.endswith('\r'):
+                raw = raw[:-1]
+            match = ENTRY_RE.match(raw)
+            if match:
+                value = match.group('quoted')
+                if value is None:
+                    value = match.group('bare')
+                key = match.group('key')
+                self.index[key.lower()] = len(self.lines)
+                self.lines.append([key, unescape(value), raw])
+            else:
+                self.lines.append([None, None, raw])
+
+    def keys(self):
+        return [line[0] for line in self.lines if line is not None and line[0] is not None]
+
+    def get(self, key, default=None):
+        pos = self.index.get(key.lower())
+        return default if pos is None else self.lines[pos][1]
+
+    def __contains__(self, key):
+        return key.lower() in self.index
+
+    def set(self, key, value):
+        ''' set value (str), returns True if it was changed '''
+        pos = self.index.get(key.lower())
+        if pos is None:
+            self.index[key.lower()] = len(self.lines)
+            self.lines.append([key, value, None])
+            return True
+        line = self.lines[pos]
+        if line[1] == value:
+            return False
+        line[1] = value
+        line[2] = None
+        return True
+
+    def remove(self, key):
+        ''' remove entry, returns True if it was there '''
+        pos = self.index.pop(key.lower(), None)
+        if pos is None:
+            return False
+        self.lines[pos] = None
+        return True
+
+    def rename_prefix(self, old, new):
+        ''' replace "old" prefix of values with "new" (like "vm1.vmdk" -> "vm2.vmdk"), returns changed keys '''
+        changed = []
+        for line in self.lines:
+            if line is not None and line[0] is not None and line[1].startswith(old):
+                line[1] = new + line[1][len(old):]
+                line[2] = None
+                changed.append(line[0])
+        return changed
+
+    def render(self):
+        ''' config text; changed and new entries are formatted like 'key = "value"' '''
+        out = []
+        for line in self.lines:
+            if line is None:
+                continue
+            out.append(line[2] if line[2] is not None else '%s = "%s"' % (line[0], escape(line[1])))
+        return self.newline.join(out) + (self.newline if self.trailing_newline or not out else '')
+
+
+def ovf_properties(props):
+    ''' list of (key, value) from dict or list of {key, value} '''
+    if isinstance(props, dict):
+        return list(props.items())
+    return [(prop['key'], prop['value']) for prop in props]
+
+
+def apply_operation(vmx, oper):
+    '''
+    apply one operation (dict with one of OPERATIONS keys) to VmxConfig,
+    returns list of changed keys; raises ValueError if operation is malformed
+    '''
+    if not isinstance(oper, dict):
+        raise ValueError("bad operation (dict expected): %s" % oper)
+    kinds = [kind for kind in OPERATIONS if kind in oper]
+    if len(kinds) != 1:
+        raise ValueError("operation must have exactly one of %s: %s" %
+                         (', '.join(OPERATIONS), oper))
+    kind = kinds[0]
+    arg = oper[kind]
+    changed = []
+    if kind == 'rename_prefix':
+        for (old, new) in arg.items():
+            if old and old != new:
+                changed.extend(vmx.rename_prefix(old, new))
+    elif kind == 'remove':
+        patterns = [arg] if not isinstance(arg, list) else arg
+        for key in vmx.keys():
+            if any(fnmatch.fnmatch(key.lower(), pattern.lower()) for pattern in patterns):
+                vmx.remove(key)
+                changed.append(key)
+    elif kind == 'set':
+        for (key, value) in arg.items():
+            value = '' if value is None else str(value)
+            if value == '' and oper.get('skip_empty'):
+                continue
+            if vmx.set(key, value):
+                changed.append(key)
+    else:
+        try:
+            props = ovf_properties(arg)
+        except (KeyError, TypeError) as e:
+            raise ValueError("bad ovf_env properties (dict or list of key/value expected): %s" % e)
+        if vmx.set('guestinfo.ovfEnv', ovf_env(props)):
+            changed.append('guestinfo.ovfEnv')
+    return changed
+
+
+def apply_operations(vmx, operations):
+    ''' apply operations in order, returns list of changed keys (w/o duplicates) '''
+    changed_keys = []
+    for oper in operations:
+        for key in apply_operation(vmx, oper):
+            if key not in changed_keys:
+                changed_keys.append(key)
+    return changed_keys
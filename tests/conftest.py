@@ -0,0 +1,65 @@
+'''
+module_utils and filter plugins are imported by plain name: ansible loads them
+from configured dirs (see ansible.esxi.cfg), and most of them do not need
+ansible itself; ones that do are skipped w/o it
+
+modules from library/ need ansible: they are loaded with "library_module", with
+our module_utils added to "ansible.module_utils" package (like ansible does for
+configured dirs), and run with "run_module" (args are passed like by ansible)
+
+    python -m pytest -q tests
+    python -m pytest -q -s tests -k bench     # benchmarks, with timings
+'''
+
+import importlib
+import importlib.util
+import json
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FIXTURES = os.path.join(ROOT, 'tests', 'fixtures')
+
+for subdir in ('module_utils', 'filter_plugins'):
+    sys.path.insert(0, os.path.join(ROOT, subdir))
+
+
+def ansible_module_utils(name):
+    '''
+    module_utils module that imports others as "ansible.module_utils.<name>",
+    loaded the same way; test is skipped w/o ansible
+    '''
+    pytest.importorskip('ansible.module_utils.basic')
+    import ansible.module_utils
+    utils_dir = os.path.join(ROOT, 'module_utils')
+    if utils_dir not in ansible.module_utils.__path__:
+        ansible.module_utils.__path__.append(utils_dir)
+    return importlib.import_module('ansible.module_utils.' + name)
+
+
+def library_module(name):
+    ''' module from library/ (as "library_<name>"), test is skipped w/o ansible '''
+    ansible_module_utils('basic')
+    mod_name = 'library_' + name
+    if mod_name not in sys.modules:
+        path = os.path.join(ROOT, 'library', name + '.py')
+        spec = importlib.util.spec_from_file_location(mod_name, path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        sys.modules[mod_name] = module
+    return sys.modules[mod_name]
+
+
+def run_module(module, args, capsys, check_mode=False):
+    ''' run main() of library module with args, returns its result (dict) '''
+    from ansible.module_utils import basic
+    args = dict(args, _ansible_check_mode=check_mode)
+    basic._ANSIBLE_ARGS = json.dumps({'ANSIBLE_MODULE_ARGS': args}).encode('utf-8')
+    try:
+        with pytest.raises(SystemExit):
+            module.main()
+    finally:
+        basic._ANSIBLE_ARGS = None
+    return json.loads(capsys.readouterr().out.strip().splitlines()[-1])
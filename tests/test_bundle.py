@@ -0,0 +1,123 @@
+'''
+bundle cache and resumable download, with local http server that drops
+connection in the middle of the body
+'''
+
+import hashlib
+import os
+import threading
+
+import pytest
+
+from esxi_bundle import (BundleCache, BundleError, Downloader, file_sha256, file_stamp,
+                         parse_checksum, sidecar_path)
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+
+BODY = bytes(bytearray(num % 251 for num in range(3 * 1024 * 1024 + 17)))
+DIGEST = hashlib.sha256(BODY).hexdigest()
+
+
+class Handler(BaseHTTPRequestHandler):
+    '''
+    ranged GET of BODY; the first "drops" responses are cut in the middle, in
+    chunked encoding if "chunked" (client gets IncompleteRead then)
+    '''
+    protocol_version = 'HTTP/1.1'
+    drops = 0
+    chunked = False
+
+    def do_GET(self):
+        start = 0
+        if self.headers.get('Range'):
+            start = int(self.headers['Range'].split('=')[1].rstrip('-'))
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes %d-%d/%d' % (start, len(BODY) - 1,
+                                                                  len(BODY)))
+        else:
+            self.send_response(200)
+        if Handler.chunked:
+            self.send_header('Transfer-Encoding', 'chunked')
+        else:
+            self.send_header('Content-Length', str(len(BODY) - start))
+        self.send_header('ETag', '"v1"')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        body = BODY[start:]
+        if Handler.chunked:
+            self.wfile.write(b'%x\r\n' % len(body))
+        if Handler.drops:
+            Handler.drops -= 1
+            body = body[:len(body) // 2]
+        elif Handler.chunked:
+            body += b'\r\n0\r\n\r\n'
+        self.wfile.write(body)
+        self.close_connection = True
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    httpd = HTTPServer(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=httpd.serve_forever)
+    thread.daemon = True
+    thread.start()
+    yield 'http://127.0.0.1:%d/bundle.zip' % httpd.server_address[1]
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def test_parse_checksum():
+    assert parse_checksum(None) is None
+    assert parse_checksum('sha256:' + DIGEST.upper()) == DIGEST
+    with pytest.raises(BundleError):
+        parse_checksum('md5:' + DIGEST)
+
+
+def test_sidecar_precision(tmp_path):
+    path = str(tmp_path / 'bundle.zip')
+    with open(path, 'wb') as bfile:
+        bfile.write(b'one')
+    os.utime(path, (1500000000.1, 1500000000.1))
+    assert file_sha256(path) == hashlib.sha256(b'one').hexdigest()
+    assert os.path.exists(sidecar_path(path))
+    # same size, same second
+    with open(path, 'wb') as bfile:
+        bfile.write(b'two')
+    os.utime(path, (1500000000.4, 1500000000.4))
+    assert file_stamp(path)[1] != 1500000000 * 1000000000
+    assert file_sha256(path) == hashlib.sha256(b'two').hexdigest()
+
+
+@pytest.mark.parametrize('chunked', [False, True])
+def test_download_resumed(server, tmp_path, chunked):
+    Handler.drops = 2
+    Handler.chunked = chunked
+    partial = str(tmp_path / '.partial' / 'bundle.zip')
+    downloader = Downloader(server, partial, retries=3, retry_delay=0)
+    assert downloader.run() == DIGEST
+    assert downloader.stats['retries'] == 2
+    assert downloader.stats['restarts'] == 0
+    # only missing part was downloaded again
+    assert downloader.stats['downloaded'] < 2 * len(BODY)
+    cache = BundleCache(str(tmp_path))
+    path = cache.store(partial, 'bundle.zip', DIGEST)
+    assert cache.lookup('bundle.zip') == (path, DIGEST)
+
+
+def test_download_gives_up(server, tmp_path):
+    Handler.drops = 5
+    Handler.chunked = False
+    partial = str(tmp_path / '.partial' / 'bundle.zip')
+    with pytest.raises(BundleError):
+        Downloader(server, partial, retries=1, retry_delay=0).run()
+    Handler.drops = 0
+    # resumed on the next run
+    downloader = Downloader(server, partial, retry_delay=0)
+    assert downloader.run() == DIGEST
+    assert downloader.stats['resumed_from'] > 0
@@ -0,0 +1,84 @@
+'''
+compact_table filter: lookups, copy/pickle of rows, and memory on 10k paths vs
+dict per row
+'''
+
+import copy
+import pickle
+import tracemalloc
+
+import pytest
+
+pytest.importorskip('ansible')
+
+from compact import CompactRow, CompactTable, compact_table, table_view
+
+
+def mpath_records(count):
+    return [{'path': 'vmhba%d:C0:T%d:L%d' % (num % 4, num % 16, num),
+             'hba': 'vmhba%d' % (num % 4), 'state': 'active',
+             'dev': 'naa.6000c29%09x' % (num // 2), 'lun': num}
+            for num in range(count)]
+
+
+def test_lookups():
+    table = compact_table(mpath_records(3), 'path')
+    row = table['vmhba1:C0:T1:L1']
+    assert (row.hba, row['dev'], row.lun) == ('vmhba1', 'naa.6000c29000000000', 1)
+    assert dict(row) == mpath_records(3)[1]
+    assert list(table) == ['vmhba0:C0:T0:L0', 'vmhba1:C0:T1:L1', 'vmhba2:C0:T2:L2']
+    with pytest.raises(AttributeError):
+        row.nothing
+    with pytest.raises(KeyError):
+        table['nothing']
+
+
+def test_missing_columns():
+    table = compact_table([{'k': 'a'}, {'k': 'b', 'x': 1}, {'k': 'c'}], 'k')
+    assert [table[key].get('x') for key in 'abc'] == [None, 1, None]
+
+
+def test_plain_form():
+    table = compact_table(mpath_records(5), 'path')
+    plain = table.to_plain()
+    assert sorted(plain) == ['columns', 'data', 'keys']
+    view = table_view(plain)
+    assert dict(view['vmhba3:C0:T3:L3']) == mpath_records(5)[3]
+    assert table_view(table) is table
+    assert table_view({'a': 1}) == {'a': 1}
+
+
+def test_row_copy_and_pickle():
+    ''' used to recurse forever in __getattr__ on row w/o slots set '''
+    table = compact_table(mpath_records(3), 'path')
+    row = table['vmhba2:C0:T2:L2']
+    for other in (copy.copy(row), copy.deepcopy(row), pickle.loads(pickle.dumps(row)),
+                  pickle.loads(pickle.dumps(row, 2))):
+        assert isinstance(other, CompactRow)
+        assert dict(other) == dict(row)
+    other = pickle.loads(pickle.dumps(table))
+    assert isinstance(other, CompactTable)
+    assert dict(other['vmhba1:C0:T1:L1']) == dict(table['vmhba1:C0:T1:L1'])
+    assert dict(copy.deepcopy(table)['vmhba0:C0:T0:L0']) == mpath_records(1)[0]
+    with pytest.raises(AttributeError):
+        CompactRow.__new__(CompactRow)._table
+
+
+def allocated(build):
+    tracemalloc.start()
+    try:
+        res = build()
+        return (tracemalloc.get_traced_memory()[0], res)
+    finally:
+        tracemalloc.stop()
+
+
+def test_bench_memory_10k_paths():
+    recs = mpath_records(10000)
+    # values are built anew for both, like after parsing command output
+    (dict_size, _) = allocated(lambda: dict((rec['path'], rec)
+                                            for rec in copy.deepcopy(recs)))
+    (compact_size, _) = allocated(lambda: compact_table(copy.deepcopy(recs), 'path'))
+    print('\n10k paths: dict per row %.1f MB, compact table %.1f MB' %
+          (dict_size / 1024.0 / 1024.0, compact_size / 1024.0 / 1024.0))
+    assert compact_size < dict_size
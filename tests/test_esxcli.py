@@ -0,0 +1,170 @@
+'''
+esxcli output parsers: recorded-like fixtures, and csv/xml parsing vs old text
+scraping of "esxcli software vib ..." output on big synthetic listing
+'''
+
+import os
+import time
+
+import pytest
+
+from conftest import FIXTURES, library_module, run_module
+from esxi_esxcli import PARSE_ERRORS, parse_csv, parse_output, parse_xml
+
+FIELDS = ['Name', 'ID', 'Version', 'Vendor', 'AcceptanceLevel', 'InstallDate']
+
+
+def fixture(name):
+    with open(os.path.join(FIXTURES, name)) as ffile:
+        return ffile.read()
+
+
+def parse_cmd_responce(lines, skip_empty=True):
+    ''' old esxi_vib text scraper, kept as baseline '''
+    res = dict()
+    title = None
+    for line in lines.split('\n'):
+        if title is None:
+            title = line
+        elif line.startswith('   '):
+            key, val = line.lstrip().split(":", 1)
+            vals = val.lstrip()
+            if not (skip_empty and vals == ''):
+                res[key] = val.lstrip()
+
+    res['Title'] = title
+    return res
+
+
+def test_xml_structure():
+    res = parse_xml(fixture('esxcli_vib_install.xml'))
+    assert res == {'Message': 'Operation finished successfully.',
+                   'Reboot Required': False,
+                   'VIBs Installed': ['VMware_bootbank_esx-ui_1.21.0-5724747'],
+                   'VIBs Removed': ['VMware_bootbank_esx-ui_1.8.0-4516221'],
+                   'VIBs Skipped': []}
+
+
+def test_vib_dry_run_planned():
+    ''' check mode of esxi_vib trusts "--dry-run" result '''
+    esxi_vib = library_module('esxi_vib')
+    result = parse_output(fixture('esxcli_vib_install.xml'))
+    assert esxi_vib.planned_change(result)
+    result['VIBs Installed'] = []
+    assert esxi_vib.planned_change(result)
+    result['VIBs Removed'] = []
+    assert not esxi_vib.planned_change(result)
+
+
+def fake_esxcli(tmp_path, monkeypatch):
+    ''' "esxcli" in PATH: vib list from csv fixture, transactions from xml one '''
+    script = tmp_path / 'esxcli'
+    script.write_text(u'''#!/bin/sh
+case "$*" in
+  *"software vib list"*) cat "%s" ;;
+  *"software vib"*) cat "%s" ;;
+  *) exit 1 ;;
+esac
+''' % (os.path.join(FIXTURES, 'esxcli_vib_list.csv'), os.path.join(FIXTURES, 'esxcli_vib_install.xml')))
+    script.chmod(0o755)
+    monkeypatch.setenv('PATH', '%s%s%s' % (tmp_path, os.pathsep, os.environ['PATH']))
+
+
+@pytest.mark.parametrize('vib', [{'name': 'esx-ui', 'state': 'latest', 'url': '/tmp/esx-ui.vib'},
+                                 {'name': 'esx-new', 'url': '/tmp/esx-new.vib'},
+                                 {'name': 'esx-ui', 'state': 'absent'}])
+def test_vib_check_mode(tmp_path, monkeypatch, capsys, vib):
+    esxi_vib = library_module('esxi_vib')
+    fake_esxcli(tmp_path, monkeypatch)
+    res = run_module(esxi_vib, vib, capsys, check_mode=True)
+    assert res['changed']
+    assert res['command'].endswith('--dry-run')
+    assert res['details']['VIBs Installed'] == ['VMware_bootbank_esx-ui_1.21.0-5724747']
+
+
+def test_xml_list():
+    res = parse_output(fixture('esxcli_portgroup_list.xml'))
+    assert res == [{'ActiveClients': 2, 'Name': 'srv-smb', 'VLANID': 120,
+                    'VirtualSwitch': 'vSwitch0'},
+                   {'ActiveClients': 0, 'Name': 'Management Network', 'VLANID': 0,
+                    'VirtualSwitch': 'vSwitch0'}]
+
+
+def test_xml_empty_and_broken():
+    assert parse_output('') is None
+    assert parse_output('<output><root></root></output>') is None
+    with pytest.raises(PARSE_ERRORS):
+        parse_output('<output><root>')
+
+
+def test_csv():
+    recs = parse_csv(fixture('esxcli_vib_list.csv'))
+    assert [rec['Name'] for rec in recs] == ['esx-base', 'esx-ui', 'lsu-lsi-lsi-msgpt3-plugin',
+                                             'net55-r8168']
+    # trailing comma of header does not make extra field
+    assert sorted(recs[0]) == ['AcceptanceLevel', 'CreationDate', 'ID', 'InstallDate', 'Name',
+                               'Status', 'Vendor', 'Version']
+    assert recs[2]['Version'] == '1.0.0-1vmw.650.0.0.4564106'
+
+
+def test_csv_types():
+    text = 'ActiveClients,Name,VLANID,VirtualSwitch,\n2,srv-smb,120,vSwitch0,\n0,x,,vSwitch1,\n'
+    recs = parse_output(text, 'csv', types={'VLANID': int, 'ActiveClients': int})
+    assert (recs[0]['VLANID'], recs[0]['ActiveClients']) == (120, 2)
+    # empty values are not converted
+    assert recs[1]['VLANID'] == ''
+    with pytest.raises(ValueError):
+        parse_output(text, 'json')
+
+
+def vib_records(count):
+    return [dict(zip(FIELDS, ['vib-%d' % num, 'Vendor_bootbank_vib-%d_1.0.%d' % (num, num),
+                              '1.0.%d' % num, 'Vendor %d' % (num % 7), 'VMwareCertified',
+                              '2017-08-01']))
+            for num in range(count)]
+
+
+def as_text(recs):
+    ''' like plain "esxcli software vib get" output '''
+    return '\n'.join('%s\n%s\n' % (rec['ID'], '\n'.join('   %s: %s' % (key, rec[key])
+                                                        for key in FIELDS))
+                     for rec in recs)
+
+
+def as_csv(recs):
+    return '%s,\n%s' % (','.join(FIELDS),
+                        ''.join('%s,\n' % ','.join(rec[key] for key in FIELDS) for rec in recs))
+
+
+def as_xml(recs):
+    fields = ''.join('<field name="%s"><string>%%(%s)s</string></field>' % (key, key)
+                     for key in FIELDS)
+    return ('<?xml version="1.0" ?>\n'
+            '<output xmlns="http://www.vmware.com/Products/ESX/5.0/esxcli">\n'
+            '<root><list type="structure">\n%s</list></root></output>\n' %
+            ''.join('<structure typeName="VIBExt">%s</structure>\n' % (fields % rec)
+                    for rec in recs))
+
+
+def scrape_text(text):
+    recs = [parse_cmd_responce(block) for block in text.split('\n\n') if block.strip()]
+    for rec in recs:
+        del rec['Title']
+    return recs
+
+
+def test_bench_vib_list():
+    ''' 20000 VIB records: csv and xml parsers vs old text scraping '''
+    recs = vib_records(20000)
+    results = {}
+    for (name, data, parser) in [('text', as_text(recs), scrape_text),
+                                 ('csv', as_csv(recs), parse_csv),
+                                 ('xml', as_xml(recs), parse_xml)]:
+        started = time.time()
+        assert parser(data) == recs
+        results[name] = time.time() - started
+        print('\n%s: %.1f MB, %.3f s' % (name, len(data) / 1024.0 / 1024.0, results[name]),
+              end='')
+    print()
+    # csv is the one for big listings
+    assert results['csv'] < results['xml']
@@ -0,0 +1,77 @@
+'''
+fanout_plan filter: sources per wave stay within limit, holders feed first,
+hostvars with missing facts
+'''
+
+import pytest
+
+pytest.importorskip('ansible')
+
+from ansible import errors
+from fanout import fanout_plan, fanout_waves
+
+HOSTS = ['esx%02d' % num for num in range(30)]
+
+
+def check_limits(plan, have, limit):
+    ''' every host is fed once by host that had file before its wave '''
+    ready_in = dict((host, -1) for host in have)
+    ready_in.update((host, item['wave']) for (host, item) in plan.items())
+    for wave in range(fanout_waves(plan) + 1):
+        feeds = {}
+        for (host, item) in plan.items():
+            if item['wave'] == wave and item['src'] is not None:
+                assert ready_in[item['src']] < wave
+                feeds[item['src']] = feeds.get(item['src'], 0) + 1
+        assert max(list(feeds.values()) or [0]) <= limit
+
+
+def test_seed_30_hosts():
+    plan = fanout_plan(HOSTS, [], 3)
+    assert sorted(plan) == HOSTS
+    assert plan[HOSTS[0]] == {'wave': 0, 'src': None}
+    assert [host for host in plan if plan[host]['src'] is None] == [HOSTS[0]]
+    check_limits(plan, [], 3)
+    # 1 -> 4 -> 16 -> 30
+    assert fanout_waves(plan) == 3
+    assert [len([1 for item in plan.values() if item['wave'] == wave])
+            for wave in range(4)] == [1, 3, 12, 14]
+
+
+def test_holders_feed_first():
+    have = ['esx05', 'esx17']
+    plan = fanout_plan(HOSTS, have, 3)
+    assert sorted(plan) == sorted(set(HOSTS) - set(have))
+    check_limits(plan, have, 3)
+    first = [item['src'] for item in plan.values() if item['wave'] == 1]
+    assert sorted(set(first)) == have and len(first) == 6
+    # new holders join in the next wave, after the old ones
+    assert fanout_plan(['a', 'b', 'c', 'd'], ['b'], 1) == {
+        'a': {'wave': 1, 'src': 'b'},
+        'c': {'wave': 2, 'src': 'b'},
+        'd': {'wave': 2, 'src': 'a'}}
+
+
+def test_hostvars():
+    hostvars = dict((host, {'bundle_path': ''}) for host in HOSTS)
+    hostvars['esx03']['bundle_path'] = '/vmfs/volumes/ds1/bundle.zip'
+    # host without the fact at all, and unreachable one (no hostvars)
+    del hostvars['esx04']['bundle_path']
+    del hostvars['esx05']
+    plan = fanout_plan(HOSTS, hostvars, 2, 'bundle_path')
+    assert 'esx03' not in plan
+    assert 'esx04' in plan and 'esx05' in plan
+    check_limits(plan, ['esx03'], 2)
+    with pytest.raises(errors.AnsibleFilterError):
+        fanout_plan(HOSTS, hostvars, 2)
+
+
+@pytest.mark.parametrize('limit, seeds', [(0, 1), (-1, 1), (2, 0)])
+def test_bad_limit(limit, seeds):
+    with pytest.raises(errors.AnsibleFilterError):
+        fanout_plan(HOSTS, [], limit, seeds=seeds)
+
+
+def test_nothing_to_do():
+    assert fanout_plan(HOSTS, HOSTS, 3) == {}
+    assert fanout_waves({}) == -1
@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+'''
+VM inventory from hostd files: generated vmInventory.xml, json cache and its
+invalidation, missing and unreadable .vmx
+'''
+
+import os
+import time
+
+import pytest
+
+import esxi_inventory
+from esxi_inventory import load_inventory, parse_inventory, read_display_name
+
+VOLUME = '5a1b2c3d-0a1b2c3d-4e5f-0025b5000001'
+
+
+def write_inventory(path, entries):
+    with open(path, 'w') as ifile:
+        ifile.write('<ConfigRoot>\n')
+        for (num, (vm_id, vmx)) in enumerate(entries):
+            ifile.write('  <ConfigEntry id="%04d">\n'
+                        '    <objID>%d</objID>\n'
+                        '    <secDomain>23</secDomain>\n'
+                        '    <vmxCfgPath>%s</vmxCfgPath>\n'
+                        '  </ConfigEntry>\n' % (num, vm_id, vmx))
+        ifile.write('</ConfigRoot>\n')
+
+
+def write_vmx(path, name):
+    if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    with open(path, 'wb') as vfile:
+        vfile.write(b'.encoding = "UTF-8"\nconfig.version = "8"\n')
+        vfile.write(b'displayName = "' + name + b'"\nguestOS = "ubuntu-64"\n')
+
+
+@pytest.fixture
+def host(tmp_path):
+    ''' fake host: volumes dir with datastore symlink, inventory with "count" VMs '''
+    volumes = tmp_path / 'volumes'
+    (volumes / VOLUME).mkdir(parents=True)
+    os.symlink(VOLUME, str(volumes / 'nest1-sys'))
+
+    class Host(object):
+        volumes_dir = str(volumes)
+        inventory = str(tmp_path / 'vmInventory.xml')
+        cache = str(tmp_path / 'cache.json')
+
+        def vmx(self, num):
+            return os.path.join(self.volumes_dir, VOLUME, 'vm%d' % num, 'vm%d.vmx' % num)
+
+        def build(self, count):
+            for num in range(count):
+                write_vmx(self.vmx(num), b'vm' + str(num).encode())
+            write_inventory(self.inventory, [(num + 1, self.vmx(num)) for num in range(count)])
+
+        def load(self):
+            return load_inventory(self.inventory, self.cache, self.volumes_dir)
+    return Host()
+
+
+def count_calls(monkeypatch, name):
+    calls = []
+    orig = getattr(esxi_inventory, name)
+
+    def wrapper(*args):
+        calls.append(args)
+        return orig(*args)
+    monkeypatch.setattr(esxi_inventory, name, wrapper)
+    return calls
+
+
+def test_parse_generated(host):
+    host.build(3000)
+    entries = parse_inventory(host.inventory)
+    assert len(entries) == 3000
+    assert entries[0] == (1, host.vmx(0))
+    assert entries[-1] == (3000, host.vmx(2999))
+
+
+def test_load(host):
+    host.build(3)
+    vms = host.load()
+    assert vms[0] == {'id': 1, 'name': 'vm0',
+                      'path': os.path.join(host.volumes_dir, 'nest1-sys', 'vm0', 'vm0.vmx')}
+    assert [vm['id'] for vm in vms] == [1, 2, 3]
+
+
+def test_cache_hit(host, monkeypatch):
+    host.build(50)
+    first = host.load()
+    parsed = count_calls(monkeypatch, 'parse_inventory')
+    read = count_calls(monkeypatch, 'read_display_name')
+    assert host.load() == first
+    assert parsed == [] and read == []
+
+
+def test_cache_invalidated_by_size(host, monkeypatch):
+    host.build(5)
+    host.load()
+    stat = os.stat(host.inventory)
+    write_vmx(host.vmx(5), b'new one')
+    write_inventory(host.inventory, [(num + 1, host.vmx(num)) for num in range(6)])
+    # same mtime, only size differs
+    os.utime(host.inventory, (stat.st_atime, stat.st_mtime))
+    parsed = count_calls(monkeypatch, 'parse_inventory')
+    vms = host.load()
+    assert len(parsed) == 1
+    assert vms[-1]['name'] == 'new one'
+
+
+def test_cache_invalidated_by_mtime(host, monkeypatch):
+    host.build(5)
+    host.load()
+    stat = os.stat(host.inventory)
+    # same size, VMs 1 and 2 swapped their ids
+    entries = [(num + 1, host.vmx(num)) for num in range(5)]
+    entries[0:2] = [(1, host.vmx(1)), (2, host.vmx(0))]
+    write_inventory(host.inventory, entries)
+    os.utime(host.inventory, (stat.st_atime, stat.st_mtime + 10))
+    assert os.path.getsize(host.inventory) == stat.st_size
+    parsed = count_calls(monkeypatch, 'parse_inventory')
+    vms = host.load()
+    assert len(parsed) == 1
+    assert [(vm['id'], vm['name']) for vm in vms[:2]] == [(1, 'vm1'), (2, 'vm0')]
+
+
+def test_vmx_reread_on_mtime(host, monkeypatch):
+    host.build(5)
+    host.load()
+    write_vmx(host.vmx(2), b'renamed')
+    stat = os.stat(host.vmx(2))
+    os.utime(host.vmx(2), (stat.st_atime, stat.st_mtime + 10))
+    read = count_calls(monkeypatch, 'read_display_name')
+    vms = host.load()
+    assert read == [(host.vmx(2),)]
+    assert vms[2]['name'] == 'renamed'
+
+
+def test_missing_and_unreadable_vmx(host):
+    host.build(4)
+    os.unlink(host.vmx(1))
+    # directory in place of .vmx: not readable as file
+    os.unlink(host.vmx(2))
+    os.mkdir(host.vmx(2))
+    assert [vm['id'] for vm in host.load()] == [1, 4]
+    # back again: picked up with cache in place
+    os.rmdir(host.vmx(2))
+    write_vmx(host.vmx(2), b'vm2')
+    assert [vm['id'] for vm in host.load()] == [1, 3, 4]
+    # gone after it was cached
+    os.unlink(host.vmx(3))
+    assert [vm['id'] for vm in host.load()] == [1, 3]
+
+
+def test_broken_inventory(host):
+    with open(host.inventory, 'w') as ifile:
+        ifile.write('<ConfigRoot><ConfigEntry>')
+    with pytest.raises(esxi_inventory.LOAD_ERRORS):
+        host.load()
+
+
+def test_display_name_utf8(tmp_path):
+    path = str(tmp_path / 'vm' / 'vm.vmx')
+    # "|XX" codes are bytes of UTF-8 sequence, raw UTF-8 is kept as is
+    write_vmx(path, b'|D0|A1|D0|B5|D1|80|D0|B2|D0|B5|D1|80 |22one|22 \xd0\xb4\xd0\xb2\xd0\xb0 |7C')
+    assert read_display_name(path) == u'Сервер "one" два |'
+
+
+def test_bench_inventory(host):
+    ''' thousands of VMs: cold load vs cached one '''
+    host.build(5000)
+    started = time.time()
+    assert len(host.load()) == 5000
+    cold = time.time() - started
+    started = time.time()
+    assert len(host.load()) == 5000
+    cached = time.time() - started
+    print('\ninventory of 5000 VMs: cold %.3f s, cached %.3f s' % (cold, cached))
+    assert cached < cold
@@ -0,0 +1,95 @@
+'''
+parse_table filter: column specs, and one pass vs split -> record -> to_dict
+chain on 100k lines of "esxcfg-mpath -L"-like output
+'''
+
+import time
+
+import pytest
+
+pytest.importorskip('ansible')
+
+from ansible import errors
+from parse_table import parse_table
+from split import split_string
+from todict import to_dict
+from torec import to_rec
+
+MPATH_COLUMNS = ['path', 'hba', 'channel', 'target', 'lun', 'rest']
+
+
+def mpath_lines(count):
+    ''' like "esxcfg-mpath -L": runtime name, hba, C/T/L, device and so on '''
+    return ['vmhba%d:C0:T%d:L%d vmhba%d 0 %d %d naa.6000c29%09x fc active' %
+            (num % 4, num % 16, num, num % 4, num % 16, num, num)
+            for num in range(count)]
+
+
+def chain(lines, columns, key):
+    ''' stdout_lines | map('split', None, n) | map('record', columns) | to_dict(key) '''
+    return to_dict([to_rec(split_string(line, None, len(columns) - 1), columns)
+                    for line in lines], key)
+
+
+def test_split():
+    text = 'vmk0 Management Network IPv4\n\nvmk1 vMotion IPv4\n'
+    assert parse_table(text, ['name', 'portgroup'], spec=1, key='name') == {
+        'vmk0': {'name': 'vmk0', 'portgroup': 'Management Network IPv4'},
+        'vmk1': {'name': 'vmk1', 'portgroup': 'vMotion IPv4'}}
+    assert parse_table(text.splitlines(), ['name', 'portgroup'], spec=1, key='name',
+                       value='portgroup')['vmk1'] == 'vMotion IPv4'
+    with pytest.raises(errors.AnsibleFilterError):
+        parse_table('one two\nthree\n', ['a', 'b'])
+    with pytest.raises(errors.AnsibleFilterError):
+        parse_table('one two\n')
+
+
+def test_regexp():
+    text = 'VM 3 order 1\njunk\nVM 12 order 2\n'
+    assert parse_table(text, spec=r'VM (?P<vm>\d+) order (?P<order>\d+)') == \
+        [{'vm': '3', 'order': '1'}, {'vm': '12', 'order': '2'}]
+    assert parse_table(text, ['id', 'n'], spec=r'VM (\d+) order (\d+)', key='id',
+                       value='n') == {'3': '1', '12': '2'}
+
+
+def test_header():
+    text = ('Interface  Port Group/DVPort/Opaque Network        IP Family IP Address\n'
+            '---------  -----------------------------------     --------- ----------\n'
+            'vmk0       Management Network                      IPv4      10.1.1.10\n'
+            'vmk1       vMotion                                 IPv4      10.2.1.10\n')
+    res = parse_table(text, spec='header', key='interface')
+    assert res['vmk0'] == {'interface': 'vmk0',
+                           'port_group_dvport_opaque_network': 'Management Network',
+                           'ip_family': 'IPv4', 'ip_address': '10.1.1.10'}
+    res = parse_table(text, ['name', 'portgroup'], spec='header', key='name', value='portgroup')
+    assert res == {'vmk0': 'Management Network', 'vmk1': 'vMotion'}
+
+
+def test_skip():
+    text = 'header line\n# comment\na 1\nb 2\n'
+    assert parse_table(text, ['k', 'v'], skip=1, skip_re='#', key='k', value='v') == \
+        {'a': '1', 'b': '2'}
+
+
+def best_of(runs, func, *args):
+    times = []
+    for _ in range(runs):
+        started = time.time()
+        res = func(*args)
+        times.append(time.time() - started)
+    return (min(times), res)
+
+
+def test_bench_100k_lines():
+    lines = mpath_lines(100000)
+    text = '\n'.join(lines)
+    (chain_time, expected) = best_of(3, chain, lines, MPATH_COLUMNS, 'path')
+    (split_time, res) = best_of(3, parse_table, text, MPATH_COLUMNS, None, 'path')
+    assert res == expected
+    regexp = r'(\S+) (\S+) (\d+) (\d+) (\d+) (.*)$'
+    (re_time, res) = best_of(3, parse_table, text, MPATH_COLUMNS, regexp, 'path')
+    assert res == expected
+    print('\n100k lines: split -> record -> to_dict %.3f s, parse_table split %.3f s, '
+          'regexp %.3f s' % (chain_time, split_time, re_time))
+    # same work in plain python; real win is w/o per-item jinja filter calls
+    assert split_time < chain_time * 1.5
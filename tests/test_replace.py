@@ -0,0 +1,123 @@
+'''
+bytes-native replace: in-memory "replace_bytes" (for diff) gives the same result
+as streaming Replacer; benchmark against read/subn/write of replace.py fork
+'''
+
+import os
+import re
+import tempfile
+import time
+
+import pytest
+
+from esxi_replace import Replacer, compile_replacements, replace_bytes
+
+SAMPLES = [
+    b'displayName = "vm1"\nscsi0:0.fileName = "vm1.vmdk"\n',
+    b'displayName = "vm1"\r\nscsi0:0.fileName = "vm1.vmdk"\r\n',
+    # bare "\r" is not a line break
+    b'one vm1\rtwo vm1 end\nvm1',
+    b'\n\nvm1\x0bvm1\x0cvm1\n',
+    b'',
+]
+PAIRS = [
+    [(r'vm1', 'vm2')],
+    [(r'vm1$', 'vm2')],
+    [(r'^', '# ')],
+    [(r'(\w+)\r?$', r'<\1>')],
+    [(r'vm1', 'a'), (r'\r', '[CR]')],
+]
+
+
+def streamed(tmp_path, data, pairs, scope='line'):
+    path = tmp_path / 'file'
+    path.write_bytes(data)
+    replacer = Replacer(str(path), compile_replacements(pairs), scope=scope)
+    replacer.run()
+    if replacer.tmp_name is None:
+        return data
+    with open(replacer.tmp_name, 'rb') as tmp_file:
+        return tmp_file.read()
+
+
+@pytest.mark.parametrize('data', SAMPLES)
+@pytest.mark.parametrize('pairs', PAIRS)
+def test_same_as_streamed(tmp_path, data, pairs):
+    assert replace_bytes(data, compile_replacements(pairs)) == streamed(tmp_path, data, pairs)
+
+
+def test_bare_cr():
+    replacements = compile_replacements([(r'vm1$', 'vm2')])
+    assert replace_bytes(b'a vm1\rb vm1\n', replacements) == b'a vm1\rb vm2\n'
+    assert replace_bytes(b'a vm1\r\nb vm1', replacements) == b'a vm1\r\nb vm2'
+
+
+@pytest.mark.parametrize('regexp', [r'^', r'$', r'a*', r'\A', r'x'])
+def test_empty_file(tmp_path, regexp):
+    pairs = [(regexp, 'new')]
+    expected = re.sub(regexp.encode('ascii'), b'new', b'', flags=re.MULTILINE)
+    assert streamed(tmp_path, b'', pairs, 'file') == expected
+    assert replace_bytes(b'', compile_replacements(pairs), 'file') == expected
+    # no lines at all
+    assert streamed(tmp_path, b'', pairs) == b''
+
+
+def fork_replace(path, regexp, replace):
+    ''' what replace.py fork does: whole file as text, re.subn, full temp copy '''
+    with open(path, 'rb') as src:
+        contents = src.read().decode('utf-8', 'surrogateescape')
+    (contents, count) = re.subn(re.compile(regexp, re.MULTILINE), replace, contents, 0)
+    if count:
+        (fd, tmp_name) = tempfile.mkstemp()
+        with os.fdopen(fd, 'wb') as tmp_file:
+            tmp_file.write(contents.encode('utf-8', 'surrogateescape'))
+        return tmp_name
+    return None
+
+
+def bench_file(path, size):
+    ''' ~80 byte lines, like vmx, "vm1" on every 10th line '''
+    lines = [('scsi0:%d.fileName = "disk%05d.vmdk" # %s\n' % (
+        num % 16, num, 'vm1' if num % 10 == 0 else 'vm0' + 'x' * 20)).encode('ascii')
+        for num in range(1000)]
+    block = b''.join(lines)
+    with open(path, 'wb') as out:
+        for _ in range(max(1, size // len(block))):
+            out.write(block)
+
+
+def test_bench_replace(tmp_path):
+    '''
+    fork / line / file scope on generated files: no match, every 10th line;
+    sizes in MB from ESXI_REPLACE_BENCH_MB (like "1,100,1000"), default is 1
+    '''
+    sizes = [int(size) for size in os.environ.get('ESXI_REPLACE_BENCH_MB', '1').split(',')]
+    path = str(tmp_path / 'bench.vmx')
+    for size in sizes:
+        bench_file(path, size * 1024 * 1024)
+        for (name, regexp) in [('no match', r'vm9$'), ('10% lines', r'vm1$')]:
+            times = []
+            outputs = []
+            for scope in ('fork', 'line', 'file'):
+                started = time.time()
+                if scope == 'fork':
+                    tmp_name = fork_replace(path, regexp, 'vm2')
+                else:
+                    replacer = Replacer(path, compile_replacements([(regexp, 'vm2')]), scope)
+                    replacer.run()
+                    tmp_name = replacer.tmp_name
+                times.append(time.time() - started)
+                if tmp_name is None:
+                    outputs.append(None)
+                else:
+                    with open(tmp_name, 'rb') as tmp_file:
+                        outputs.append(tmp_file.read())
+                    os.unlink(tmp_name)
+            print('\n%d MB, %s: fork %.3f s, line %.3f s, file %.3f s' % (
+                (size, name) + tuple(times)), end='')
+            assert outputs[0] == outputs[1] == outputs[2]
+            if name == 'no match':
+                assert outputs[0] is None
+                # nothing is written: not slower than the fork
+                assert times[1] < times[0] * 2 + 0.05
+    print()
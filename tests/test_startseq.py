@@ -0,0 +1,80 @@
+import random
+import time
+
+from esxi_startseq import apply_moves, plan_moves, start_sequence
+
+
+def start_info(seq, action='PowerOn'):
+    return dict((vm_id, {'order': pos + 1, 'action': action}) for (pos, vm_id) in enumerate(seq))
+
+
+def check(info, target, disable=()):
+    moves = plan_moves(info, target, disable)
+    # raises on "move to end"
+    result = apply_moves(start_sequence(info), moves)
+    assert result[:len(target)] == list(target)
+    return moves
+
+
+def test_same_order_no_moves():
+    assert check(start_info(['1', '2', '3']), ['1', '2', '3']) == []
+
+
+def test_one_displaced_entry_is_one_move():
+    seq = [str(num) for num in range(1, 101)]
+    target = list(seq)
+    target.insert(10, target.pop(70))
+    assert len(check(start_info(seq), target)) == 1
+
+
+def test_last_entry_is_not_moved_to_end():
+    # naive plan would move "1" to the end
+    check(start_info(['1', '2', '3', '4']), ['2', '3', '4', '1'])
+
+
+def test_new_and_disabled_entries():
+    info = start_info(['1', '2', '3'])
+    moves = check(info, ['4', '3', '1'], disable=['2'])
+    assert ('2', -1) in moves
+    assert ('4', 1) in moves
+
+
+def test_powered_off_entries_are_taken_out():
+    info = start_info(['1', '2', '3'])
+    info['2']['action'] = 'PowerOff'
+    moves = check(info, ['3', '1'])
+    assert ('2', -1) in moves
+
+
+def test_lowercase_power_on_is_started():
+    # some ESXi versions report "powerOn": entries in place are not moved
+    info = start_info(['1', '2', '3'], action='powerOn')
+    assert check(info, ['1', '2', '3']) == []
+    info['2']['action'] = 'powerOff'
+    assert check(info, ['1', '3']) == [('2', -1)]
+
+
+def test_random_orders():
+    rnd = random.Random(1)
+    for _ in range(300):
+        seq = [str(num) for num in range(rnd.randint(0, 12))]
+        info = start_info(seq)
+        target = rnd.sample(seq + ['new1', 'new2'], rnd.randint(0, len(seq) + 2))
+        check(info, target)
+
+
+def test_bench_planner_500_plus():
+    ''' plan for shuffled 500 and 5000 VM sequences (moves are n - LIS) '''
+    rnd = random.Random(2)
+    for size in (500, 5000):
+        seq = ['vm%d' % num for num in range(size)]
+        target = list(seq)
+        rnd.shuffle(target)
+        info = start_info(seq)
+        started = time.time()
+        moves = plan_moves(info, target)
+        seconds = time.time() - started
+        assert apply_moves(seq, moves) == target
+        assert len(moves) < size
+        print('\nplanner: %d VMs, %d moves, %.3fs' % (size, len(moves), seconds))
+        assert seconds < (1 if size == 500 else 30)
@@ -0,0 +1,167 @@
+'''
+template cache with plain dirs as datastores and stand-in "vmkfstools -i":
+lookup across datastores, LRU eviction, budget, stale leftovers, keys from
+transfer manifests
+'''
+
+import json
+import os
+import sys
+import time
+
+import pytest
+
+from conftest import ansible_module_utils
+
+cache_mod = ansible_module_utils('esxi_template_cache')
+transfer_mod = ansible_module_utils('esxi_transfer')
+
+CHUNK = 64 * 1024
+HOUR_AGO = int(time.time()) - 3600 + 0.1
+
+# copies descriptor and its extents, extent names follow new descriptor name
+VMKFSTOOLS = '''#!{python}
+import os, re, shutil, sys
+(src, dest) = (sys.argv[2], sys.argv[3])
+if sys.argv[1] != '-i' or sys.argv[4:] != ['-d', 'thin']:
+    sys.exit('bad args: %s' % sys.argv[1:])
+base = os.path.basename(dest)[:-len('.vmdk')]
+lines = []
+for (num, line) in enumerate(open(src).read().splitlines()):
+    match = re.match(r'^(RW \\d+ VMFS) "([^"]+)"$', line)
+    if match:
+        name = '%s-s%03d.vmdk' % (base, num)
+        shutil.copy(os.path.join(os.path.dirname(src), match.group(2)),
+                    os.path.join(os.path.dirname(dest), name))
+        line = '%s "%s"' % (match.group(1), name)
+    lines.append(line)
+open(dest, 'w').write('\\n'.join(lines) + '\\n')
+'''
+
+
+def make_disk(path, name, size, seed=0):
+    ''' descriptor "<name>.vmdk" with one flat extent of given size '''
+    extent = os.path.join(path, name + '-flat.vmdk')
+    with open(extent, 'wb') as efile:
+        efile.write(bytes(bytearray((num * 7 + seed) % 251 for num in range(size))))
+    os.utime(extent, (HOUR_AGO, HOUR_AGO))
+    descriptor = os.path.join(path, name + '.vmdk')
+    with open(descriptor, 'w') as dfile:
+        dfile.write('# Disk DescriptorFile\nversion=1\ncreateType="vmfs"\n\n'
+                    'RW %d VMFS "%s-flat.vmdk"\n' % (size // 512, name))
+    return descriptor
+
+
+@pytest.fixture
+def env(tmp_path, monkeypatch):
+    monkeypatch.setattr(cache_mod, 'CHUNK_SIZE', CHUNK)
+    tool = tmp_path / 'vmkfstools'
+    tool.write_text(VMKFSTOOLS.format(python=sys.executable))
+    tool.chmod(0o755)
+    for name in ('ds1', 'ds2', 'src'):
+        (tmp_path / name).mkdir()
+    return tmp_path
+
+
+def cache(env, name):
+    return cache_mod.DatastoreCache(name, str(env / name), str(env / 'vmkfstools'))
+
+
+def store(env, name, descriptor, budget):
+    key = cache_mod.disk_key(descriptor, save=False)
+    size = sum(cache_mod.allocated_size(extent)
+               for extent in cache_mod.disk_extents(descriptor))
+    ds_cache = cache(env, name)
+    return (key, ds_cache.store(descriptor, key, budget, size))
+
+
+def set_used(env, name, key, used):
+    ds_cache = cache(env, name)
+    ds_cache.load()
+    ds_cache.entries[key]['used'] = used
+    ds_cache.save()
+
+
+def test_hit_on_other_datastore(env):
+    descriptor = make_disk(str(env / 'src'), 'tmpl', 4 * CHUNK)
+    (key, _) = store(env, 'ds2', descriptor, 1 << 30)
+    datastores = [('ds1', str(env / 'ds1')), ('ds2', str(env / 'ds2'))]
+    found = cache_mod.find(key, datastores, str(env / 'vmkfstools'), prefer=str(env / 'ds1'))
+    assert found.name == 'ds2'
+    disk = found.lookup(key)
+    assert disk == cache(env, 'ds2').disk_path(key)
+    # clone has the same content, so the same key
+    assert cache_mod.disk_key(disk, save=False) == key
+    assert cache_mod.find('0' * 40, datastores, str(env / 'vmkfstools')) is None
+
+
+def test_lru_eviction(env):
+    size = 4 * CHUNK
+    descriptors = [make_disk(str(env / 'src'), 'tmpl%d' % num, size, seed=num)
+                   for num in range(3)]
+    budget = 2 * size + CHUNK
+    (first, _) = store(env, 'ds1', descriptors[0], budget)
+    (second, evicted) = store(env, 'ds1', descriptors[1], budget)
+    assert evicted == []
+    # first one is used later than the second
+    set_used(env, 'ds1', second, 1000)
+    set_used(env, 'ds1', first, 2000)
+    (third, evicted) = store(env, 'ds1', descriptors[2], budget)
+    assert evicted == [second]
+    ds_cache = cache(env, 'ds1')
+    assert sorted(ds_cache.load()) == sorted([first, third])
+    assert not os.path.exists(os.path.join(ds_cache.path, second))
+    assert ds_cache.total_size() <= budget
+
+
+def test_oversized_disk_refused(env):
+    descriptor = make_disk(str(env / 'src'), 'big', 4 * CHUNK)
+    with pytest.raises(cache_mod.CacheError):
+        store(env, 'ds1', descriptor, CHUNK)
+    assert not cache(env, 'ds1').exists()
+
+
+def test_stale_dirs_and_missing_disks_dropped(env):
+    kept = make_disk(str(env / 'src'), 'kept', 2 * CHUNK, seed=1)
+    lost = make_disk(str(env / 'src'), 'lost', 2 * CHUNK, seed=2)
+    (kept_key, _) = store(env, 'ds1', kept, 1 << 30)
+    (lost_key, _) = store(env, 'ds1', lost, 1 << 30)
+    ds_cache = cache(env, 'ds1')
+    # entry whose disk is gone
+    os.remove(ds_cache.disk_path(lost_key))
+    assert ds_cache.lookup(lost_key) is None
+    assert lost_key not in cache(env, 'ds1').load()
+    assert ds_cache.lookup(kept_key) == ds_cache.disk_path(kept_key)
+    # leftover of interrupted store: key dir w/o entry
+    stale = os.path.join(ds_cache.path, 'f' * 40)
+    os.mkdir(stale)
+    descriptor = make_disk(str(env / 'src'), 'new', 2 * CHUNK, seed=3)
+    store(env, 'ds1', descriptor, 1 << 30)
+    assert not os.path.exists(stale)
+    assert not os.path.exists(os.path.join(ds_cache.path, lost_key))
+    with open(os.path.join(ds_cache.path, cache_mod.MANIFEST)) as mfile:
+        assert len(json.load(mfile)['entries']) == 2
+
+
+def test_key_from_transfer_manifest(env):
+    src = make_disk(str(env / 'src'), 'tmpl', 10 * CHUNK + 123)
+    dest_dir = env / 'ds1' / 'tmpl'
+    dest_dir.mkdir()
+    dest = str(dest_dir / 'tmpl.vmdk')
+    with open(src) as sfile, open(dest, 'w') as dfile:
+        dfile.write(sfile.read())
+    argv = transfer_mod.sender_argv({'transport': 'local', 'python': sys.executable})
+    extent = cache_mod.disk_extents(src)[0]
+    dest_extent = cache_mod.disk_extents(dest)[0]
+    receiver = transfer_mod.Receiver(argv, extent, dest_extent, CHUNK, retry_delay=0)
+    assert receiver.run()
+    manifest = transfer_mod.load_manifest(dest_extent, CHUNK)
+    assert manifest
+    key = cache_mod.disk_key(dest)
+    assert key == transfer_mod.root_hash(manifest)
+    # full rehash w/o manifests
+    os.remove(transfer_mod.manifest_path(dest_extent))
+    os.remove(transfer_mod.manifest_path(extent))
+    assert cache_mod.disk_key(dest, save=False) == key
+    assert cache_mod.disk_key(src, save=False) == key
+    assert not os.path.exists(transfer_mod.manifest_path(dest_extent))
@@ -0,0 +1,241 @@
+'''
+esxi_transfer stream with "local" transport: copy, re-run, full-precision stamps,
+racy manifests, sender shutdown, resume after broken stream, compression,
+sparse sources (with and w/o SEEK_DATA)
+'''
+
+import os
+import sys
+import time
+
+import pytest
+
+from esxi_transfer import (RACY_SECONDS, Receiver, TransferError, file_hashes, file_stamp,
+                           load_manifest, manifest_path, save_manifest, sender_argv)
+
+CHUNK = 64 * 1024
+# early in its second: +0.3 s is the same second
+HOUR_AGO = int(time.time()) - 3600 + 0.1
+
+
+def write(path, data, mtime=HOUR_AGO):
+    with open(path, 'wb') as dfile:
+        dfile.write(data)
+    os.utime(path, (mtime, mtime))
+
+
+def receiver(src, dest, **kwargs):
+    argv = sender_argv({'transport': 'local', 'python': sys.executable})
+    return Receiver(argv, src, dest, CHUNK, retry_delay=0, **kwargs)
+
+
+def data(size, seed=0):
+    return bytes(bytearray((num * 7 + seed) % 251 for num in range(size)))
+
+
+@pytest.fixture
+def files(tmp_path):
+    src = str(tmp_path / 'src.bin')
+    write(src, data(20 * CHUNK + 123))
+    return (src, str(tmp_path / 'dest.bin'))
+
+
+def read(path):
+    with open(path, 'rb') as rfile:
+        return rfile.read()
+
+
+def test_copy_and_rerun(files):
+    (src, dest) = files
+    assert receiver(src, dest).run()
+    assert read(dest) == read(src)
+    # destination gets mtime of source, so its manifest is not racy
+    assert os.stat(dest).st_mtime == os.stat(src).st_mtime
+    assert load_manifest(dest, CHUNK) == file_hashes(src, CHUNK, save=False)
+    # sender is not killed after the end frame: source manifest is saved by it
+    assert load_manifest(src, CHUNK) == load_manifest(dest, CHUNK)
+    rerun = receiver(src, dest)
+    assert not rerun.run()
+    assert rerun.stats['transferred'] == 0
+
+
+def test_change_within_second(files):
+    ''' same size, mtime differs by less than a second from recorded one '''
+    (src, dest) = files
+    receiver(src, dest).run()
+    mtime = os.stat(src).st_mtime
+    write(src, data(20 * CHUNK + 123, seed=1), mtime + 0.3)
+    assert int(os.stat(src).st_mtime) == int(mtime)
+    rerun = receiver(src, dest)
+    assert rerun.run()
+    assert rerun.stats['source_changed']
+    assert read(dest) == read(src)
+
+
+def test_dest_change_within_second(files):
+    (src, dest) = files
+    receiver(src, dest).run()
+    mtime = os.stat(dest).st_mtime
+    write(dest, data(20 * CHUNK + 123, seed=2), mtime + 0.3)
+    with pytest.raises(TransferError):
+        receiver(src, dest).run()
+    assert receiver(src, dest, force=True).run()
+    assert read(dest) == read(src)
+
+
+def test_racy_manifest(tmp_path):
+    path = str(tmp_path / 'fresh.bin')
+    write(path, data(3 * CHUNK), time.time())
+    hashes = file_hashes(path, CHUNK)
+    # modified just now: not saved
+    assert not os.path.exists(manifest_path(path))
+    save_manifest(path, CHUNK, hashes)
+    assert not os.path.exists(manifest_path(path))
+    # saved with old "started" (like by other tool), not trusted
+    save_manifest(path, CHUNK, hashes, started=time.time() + RACY_SECONDS + 1)
+    assert os.path.exists(manifest_path(path))
+    assert load_manifest(path, CHUNK) is None
+    # old enough
+    old = time.time() - RACY_SECONDS - 1
+    os.utime(path, (old, old))
+    assert file_hashes(path, CHUNK) == hashes
+    assert load_manifest(path, CHUNK) == hashes
+
+
+def test_stamp_precision(tmp_path):
+    path = str(tmp_path / 'file.bin')
+    write(path, b'x', HOUR_AGO)
+    stamp = file_stamp(path, CHUNK)
+    os.utime(path, (HOUR_AGO, HOUR_AGO + 0.001))
+    assert file_stamp(path, CHUNK) != stamp
+
+
+# passes sender stream through, but the first run is cut after CUT bytes
+CUTTER = '''
+import os, subprocess, sys
+CUT = 500 * 1000
+(marker, argv) = (sys.argv[1], sys.argv[2:])
+proc = subprocess.Popen(argv, stdout=subprocess.PIPE)
+out = getattr(sys.stdout, 'buffer', sys.stdout)
+limit = None
+if not os.path.exists(marker):
+    open(marker, 'w').close()
+    limit = CUT
+sent = 0
+while limit is None or sent < limit:
+    block = proc.stdout.read(min(64 * 1024, limit - sent) if limit else 64 * 1024)
+    if not block:
+        break
+    out.write(block)
+    sent += len(block)
+out.flush()
+if limit is not None:
+    proc.kill()
+sys.exit(proc.wait() if limit is None else 0)
+'''
+
+
+def test_resume_after_broken_stream(tmp_path):
+    src = str(tmp_path / 'src.bin')
+    write(src, os.urandom(20 * CHUNK + 123))
+    dest = str(tmp_path / 'dest.bin')
+    cutter = tmp_path / 'cutter.py'
+    cutter.write_text(CUTTER)
+    argv = [sys.executable, str(cutter), str(tmp_path / 'cut.done')] + \
+        sender_argv({'transport': 'local', 'python': sys.executable})
+    xfer = Receiver(argv, src, dest, CHUNK, level=0, retry_delay=0)
+    assert xfer.run()
+    assert xfer.stats['retries'] == 1
+    assert read(dest) == read(src)
+    # chunks received before the break are kept, not sent again
+    assert xfer.stats['transferred'] == os.path.getsize(src)
+
+
+def test_compression(files):
+    (src, dest) = files
+    xfer = receiver(src, dest, level=1)
+    xfer.run()
+    assert read(dest) == read(src)
+    assert xfer.stats['wire_bytes'] < xfer.stats['transferred'] // 2
+    raw = receiver(src, dest + '.raw', level=0)
+    raw.run()
+    assert raw.stats['wire_bytes'] > raw.stats['transferred']
+
+
+BLOCK = 64 * 1024
+# like sender_argv, but python w/o SEEK_DATA: holes are found by zero scan only
+NO_SEEK_DATA = [sys.executable, '-c',
+                'import os, sys; del os.SEEK_DATA, os.SEEK_HOLE; exec(sys.stdin.read())']
+
+
+def write_sparse(path, blocks, fill):
+    ''' file of 64K blocks, "fill" part of them is data, the rest are holes '''
+    filled = 0
+    with open(path, 'wb') as sfile:
+        sfile.truncate(blocks * BLOCK)
+        for num in range(blocks):
+            if (num * 37) % 100 < fill * 100:
+                sfile.seek(num * BLOCK)
+                sfile.write(os.urandom(BLOCK))
+                filled += BLOCK
+    os.utime(path, (HOUR_AGO, HOUR_AGO))
+    return filled
+
+
+def holes_supported(path):
+    return os.stat(path).st_blocks * 512 < os.path.getsize(path)
+
+
+@pytest.mark.parametrize('seek_data', [True, False], ids=['seek-data', 'zero-scan'])
+@pytest.mark.parametrize('fill', [0, 0.1, 0.5, 0.9, 1])
+def test_sparse(tmp_path, fill, seek_data):
+    src = str(tmp_path / 'src.bin')
+    dest = str(tmp_path / 'dest.bin')
+    filled = write_sparse(src, 40, fill)
+    argv = sender_argv({'transport': 'local', 'python': sys.executable}) if seek_data \
+        else NO_SEEK_DATA
+    # chunks of several blocks: both whole-hole and partly filled ones
+    xfer = Receiver(argv, src, dest, 4 * BLOCK, level=0, retry_delay=0)
+    assert xfer.run()
+    assert read(dest) == read(src)
+    assert xfer.stats['sparse_bytes'] == os.path.getsize(src) - filled
+    assert xfer.stats['wire_bytes'] < filled + 40 * BLOCK // 8
+    if fill < 1 and holes_supported(src):
+        assert os.stat(dest).st_blocks * 512 <= filled + BLOCK
+
+
+def test_sparse_allocated_zeros(tmp_path):
+    ''' zero blocks that are written (not holes) are not sent either '''
+    src = str(tmp_path / 'src.bin')
+    write(src, b'\0' * (8 * BLOCK) + os.urandom(BLOCK) + b'\0' * 100)
+    xfer = Receiver(NO_SEEK_DATA, src, str(tmp_path / 'dest.bin'), 4 * BLOCK, level=0,
+                    retry_delay=0)
+    assert xfer.run()
+    assert read(str(tmp_path / 'dest.bin')) == read(src)
+    assert xfer.stats['sparse_bytes'] == 8 * BLOCK + 100
+
+
+def test_bench_sparse(tmp_path):
+    ''' 64 MB disk with 10% data: SEEK_DATA vs zero scan vs plain stream '''
+    src = str(tmp_path / 'src.bin')
+    filled = write_sparse(src, 1024, 0.1)
+    runs = [('seek-data', sender_argv({'transport': 'local', 'python': sys.executable}), True),
+            ('zero-scan', NO_SEEK_DATA, True),
+            ('plain', sender_argv({'transport': 'local', 'python': sys.executable}), False)]
+    results = {}
+    wire = {}
+    for (name, argv, sparse) in runs:
+        dest = str(tmp_path / (name + '.bin'))
+        xfer = Receiver(argv, src, dest, 1024 * 1024, level=0, retry_delay=0, sparse=sparse)
+        started = time.time()
+        xfer.run()
+        results[name] = time.time() - started
+        wire[name] = xfer.stats['wire_bytes']
+        print('\n%s: %.3f s, %.1f MB on wire, %.1f MB allocated' % (
+            name, results[name], xfer.stats['wire_bytes'] / 1048576.0,
+            os.stat(dest).st_blocks * 512 / 1048576.0), end='')
+        assert read(dest) == read(src)
+    print()
+    # local pipe is cheap, so times are close here; over ssh wire size is what counts
+    assert wire['seek-data'] == wire['zero-scan'] < filled + 1024 * 1024
+    assert wire['plain'] > os.path.getsize(src)
@@ -0,0 +1,69 @@
+'''
+vim-cmd dump parser: recorded-like fixtures and throughput on big dump
+'''
+
+import os
+import time
+
+from conftest import FIXTURES
+from esxi_vimcmd import parse, parse_autostart_seq
+
+
+def fixture(name):
+    with open(os.path.join(FIXTURES, name)) as ffile:
+        return ffile.read()
+
+
+def test_autostart_seq():
+    assert parse_autostart_seq(fixture('vimcmd_autostartseq.txt')) == {
+        3: {'order': 1, 'action': 'PowerOn'},
+        12: {'order': 2, 'action': 'PowerOn'},
+        7: {'order': -1, 'action': 'None'},
+    }
+
+
+def test_autostart_seq_empty():
+    assert parse_autostart_seq('') == {}
+    assert parse_autostart_seq('(vim.host.AutoStartManager.AutoPowerInfo) []') == {}
+
+
+def test_get_config():
+    conf = parse(fixture('vimcmd_get_config.txt'))
+    assert conf['_type'] == 'vim.vm.ConfigInfo'
+    # quoted values with spaces, escapes and newlines
+    assert conf['name'] == 'files m1 vm'
+    assert conf['annotation'] == ('samba file server, primary\n'
+                                  'second line of notes, with "quotes" and \\ backslash')
+    assert conf['npivWorldWideNameType'] is None
+    assert conf['template'] is False
+    assert conf['files']['suspendDirectory'] is None
+    assert conf['files']['vmPathName'] == '[nest1-sys] files-m1-vm/files-m1-vm.vmx'
+    hw = conf['hardware']
+    assert (hw['numCPU'], hw['memoryMB']) == (4, 8192)
+    devices = hw['device']
+    assert [dev['_type'] for dev in devices] == ['vim.vm.device.VirtualIDEController',
+                                                 'vim.vm.device.VirtualDisk',
+                                                 'vim.vm.device.VirtualVmxnet3']
+    assert devices[0]['device'] == [3000]
+    assert devices[1]['backing']['datastore'] == \
+        'vim.Datastore:5a1f2b3c-01234567-89ab-0025b5000001'
+    assert devices[1]['capacityInBytes'] == 21474836480
+    assert devices[2]['backing']['deviceName'] == 'srv-smb'
+    assert conf['extraConfig'][0]['value'] == \
+        "<?xml version='1.0' encoding='UTF-8'?> <Environment />"
+
+
+def test_bench_throughput():
+    ''' several MB dump (like get.config of VM with many devices) '''
+    conf = fixture('vimcmd_get_config.txt')
+    body = conf[conf.index('   hardware'):conf.index('   extraConfig')]
+    text = 'Configuration:\n(vim.vm.ConfigInfo) {\n%s}\n' % (body * 3000)
+    size = len(text) / 1024.0 / 1024.0
+    started = time.time()
+    parsed = parse(text)
+    seconds = time.time() - started
+    assert parsed['hardware']['numCPU'] == 4
+    print('\nvim-cmd dump %.1f MB: %.2f s, %.1f MB/s' % (size, seconds, size / seconds))
+    assert size > 4
+    # loose floor, well below what plain regexp scan gives
+    assert size / seconds > 1
@@ -0,0 +1,208 @@
+'''
+esxi_vm_clone batch mode with stand-in vmkfstools and vim-cmd: datastores are
+plain dirs, disk jobs just sleep and create their target file
+'''
+
+import os
+import sys
+
+import pytest
+
+from conftest import library_module, run_module
+
+# log lines: "<event> <time> <args...>", jobs fail for target with "bad" in path
+VMKFSTOOLS = r'''#!%(python)s
+import os, sys, time
+log = os.environ['CLONE_LOG']
+target = sys.argv[-1]
+def event(name):
+    with open(log, 'a') as lfile:
+        lfile.write('%%s %%r %%s\n' %% (name, time.time(), ' '.join(sys.argv[1:])))
+event('start')
+time.sleep(float(os.environ.get('CLONE_DELAY', '0.2')))
+if '/bad' in target:
+    sys.exit(1)
+open(target, 'w').close()
+event('end')
+'''
+
+# registers VM with id from counter file, fails for VM with "noreg" in name
+VIM_CMD = r'''#!%(python)s
+import os, sys
+log = os.environ['CLONE_LOG']
+with open(log, 'a') as lfile:
+    lfile.write('vim-cmd 0 %%s\n' %% ' '.join(sys.argv[1:]))
+if sys.argv[1] == 'solo/registervm':
+    if 'noreg' in sys.argv[3]:
+        sys.exit(1)
+    counter = log + '.ids'
+    num = len(open(counter).read()) if os.path.exists(counter) else 0
+    with open(counter, 'a') as cfile:
+        cfile.write('x')
+    print(num + 10)
+'''
+
+
+@pytest.fixture
+def host(tmp_path, monkeypatch):
+    esxi_vm_clone = library_module('esxi_vm_clone')
+    monkeypatch.setattr(esxi_vm_clone, 'POLL_INTERVAL', 0.02)
+    bin_dir = tmp_path / 'bin'
+    bin_dir.mkdir()
+    for (name, script) in (('vmkfstools', VMKFSTOOLS), ('vim-cmd', VIM_CMD)):
+        (bin_dir / name).write_text(script % {'python': sys.executable})
+        (bin_dir / name).chmod(0o755)
+    log = tmp_path / 'clone.log'
+    monkeypatch.setenv('CLONE_LOG', str(log))
+
+    tmpl = tmp_path / 'ds1' / 'tmpl'
+    tmpl.mkdir(parents=True)
+    (tmp_path / 'ds2').mkdir()
+    (tmpl / 'tmpl.vmx').write_text(u'.encoding = "UTF-8"\n'
+                                   u'displayName = "tmpl"\n'
+                                   u'scsi0.present = "TRUE"\n'
+                                   u'scsi0:0.fileName = "tmpl.vmdk"\n'
+                                   u'scsi0:1.fileName = "tmpl_1.vmdk"\n'
+                                   u'uuid.bios = "56 4d"\n')
+    for disk in ('tmpl.vmdk', 'tmpl_1.vmdk'):
+        (tmpl / disk).write_text(u'')
+
+    class Host(object):
+        root = tmp_path
+        module = esxi_vm_clone
+
+        def ds(self, name):
+            return str(tmp_path / name)
+
+        def run(self, vms, capsys, **params):
+            args = dict(src=str(tmpl / 'tmpl.vmx'), datastore=self.ds('ds1'), vms=vms,
+                        vmkfstools=str(bin_dir / 'vmkfstools'),
+                        vim_cmd=str(bin_dir / 'vim-cmd'),
+                        progress_file=str(tmp_path / 'progress.log'))
+            args.update(params)
+            return run_module(esxi_vm_clone, args, capsys)
+
+        def jobs(self):
+            ''' [(start, end, datastores)] of finished disk jobs '''
+            started = dict()
+            jobs = []
+            with open(str(log)) as lfile:
+                for line in lfile:
+                    (event, when, args) = line.rstrip('\n').split(' ', 2)
+                    if event == 'start':
+                        started[args] = float(when)
+                    elif event == 'end':
+                        paths = args.split()
+                        paths = [paths[1], paths[-1]] if paths[0] == '-i' else [paths[-1]]
+                        dss = set(os.path.relpath(path, str(tmp_path)).split(os.sep)[0]
+                                  for path in paths)
+                        jobs.append((started[args], float(when), dss))
+            return jobs
+
+        def progress(self):
+            with open(str(tmp_path / 'progress.log')) as pfile:
+                return [line.split(' ', 1)[1].rstrip('\n') for line in pfile]
+    return Host()
+
+
+def max_running(jobs, ds):
+    ''' max number of jobs at once on datastore '''
+    events = sorted([(start, 1) for (start, _, dss) in jobs if ds in dss] +
+                    [(end, -1) for (_, end, dss) in jobs if ds in dss])
+    (count, peak) = (0, 0)
+    for (_, delta) in events:
+        count += delta
+        peak = max(peak, count)
+    return peak
+
+
+def test_batch_limits(host, capsys):
+    vms = [{'name': 'vm1'}, {'name': 'vm2', 'datastore': host.ds('ds2')},
+           {'name': 'vm3'}, {'name': 'vm4', 'datastore': host.ds('ds2'),
+                             'disks': [{'size': '1G'}]}]
+    res = host.run(vms, capsys, datastore_limit=2)
+    assert res['changed'] and not res.get('failed')
+    assert sorted(res['finished']) == ['vm1', 'vm2', 'vm3', 'vm4']
+    jobs = host.jobs()
+    assert len(jobs) == 9
+    # template is on ds1: every clone counts there, so it is never over the limit
+    assert max_running(jobs, 'ds1') == 2
+    assert max_running(jobs, 'ds2') <= 2
+    assert sorted(res['vms']['vm1']['disk_timings']) == \
+        sorted([os.path.join(host.ds('ds1'), 'vm1', disk) for disk in ('vm1.vmdk', 'vm1_1.vmdk')])
+    vmids = sorted(vm['vmid'] for vm in res['vms'].values())
+    assert vmids == [10, 11, 12, 13]
+    for name in ('vm1', 'vm2', 'vm3', 'vm4'):
+        vm = res['vms'][name]
+        assert vm['changed'] and os.path.isfile(vm['vmx'])
+        assert set(['validate', 'config', 'queued', 'disks', 'register', 'total']) <= \
+            set(vm['timings'])
+    # order of completion
+    assert [vm['timings']['total'] for vm in (res['vms'][name] for name in res['finished'])] == \
+        sorted(res['vms'][name]['timings']['total'] for name in res['finished'])
+    lines = host.progress()
+    for name in ('vm1', 'vm2', 'vm3', 'vm4'):
+        events = [line.split(' ', 1)[1] for line in lines if line.split(' ', 1)[0] == name]
+        assert len([event for event in events if event.startswith('started ')]) == \
+            len(res['vms'][name]['disk_timings'])
+        assert len([event for event in events if event.startswith('finished ')]) == \
+            len(res['vms'][name]['disk_timings'])
+        assert events[-1] == 'done (vmid %d)' % res['vms'][name]['vmid']
+
+
+def test_limit_one(host, capsys):
+    res = host.run([{'name': 'vm1'}, {'name': 'vm2', 'datastore': host.ds('ds2')}], capsys,
+                   datastore_limit=1)
+    assert not res.get('failed')
+    assert max_running(host.jobs(), 'ds1') == 1
+
+
+def test_failed_vm_rolled_back_alone(host, capsys):
+    vms = [{'name': 'vm1'}, {'name': 'bad'}, {'name': 'noreg', 'datastore': host.ds('ds2')},
+           {'name': 'vm2', 'datastore': host.ds('ds2')}]
+    res = host.run(vms, capsys, datastore_limit=2)
+    assert res['failed']
+    assert sorted(res['failed_vms']) == ['bad', 'noreg']
+    assert sorted(res['finished']) == ['bad', 'noreg', 'vm1', 'vm2']
+    for name in ('bad', 'noreg'):
+        vm = res['vms'][name]
+        assert vm['failed'] and vm['rolled_back'] and not vm['changed']
+        assert not os.path.exists(os.path.dirname(vm['vmx']))
+    assert 'unable to create disk' in res['vms']['bad']['msg']
+    assert res['vms']['noreg']['msg'] == 'unable to register VM'
+    for name in ('vm1', 'vm2'):
+        assert os.path.isfile(res['vms'][name]['vmx'])
+        assert res['vms'][name]['vmid']
+    assert [line for line in host.progress() if line.startswith('bad failed: ')]
+
+
+def test_check_mode_nothing_run(host, capsys):
+    args = dict(src=str(host.root / 'ds1' / 'tmpl' / 'tmpl.vmx'), datastore=host.ds('ds1'),
+                vms=[{'name': 'vm1'}], vmkfstools='false', vim_cmd='false')
+    res = run_module(host.module, args, capsys, check_mode=True)
+    assert res['changed']
+    assert len(res['vms']['vm1']['commands']) == 2
+    assert not os.path.exists(host.ds('ds1') + '/vm1')
+
+
+def test_validation_before_changes(host, capsys):
+    os.mkdir(os.path.join(host.ds('ds2'), 'vm2'))
+    res = host.run([{'name': 'vm1'}, {'name': 'vm2', 'datastore': host.ds('ds2')}], capsys)
+    assert res['failed'] and 'vm2: destination folder already exists' in res['msg']
+    assert not os.path.exists(os.path.join(host.ds('ds1'), 'vm1'))
+
+
+def test_bench_batch(host, capsys, monkeypatch):
+    ''' 6 VMs of 2 disks, template on ds1, half of VMs on ds2: limit 1, 2, 4 '''
+    monkeypatch.setenv('CLONE_DELAY', '0.3')
+    times = []
+    for limit in (1, 2, 4):
+        vms = [{'name': 'vm%d-%d' % (limit, num),
+                'datastore': host.ds('ds1' if num % 2 else 'ds2')} for num in range(6)]
+        res = host.run(vms, capsys, datastore_limit=limit)
+        assert not res.get('failed')
+        times.append(res['timings']['total'])
+    with capsys.disabled():
+        print('\n6 VMs, 12 disk jobs of 0.3s: limit 1 %.1fs, limit 2 %.1fs, limit 4 %.1fs' %
+              tuple(times))
+    assert times[0] > times[1] > times[2]
@@ -0,0 +1,204 @@
+'''
+esxi_vm_info on generated host (stand-in vim-cmd and esxcli): power state
+methods on 1000 VMs, details groups in one loop (get.summary and
+device.getdevices fixtures), mock files from "mock_dir"
+'''
+
+import os
+
+import pytest
+
+from conftest import FIXTURES, library_module, run_module
+
+VMS = 1000
+
+# getallvms and power.getstate from files in $FAKE_DIR ("on.txt" has ids of running VMs),
+# details from fixtures; calls are logged to $FAKE_DIR/calls.log
+VIM_CMD = '''#!/bin/sh
+echo "$*" >> "$FAKE_DIR/calls.log"
+case "$1" in
+vmsvc/getallvms) cat "$FAKE_DIR/getallvms.txt";;
+vmsvc/get.summary) cat "$FIXTURES/vimcmd_get_summary.txt";;
+vmsvc/device.getdevices) cat "$FIXTURES/vimcmd_get_devices.txt";;
+hostsvc/autostartmanager/get_autostartseq) cat "$FIXTURES/vimcmd_autostartseq.txt";;
+vmsvc/power.getstate)
+    echo "Retrieved runtime info"
+    if grep -qx "$2" "$FAKE_DIR/on.txt"; then echo "Powered on"; else echo "Powered off"; fi;;
+*) echo "unexpected: $*" >&2; exit 1;;
+esac
+'''
+
+ESXCLI = '''#!/bin/sh
+[ "$*" = "--formatter=csv vm process list" ] || { echo "unexpected: $*" >&2; exit 1; }
+cat "$FAKE_DIR/processes.csv"
+'''
+
+
+def is_on(num):
+    return num % 3 == 0
+
+
+def host_files(path, count):
+    ''' getallvms, ids of running VMs and "vm process list" for "count" VMs '''
+    vmlist = ['Vmid   Name   File   Guest OS   Version   Annotation']
+    running = []
+    processes = ['ConfigFile,DisplayName,ProcessID,UUID,VMXCartelID,WorldID,']
+    for num in range(1, count + 1):
+        vmx = '/vmfs/volumes/ds%d/vm%d/vm%d.vmx' % (num % 2, num, num)
+        vmlist.append('%-6d vm%-6d [ds%d] vm%d/vm%d.vmx   otherGuest64   vmx-11   ' % (
+            num, num, num % 2, num, num))
+        if is_on(num):
+            running.append(str(num))
+            # renamed after start: process has old display name
+            name = 'old-vm%d' % num if num % 50 == 0 else 'vm%d' % num
+            processes.append('%s,%s,0,56 4d %d,%d,%d,' % (vmx, name, num, num + 100000,
+                                                         num + 200000))
+    for (name, lines) in (('getallvms.txt', vmlist), ('on.txt', running),
+                          ('processes.csv', processes)):
+        (path / name).write_text(u'\n'.join(lines) + u'\n')
+
+
+@pytest.fixture
+def host(tmp_path, monkeypatch):
+    esxi_vm_info = library_module('esxi_vm_info')
+    bin_dir = tmp_path / 'bin'
+    bin_dir.mkdir()
+    for (name, script) in (('vim-cmd', VIM_CMD), ('esxcli', ESXCLI)):
+        (bin_dir / name).write_text(script)
+        (bin_dir / name).chmod(0o755)
+    monkeypatch.setenv('PATH', '%s:%s' % (bin_dir, os.environ['PATH']))
+    monkeypatch.setenv('FAKE_DIR', str(tmp_path))
+    monkeypatch.setenv('FIXTURES', FIXTURES)
+    return esxi_vm_info
+
+
+def test_power_methods_agree(host, tmp_path, capsys):
+    host_files(tmp_path, VMS)
+    results = dict()
+    for method in ('process_list', 'loop', 'per_vm'):
+        results[method] = run_module(host, {'get_power_state': True, 'power_method': method,
+                                            'vm_list_source': 'vim-cmd'}, capsys)
+    expected = dict(('vm%d' % num, is_on(num)) for num in range(1, VMS + 1))
+    for res in results.values():
+        assert not res.get('failed')
+        assert res['power_by_vm'] == expected
+        assert sorted(res['power_by_vm']) == sorted(res['id_by_vm'])
+    # one command for vm list, then one for all VMs or one per VM
+    assert results['process_list']['commands_run'] == 2
+    assert results['loop']['commands_run'] == 2
+    assert results['per_vm']['commands_run'] == VMS + 1
+
+
+def test_mock_dir(tmp_path, capsys):
+    esxi_vm_info = library_module('esxi_vm_info')
+    mocks = tmp_path / 'mocks'
+    mocks.mkdir()
+    host_files(mocks, 10)
+    (mocks / 'vm_process_list.csv').write_text((mocks / 'processes.csv').read_text())
+    res = run_module(esxi_vm_info, {'mock': True, 'mock_dir': str(mocks),
+                                    'get_power_state': True}, capsys)
+    assert res['vm_list_source'] == 'vim-cmd'
+    assert res['power_by_vm'] == dict(('vm%d' % num, is_on(num)) for num in range(1, 11))
+
+
+def fixture(name):
+    with open(os.path.join(FIXTURES, name)) as ffile:
+        return ffile.read()
+
+
+def test_compact_groups(host):
+    summary = host.parse_vimcmd(fixture('vimcmd_get_summary.txt'))
+    assert host.compact_resources(summary) == {
+        'cpus': 4, 'memory_mb': 8192, 'nics': 1, 'disks': 2,
+        'storage_committed': 8743813120, 'storage_uncommitted': 34359738368,
+        'cpu_usage_mhz': 119, 'memory_usage_mb': 737}
+    assert host.compact_guest(summary) == {
+        'guest_os': 'Ubuntu Linux (64-bit)', 'hostname': 'files-m1', 'ip': '10.1.2.3',
+        'tools_status': 'guestToolsRunning'}
+    devices = host.parse_vimcmd(fixture('vimcmd_get_devices.txt'))
+    assert host.compact_disks(devices) == [
+        {'label': 'Hard disk 1', 'file': '[nest1-sys] files-m1-vm/files-m1-vm.vmdk',
+         'capacity_kb': 20971520, 'thin': True},
+        {'label': 'Hard disk 2', 'file': '[nest1-data] files-m1-vm/files-m1-vm_1.vmdk',
+         'capacity_kb': 12582912, 'thin': False}]
+    # powered off VM w/o tools, VM w/o disks
+    assert set(host.compact_guest({}).values()) == set([None])
+    assert host.compact_disks({}) == []
+
+
+class StubRunner(object):
+    ''' returns canned output for any command, records (name, args) '''
+
+    def __init__(self, module, out):
+        self.commands = module.COMMANDS['real']
+        self.out = out
+        self.calls = []
+
+    def run(self, cmd_name, fail_msg=None, use_unsafe_shell=False, **kwargs):
+        self.calls.append((cmd_name, kwargs))
+        return 0, self.out, ''
+
+
+def test_load_details_split(host):
+    summary = fixture('vimcmd_get_summary.txt')
+    devices = fixture('vimcmd_get_devices.txt')
+    marker = host.DETAILS_MARKER
+    out = ''.join([
+        '%s 1\n' % marker, summary, '%s\n' % marker, devices,
+        # unregistered between list and loop: errors are on stderr only
+        '%s 2\n' % marker, '%s\n' % marker,
+        # not in VM list
+        '%s 99\n' % marker, summary, '%s\n' % marker, devices,
+        '%s 10\n' % marker, summary, '%s\n' % marker, devices])
+    vm_by_id = {'1': 'vm1', '2': 'vm2', '10': 'vm10'}
+    runner = StubRunner(host, out)
+    (summary_by_vm, devices_by_vm) = host.load_details(runner, vm_by_id, True, True)
+    assert sorted(summary_by_vm) == sorted(devices_by_vm) == ['vm1', 'vm10']
+    assert summary_by_vm['vm1']['config']['numCpu'] == 4
+    assert len(devices_by_vm['vm10']['device']) == 4
+    # one loop for everything
+    assert len(runner.calls) == 1
+    (name, args) = runner.calls[0]
+    assert name == 'get_details_loop' and args['vm_ids'] == '1 10 2'
+    assert 'get.summary' in args['body'] and 'device.getdevices' in args['body']
+
+
+def test_load_details_unrequested(host):
+    marker = host.DETAILS_MARKER
+    runner = StubRunner(host, '%s 1\n%s' % (marker, fixture('vimcmd_get_summary.txt')))
+    (summary_by_vm, devices_by_vm) = host.load_details(runner, {'1': 'vm1'}, True, False)
+    assert list(summary_by_vm) == ['vm1'] and devices_by_vm == {}
+    assert 'device.getdevices' not in runner.calls[0][1]['body']
+    runner = StubRunner(host, '')
+    assert host.load_details(runner, {'1': 'vm1'}, False, False) == ({}, {})
+    assert host.load_details(runner, {}, True, True) == ({}, {})
+    assert runner.calls == []
+
+
+@pytest.mark.parametrize('gather, commands', [
+    ([], []),
+    (['power', 'start'], []),
+    (['resources'], ['get.summary']),
+    (['guest', 'resources'], ['get.summary']),
+    (['disks'], ['device.getdevices']),
+    (['resources', 'disks', 'guest'], ['get.summary', 'device.getdevices']),
+])
+def test_gather_groups(host, tmp_path, capsys, gather, commands):
+    host_files(tmp_path, 5)
+    res = run_module(host, {'gather': gather, 'vm_list_source': 'vim-cmd'}, capsys)
+    assert not res.get('failed')
+    with open(str(tmp_path / 'calls.log')) as lfile:
+        calls = [line.split()[0] for line in lfile]
+    # details: one call per VM for every requested command, nothing for others
+    for command in ('get.summary', 'device.getdevices'):
+        assert calls.count('vmsvc/' + command) == (5 if command in commands else 0)
+    for (group, key) in (('resources', 'resources_by_vm'), ('guest', 'guest_by_vm'),
+                         ('disks', 'disks_by_vm')):
+        if group in gather:
+            assert sorted(res[key]) == sorted(res['id_by_vm'])
+        else:
+            assert key not in res
+    if 'resources' in gather:
+        assert res['resources_by_vm']['vm3']['cpus'] == 4
+    if 'disks' in gather:
+        assert [disk['thin'] for disk in res['disks_by_vm']['vm3']] == [True, False]
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+'''
+.vmx editor: escaping, unchanged files rendered byte for byte (LF and CRLF),
+operations, module failure on non-UTF-8 file
+'''
+
+import pytest
+
+from conftest import library_module, run_module
+from esxi_vmx import VmxConfig, apply_operations, escape, unescape
+
+VMX = ('.encoding = "UTF-8"\n'
+       '# comment\n'
+       'displayName = "phoenix11"\n'
+       'annotation = "test|0Aserver |22one|22 |7C"\n'
+       '\n'
+       'scsi0:0.fileName = "phoenix11.vmdk"\n'
+       'ethernet0.networkName   =   "adm-srv"\n')
+
+
+def test_escape():
+    assert unescape('test|0Aserver |22one|22 |7C') == 'test\nserver "one" |'
+    assert escape('test\nserver "one" |') == 'test|0Aserver |22one|22 |7C'
+    # codes of non-ascii chars are bytes of UTF-8 sequence
+    assert unescape(u'|D0|A1|D0|B5|D1|80|D0|B2|D0|B5|D1|80|0A два') == u'Сервер\n два'
+
+
+@pytest.mark.parametrize('newline', ['\n', '\r\n'])
+def test_unchanged(newline):
+    text = VMX.replace('\n', newline)
+    vmx = VmxConfig(text)
+    assert vmx.get('DISPLAYNAME') == 'phoenix11'
+    assert vmx.get('annotation') == 'test\nserver "one" |'
+    assert vmx.get('ethernet0.networkName') == 'adm-srv'
+    assert apply_operations(vmx, [{'set': {'displayName': 'phoenix11'}}]) == []
+    assert vmx.render() == text
+    assert VmxConfig(text.rstrip()).render() == text.rstrip()
+
+
+@pytest.mark.parametrize('newline', ['\n', '\r\n'])
+def test_operations(newline):
+    vmx = VmxConfig(VMX.replace('\n', newline))
+    changed = apply_operations(vmx, [
+        {'rename_prefix': {'phoenix11': 'phoenix12'}},
+        {'remove': 'ethernet0.*'},
+        {'set': {'annotation': 'new "one"', 'uuid.bios': None}, 'skip_empty': True},
+    ])
+    assert changed == ['displayName', 'scsi0:0.fileName', 'ethernet0.networkName', 'annotation']
+    assert vmx.render() == ('.encoding = "UTF-8"\n'
+                            '# comment\n'
+                            'displayName = "phoenix12"\n'
+                            'annotation = "new |22one|22"\n'
+                            '\n'
+                            'scsi0:0.fileName = "phoenix12.vmdk"\n').replace('\n', newline)
+
+
+def test_empty():
+    vmx = VmxConfig('')
+    assert vmx.keys() == []
+    assert vmx.render() == '\n'
+
+
+def test_not_utf8(tmp_path, capsys):
+    esxi_vmx = library_module('esxi_vmx')
+    path = tmp_path / 'old.vmx'
+    path.write_bytes(b'.encoding = "windows-1252"\nannotation = "caf\xe9"\n')
+    res = run_module(esxi_vmx, {'path': str(path), 'set': {'displayName': 'x'}}, capsys)
+    assert res['failed']
+    assert res['msg'].startswith('unable to read %s as UTF-8' % path)